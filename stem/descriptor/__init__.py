@@ -37,8 +37,16 @@ Package for parsing and processing descriptor data.
 """
 
 __all__ = [
+  "cache",
   "export",
   "reader",
+  "serialization",
+  "store",
+  "diff",
+  "verification",
+  "dedup",
+  "join",
+  "filters",
   "extrainfo_descriptor",
   "server_descriptor",
   "microdescriptor",
@@ -48,6 +56,8 @@ __all__ = [
   "Descriptor",
 ]
 
+import collections
+import io
 import os
 import re
 
@@ -64,17 +74,55 @@ except ImportError:
 KEYWORD_CHAR = "a-zA-Z0-9-"
 WHITESPACE = " \t"
 KEYWORD_LINE = re.compile("^([%s]+)(?:[%s]+(.*))?$" % (KEYWORD_CHAR, WHITESPACE))
+KEYWORD_LINE_BYTES = re.compile(stem.util.str_tools._to_bytes("^([%s]+)(?:[%s]+(.*))?$" % (KEYWORD_CHAR, WHITESPACE)))
 PGP_BLOCK_START = re.compile("^-----BEGIN ([%s%s]+)-----$" % (KEYWORD_CHAR, WHITESPACE))
 PGP_BLOCK_END = "-----END %s-----"
 
+# patterns for _get_bytes_field(), by their keyword
+
+_BYTES_FIELD_PATTERNS = {}
+
 DocumentHandler = stem.util.enum.UppercaseEnum(
   "ENTRIES",
   "DOCUMENT",
   "BARE_DOCUMENT",
 )
 
-
-def parse_file(descriptor_file, descriptor_type = None, validate = True, document_handler = DocumentHandler.ENTRIES):
+# Descriptor types found in tor's data directory. These are the same as their
+# metrics counterparts, just without the @type annotation. Files ending with
+# '.new' are journals that tor appends newly fetched descriptors to.
+
+DATA_DIRECTORY_TYPES = {
+  "cached-descriptors": ("server-descriptor", 1, 0),
+  "cached-descriptors.new": ("server-descriptor", 1, 0),
+  "cached-extrainfo": ("extra-info", 1, 0),
+  "cached-extrainfo.new": ("extra-info", 1, 0),
+  "cached-microdescs": ("microdescriptor", 1, 0),
+  "cached-microdescs.new": ("microdescriptor", 1, 0),
+  "cached-consensus": ("network-status-consensus-3", 1, 0),
+  "cached-microdesc-consensus": ("network-status-microdesc-consensus-3", 1, 0),
+}
+
+# Descriptor types that consist of a series of independent descriptors, mapped
+# to the keyword that each of them begins with. Files of these types can be
+# divided up and parsed by multiple processes.
+
+SPLITTABLE_TYPES = {
+  "server-descriptor": b"router ",
+  "bridge-server-descriptor": b"router ",
+  "extra-info": b"extra-info ",
+  "bridge-extra-info": b"extra-info ",
+  "microdescriptor": b"onion-key",
+}
+
+# Amount of content we hand to a worker process at a time, and the number of
+# those chunks each worker can have queued up.
+
+WORKER_CHUNK_SIZE = 1048576
+WORKER_QUEUE_SIZE = 2
+
+
+def parse_file(descriptor_file, descriptor_type = None, validate = True, document_handler = DocumentHandler.ENTRIES, workers = None, ordered = True, cache = None, seen = None, descriptor_filter = None):
   """
   Simple function to read the descriptor contents from a file, providing an
   iterator for its :class:`~stem.descriptor.__init__.Descriptor` contents.
@@ -125,12 +173,51 @@ def parse_file(descriptor_file, descriptor_type = None, validate = True, documen
 
     my_descriptor_file = open(descriptor_path, 'rb')
 
+  Files with a series of server descriptors, extra-info descriptors, or
+  microdescriptors (such as tor's 'cached-descriptors') can be parsed by
+  several processes at once by providing a **workers** count. The file is
+  divided at descriptor boundaries, and each chunk is parsed and validated by a
+  :class:`multiprocessing.Pool` worker. Other descriptor types are read as
+  usual. Like anything else that uses :mod:`multiprocessing`, on Windows this
+  should only be called from within an **if __name__ == '__main__'** block.
+
+  ::
+
+    for desc in parse_file('/home/atagar/.tor/cached-descriptors', workers = 4):
+      print desc.nickname
+
+  If you parse the same files repeatedly then providing a
+  :class:`~stem.descriptor.cache.DescriptorCache` lets us load the descriptors
+  we parsed last time rather than parsing them again. Files are only read from
+  the cache if their content is unchanged.
+
+  Descriptors that we've already read from other files can be skipped by
+  providing a :class:`~stem.descriptor.dedup.DigestSet`. Duplicate server
+  descriptors, extra-info descriptors, and microdescriptors are dropped
+  before they're parsed.
+
+  If you only want some of the descriptors then provide a
+  :class:`~stem.descriptor.filters.DescriptorFilter`. Its criteria are checked
+  against the file's name, type, and the content of each descriptor before
+  we parse it.
+
   :param str,file descriptor_file: path or opened file with the descriptor contents
   :param str descriptor_type: `descriptor type <https://metrics.torproject.org/formats.html#descriptortypes>`_, this is guessed if not provided
   :param bool validate: checks the validity of the descriptor's content if
     **True**, skips these checks otherwise
   :param stem.descriptor.__init__.DocumentHandler document_handler: method in
     which to parse :class:`~stem.descriptor.networkstatus.NetworkStatusDocument`
+  :param int workers: number of processes to parse the file with, if unset
+    then it's parsed by the calling process
+  :param bool ordered: provides descriptors in the order they appear in the
+    file if **True**, otherwise they're provided as soon as a worker has parsed
+    them (this only matters if we have **workers**)
+  :param stem.descriptor.cache.DescriptorCache cache: cache to load
+    previously parsed descriptors from, and save newly parsed ones to
+  :param stem.descriptor.dedup.DigestSet seen: digests of descriptors we've
+    already read, these are skipped and the rest are added to it
+  :param stem.descriptor.filters.DescriptorFilter descriptor_filter: criteria
+    for the descriptors that we want, others are skipped
 
   :returns: iterator for :class:`~stem.descriptor.__init__.Descriptor` instances in the file
 
@@ -139,18 +226,18 @@ def parse_file(descriptor_file, descriptor_type = None, validate = True, documen
     * **IOError** if unable to read from the descriptor_file
   """
 
-  # if we got a path then open that file for parsing
+  # if we got a path then open that file for parsing, our parsers (and
+  # splitting files for workers) expect bytes
 
   if isinstance(descriptor_file, (bytes, unicode)):
-    with open(descriptor_file) as desc_file:
-      for desc in parse_file(desc_file, descriptor_type, validate, document_handler):
+    with open(descriptor_file, 'rb') as desc_file:
+      for desc in parse_file(desc_file, descriptor_type, validate, document_handler, workers, ordered, cache, seen, descriptor_filter):
         yield desc
 
       return
 
-  import stem.descriptor.server_descriptor
-  import stem.descriptor.extrainfo_descriptor
-  import stem.descriptor.networkstatus
+  if descriptor_filter is not None and not descriptor_filter.accepts_path(getattr(descriptor_file, 'name', None)):
+    return
 
   # The tor descriptor specifications do not provide a reliable method for
   # identifying a descriptor file's type and version so we need to guess
@@ -167,37 +254,88 @@ def parse_file(descriptor_file, descriptor_type = None, validate = True, documen
 
   descriptor_path = getattr(descriptor_file, 'name', None)
   filename = '<undefined>' if descriptor_path is None else os.path.basename(descriptor_file.name)
-  file_parser = None
+  file_type = None
 
   if descriptor_type is not None:
     descriptor_type_match = re.match("^(\S+) (\d+).(\d+)$", descriptor_type)
 
     if descriptor_type_match:
       desc_type, major_version, minor_version = descriptor_type_match.groups()
-      file_parser = lambda f: _parse_metrics_file(desc_type, int(major_version), int(minor_version), f, validate, document_handler)
+      file_type = (desc_type, int(major_version), int(minor_version))
     else:
       raise ValueError("The descriptor_type must be of the form '<type> <major_version>.<minor_version>'")
   elif metrics_header_match:
     # Metrics descriptor handling
 
     desc_type, major_version, minor_version = metrics_header_match.groups()
-    file_parser = lambda f: _parse_metrics_file(desc_type, int(major_version), int(minor_version), f, validate, document_handler)
+    file_type = (desc_type, int(major_version), int(minor_version))
   else:
     # Cached descriptor handling. These contain multiple descriptors per file.
 
-    if filename == "cached-descriptors":
-      file_parser = lambda f: stem.descriptor.server_descriptor._parse_file(f, validate = validate)
-    elif filename == "cached-extrainfo":
-      file_parser = lambda f: stem.descriptor.extrainfo_descriptor._parse_file(f, validate = validate)
-    elif filename == "cached-microdescs":
-      file_parser = lambda f: stem.descriptor.microdescriptor._parse_file(f, validate = validate)
-    elif filename == "cached-consensus":
-      file_parser = lambda f: stem.descriptor.networkstatus._parse_file(f, validate = validate, document_handler = document_handler)
-    elif filename == "cached-microdesc-consensus":
-      file_parser = lambda f: stem.descriptor.networkstatus._parse_file(f, is_microdescriptor = True, validate = validate, document_handler = document_handler)
-
-  if file_parser:
-    for desc in file_parser(descriptor_file):
+    file_type = DATA_DIRECTORY_TYPES.get(filename)
+
+  if file_type:
+    desc_type, major_version, minor_version = file_type
+    parser_args = (desc_type, major_version, minor_version, validate, document_handler)
+
+    if descriptor_filter is not None and not descriptor_filter.accepts_type(desc_type):
+      return
+
+    if cache is not None:
+      # cached descriptors are unfiltered, so checking them as they're loaded
+
+      desc_iterator = _parse_with_cache(descriptor_file, cache, "%s %i.%i" % file_type, validate, document_handler, workers, ordered)
+
+      if descriptor_filter is not None:
+        desc_iterator = _filter_accepted(desc_iterator, descriptor_filter)
+
+      if seen is not None:
+        desc_iterator = _filter_seen(desc_iterator, seen)
+    elif (seen is not None or descriptor_filter is not None) and desc_type in SPLITTABLE_TYPES:
+      # drop the descriptors we don't want or have already seen before
+      # parsing them
+
+      from stem.descriptor import dedup, filters
+
+      keyword = SPLITTABLE_TYPES[desc_type]
+      chunks = _split_descriptor_file(descriptor_file, keyword)
+
+      if workers and workers > 1:
+        if descriptor_filter is not None:
+          chunks = filters._filter_chunks(chunks, keyword, descriptor_filter)
+
+        if seen is not None:
+          chunks = dedup._filter_chunks(chunks, keyword, seen)
+
+        desc_iterator = _parse_with_workers(chunks, parser_args, workers, ordered)
+      else:
+        if descriptor_filter is not None:
+          chunks = filters._filter_descriptors(chunks, keyword, descriptor_filter)
+
+        if seen is not None:
+          chunks = dedup._filter_descriptors(chunks, keyword, seen)
+
+        desc_iterator = _parse_chunks(chunks, parser_args)
+
+      if descriptor_filter is not None:
+        desc_iterator = _filter_accepted(desc_iterator, descriptor_filter)
+
+      if seen is not None:
+        desc_iterator = _filter_seen(desc_iterator, seen)
+    elif workers and workers > 1 and desc_type in SPLITTABLE_TYPES:
+      chunks = _split_descriptor_file(descriptor_file, SPLITTABLE_TYPES[desc_type])
+      desc_iterator = _parse_with_workers(chunks, parser_args, workers, ordered)
+    else:
+      entry_filter = descriptor_filter.accepts_content if descriptor_filter is not None else None
+      desc_iterator = _parse_metrics_file(desc_type, major_version, minor_version, descriptor_file, validate, document_handler, entry_filter)
+
+      if descriptor_filter is not None:
+        desc_iterator = _filter_accepted(desc_iterator, descriptor_filter)
+
+      if seen is not None:
+        desc_iterator = _filter_seen(desc_iterator, seen)
+
+    for desc in desc_iterator:
       if descriptor_path is not None:
         desc._set_path(os.path.abspath(descriptor_path))
 
@@ -210,11 +348,234 @@ def parse_file(descriptor_file, descriptor_type = None, validate = True, documen
   raise TypeError("Unable to determine the descriptor's type. filename: '%s', first line: '%s'" % (filename, first_line))
 
 
-def _parse_metrics_file(descriptor_type, major_version, minor_version, descriptor_file, validate, document_handler):
+def _parse_with_cache(descriptor_file, cache, descriptor_type, validate, document_handler, workers, ordered):
+  """
+  Provides descriptors from our cache if we've parsed this content before, and
+  otherwise parses the file and caches its descriptors.
+
+  :param file descriptor_file: file with the descriptor contents
+  :param stem.descriptor.cache.DescriptorCache cache: cache for our descriptors
+
+  :returns: iterator for the :class:`~stem.descriptor.__init__.Descriptor`
+    instances in the file
+  """
+
+  descriptor_path = getattr(descriptor_file, 'name', None)
+  last_modified = None
+
+  if descriptor_path is not None and os.path.isfile(descriptor_path):
+    last_modified = int(os.stat(descriptor_path).st_mtime)
+
+  initial_position = descriptor_file.tell()
+  content = descriptor_file.read()
+  descriptor_file.seek(initial_position)
+
+  settings = (descriptor_type, validate, document_handler)
+  key = cache.get_key(descriptor_path, content, last_modified = last_modified, settings = settings)
+  descriptors = cache.get(key)
+
+  if descriptors is not None:
+    for desc in descriptors:
+      yield desc
+  else:
+    descriptors = []
+
+    for desc in parse_file(descriptor_file, descriptor_type, validate, document_handler, workers, ordered):
+      descriptors.append(desc)
+      yield desc
+
+    cache.put(key, descriptors)
+
+
+def _filter_accepted(descriptors, descriptor_filter):
+  """
+  Drops the parsed descriptors that a filter doesn't accept.
+
+  :param iterator descriptors: descriptors to be filtered
+  :param stem.descriptor.filters.DescriptorFilter descriptor_filter: criteria
+    for the descriptors that we want
+
+  :returns: iterator for the descriptors that we want
+  """
+
+  for desc in descriptors:
+    if descriptor_filter.accepts(desc):
+      yield desc
+
+
+def _filter_seen(descriptors, seen):
+  """
+  Drops the descriptors we've already seen.
+
+  :param iterator descriptors: descriptors to be filtered
+  :param stem.descriptor.dedup.DigestSet seen: digests of the descriptors
+    we've already seen, the new ones are added to it
+
+  :returns: iterator for the descriptors that we haven't seen
+  """
+
+  import stem.descriptor.dedup
+
+  for desc in descriptors:
+    if seen.add(stem.descriptor.dedup.get_digest(desc.get_bytes())):
+      yield desc
+
+
+def _split_descriptor_file(descriptor_file, keyword, chunk_size = WORKER_CHUNK_SIZE):
+  """
+  Divides a file with a series of descriptors into chunks of roughly the given
+  size. Chunks are only broken at the start of a descriptor, so each is a
+  valid file of that descriptor type. Any annotations (lines starting with an
+  '@') are kept with the descriptor that follows them.
+
+  This only checks the start of lines so it's far cheaper than actually
+  parsing the content.
+
+  :param file descriptor_file: file with descriptor content
+  :param bytes keyword: keyword that descriptors begin with
+  :param int chunk_size: amount of content to read at a time
+
+  :returns: iterator for **bytes** with a series of descriptors
+  """
+
+  remainder = b""
+
+  while True:
+    content = descriptor_file.read(chunk_size)
+
+    if not content:
+      if remainder:
+        yield remainder
+
+      break
+
+    content = remainder + content
+    boundary = _get_last_descriptor_start(content, keyword)
+
+    if boundary > 0:
+      yield content[:boundary]
+      remainder = content[boundary:]
+    else:
+      remainder = content  # descriptor is larger than our chunk_size
+
+
+def _get_last_descriptor_start(content, keyword):
+  """
+  Provides where the last descriptor within a series of them begins. This is
+  the last line starting with our keyword, along with any annotations
+  immediately preceding it.
+
+  :param bytes content: series of descriptors
+  :param bytes keyword: keyword that descriptors begin with
+
+  :returns: **int** index that the last descriptor starts at, zero if the
+    content has a single descriptor
+  """
+
+  boundary = content.rfind(b"\n" + keyword) + 1
+
+  while boundary > 0:
+    line_start = content.rfind(b"\n", 0, boundary - 1) + 1
+
+    if content[line_start:line_start + 1] != b"@":
+      break
+
+    boundary = line_start
+
+  return boundary
+
+
+def _parse_with_workers(chunks, parser_args, workers, ordered, parser = None):
+  """
+  Parses chunks of a descriptor file with a pool of processes. We only read
+  a few chunks ahead of our caller so memory usage is bounded.
+
+  :param iterator chunks: series of **bytes** with the descriptors to be parsed
+  :param tuple parser_args: type, major and minor version, validate flag, and
+    document handler for :func:`~stem.descriptor.__init__._parse_metrics_file`
+  :param int workers: number of processes to parse with
+  :param bool ordered: provides descriptors in the order of the chunks if
+    **True**, otherwise as soon as a chunk is parsed
+  :param function parser: module level function that's called with a chunk
+    and the parser_args, providing a list of descriptors (this is
+    :func:`~stem.descriptor.__init__._parse_chunk` by default)
+
+  :returns: iterator for the :class:`~stem.descriptor.__init__.Descriptor`
+    instances in the chunks
+  """
+
+  import multiprocessing
+
+  if parser is None:
+    parser = _parse_chunk
+
+  pool = multiprocessing.Pool(workers)
+  pending = collections.deque()
+
+  try:
+    for chunk in chunks:
+      pending.append(pool.apply_async(parser, (chunk,) + parser_args))
+
+      if len(pending) >= workers * WORKER_QUEUE_SIZE:
+        for desc in _pop_parsed_chunk(pending, ordered):
+          yield desc
+
+    while pending:
+      for desc in _pop_parsed_chunk(pending, ordered):
+        yield desc
+
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def _pop_parsed_chunk(pending, ordered):
+  """
+  Provides the descriptors for a chunk we've given to our workers. When we're
+  unordered this is the first that's finished, or the oldest if none are done
+  yet.
+
+  :param collections.deque pending: **AsyncResult** instances for our chunks
+  :param bool ordered: provides the oldest chunk if **True**
+
+  :returns: **list** of descriptors parsed from the chunk
+
+  :raises: any exception that was raised when parsing the chunk
+  """
+
+  if not ordered:
+    for result in pending:
+      if result.ready():
+        pending.remove(result)
+        return result.get()
+
+  return pending.popleft().get()
+
+
+def _parse_chunks(chunks, parser_args):
+  # Parses chunks of descriptor content within our own process.
+
+  for chunk in chunks:
+    for desc in _parse_chunk(chunk, *parser_args):
+      yield desc
+
+
+def _parse_chunk(content, descriptor_type, major_version, minor_version, validate, document_handler):
+  # Runs within our worker processes, parsing a chunk of descriptor content.
+
+  descriptor_file = io.BytesIO(content)
+  return list(_parse_metrics_file(descriptor_type, major_version, minor_version, descriptor_file, validate, document_handler))
+
+
+def _parse_metrics_file(descriptor_type, major_version, minor_version, descriptor_file, validate, document_handler, entry_filter = None):
   # Parses descriptor files from metrics, yielding individual descriptors. This
-  # throws a TypeError if the descriptor_type or version isn't recognized.
+  # throws a TypeError if the descriptor_type or version isn't recognized. The
+  # entry_filter is checked against the content of router status entries
+  # before they're parsed.
   import stem.descriptor.server_descriptor
   import stem.descriptor.extrainfo_descriptor
+  import stem.descriptor.microdescriptor
   import stem.descriptor.networkstatus
 
   if descriptor_type == "server-descriptor" and major_version == 1:
@@ -238,24 +599,24 @@ def _parse_metrics_file(descriptor_type, major_version, minor_version, descripto
   elif descriptor_type == "network-status-2" and major_version == 1:
     document_type = stem.descriptor.networkstatus.NetworkStatusDocumentV2
 
-    for desc in stem.descriptor.networkstatus._parse_file(descriptor_file, document_type, validate = validate, document_handler = document_handler):
+    for desc in stem.descriptor.networkstatus._parse_file(descriptor_file, document_type, validate = validate, document_handler = document_handler, entry_filter = entry_filter):
       yield desc
   elif descriptor_type == "dir-key-certificate-3" and major_version == 1:
     yield stem.descriptor.networkstatus.KeyCertificate(descriptor_file.read(), validate = validate)
   elif descriptor_type in ("network-status-consensus-3", "network-status-vote-3") and major_version == 1:
     document_type = stem.descriptor.networkstatus.NetworkStatusDocumentV3
 
-    for desc in stem.descriptor.networkstatus._parse_file(descriptor_file, document_type, validate = validate, document_handler = document_handler):
+    for desc in stem.descriptor.networkstatus._parse_file(descriptor_file, document_type, validate = validate, document_handler = document_handler, entry_filter = entry_filter):
       yield desc
   elif descriptor_type == "network-status-microdesc-consensus-3" and major_version == 1:
     document_type = stem.descriptor.networkstatus.NetworkStatusDocumentV3
 
-    for desc in stem.descriptor.networkstatus._parse_file(descriptor_file, document_type, is_microdescriptor = True, validate = validate, document_handler = document_handler):
+    for desc in stem.descriptor.networkstatus._parse_file(descriptor_file, document_type, is_microdescriptor = True, validate = validate, document_handler = document_handler, entry_filter = entry_filter):
       yield desc
   elif descriptor_type == "bridge-network-status" and major_version == 1:
     document_type = stem.descriptor.networkstatus.BridgeNetworkStatusDocument
 
-    for desc in stem.descriptor.networkstatus._parse_file(descriptor_file, document_type, validate = validate, document_handler = document_handler):
+    for desc in stem.descriptor.networkstatus._parse_file(descriptor_file, document_type, validate = validate, document_handler = document_handler, entry_filter = entry_filter):
       yield desc
   else:
     raise TypeError("Unrecognized metrics descriptor format. type: '%s', version: '%i.%i'" % (descriptor_type, major_version, minor_version))
@@ -314,6 +675,42 @@ class Descriptor(object):
 
     raise NotImplementedError
 
+  def to_bytes(self):
+    """
+    Provides a compact binary representation of this descriptor, which can be
+    loaded far faster than parsing the descriptor again. See
+    :mod:`stem.descriptor.serialization` for the format.
+
+    :returns: **bytes** with the binary representation of this descriptor
+
+    :raises: **ValueError** if this type of descriptor can't be serialized
+    """
+
+    import stem.descriptor.serialization
+    return stem.descriptor.serialization.serialize(self)
+
+  @classmethod
+  def from_bytes(cls, content):
+    """
+    Provides the descriptor for a binary representation from
+    :func:`~stem.descriptor.__init__.Descriptor.to_bytes`.
+
+    :param bytes content: binary representation of a descriptor
+
+    :returns: :class:`~stem.descriptor.__init__.Descriptor` for the content
+
+    :raises: **ValueError** if the content is malformed or isn't an instance
+      of this class
+    """
+
+    import stem.descriptor.serialization
+    desc = stem.descriptor.serialization.deserialize(content)
+
+    if not isinstance(desc, cls):
+      raise ValueError("Serialized descriptor is a %s rather than a %s" % (type(desc).__name__, cls.__name__))
+
+    return desc
+
   def _set_path(self, path):
     self._path = path
 
@@ -345,7 +742,13 @@ def _get_bytes_field(keyword, content):
   if not isinstance(content, bytes):
     raise ValueError("Content must be bytes, got a %s" % type(content))
 
-  line_match = re.search(stem.util.str_tools._to_bytes("^(opt )?%s(?:[%s]+(.*))?$" % (keyword, WHITESPACE)), content, re.MULTILINE)
+  pattern = _BYTES_FIELD_PATTERNS.get(keyword)
+
+  if pattern is None:
+    pattern = re.compile(stem.util.str_tools._to_bytes("^(opt )?%s(?:[%s]+(.*))?$" % (keyword, WHITESPACE)), re.MULTILINE)
+    _BYTES_FIELD_PATTERNS[keyword] = pattern
+
+  line_match = pattern.search(content)
 
   if line_match:
     value = line_match.groups()[1]
@@ -354,6 +757,37 @@ def _get_bytes_field(keyword, content):
     return None
 
 
+def _get_bytes_value(keyword, entries, content):
+  """
+  Provides the bytes of a value from
+  :func:`~stem.descriptor.__init__._get_descriptor_components`. This is the
+  same as :func:`~stem.descriptor.__init__._get_bytes_field`, but only
+  searches the raw content if decoding it replaced any of the value's bytes.
+
+  :param str keyword: line to look up
+  :param dict entries: keyword => (value, pgp key) mappings of the decoded
+    content
+  :param bytes content: content that was decoded
+
+  :returns: **bytes** value of the first line with the given keyword, **None**
+    if the line doesn't exist
+
+  :raises: **ValueError** if the content isn't bytes
+  """
+
+  if not isinstance(content, bytes):
+    raise ValueError("Content must be bytes, got a %s" % type(content))
+  elif keyword not in entries:
+    return None
+
+  value = entries[keyword][0][0]
+
+  if u"\ufffd" in value:
+    return _get_bytes_field(keyword, content)
+  else:
+    return value.encode("utf-8")
+
+
 def _read_until_keywords(keywords, descriptor_file, inclusive = False, ignore_first = False, skip = False, end_position = None, include_ending_keyword = False):
   """
   Reads from the descriptor file until we get to one of the given keywords or reach the
@@ -377,14 +811,26 @@ def _read_until_keywords(keywords, descriptor_file, inclusive = False, ignore_fi
   if isinstance(keywords, (bytes, unicode)):
     keywords = (keywords,)
 
+  # Lines are matched as bytes so we don't need to decode them. This maps the
+  # keywords as bytes to how they were given to us.
+
+  keywords = dict([(stem.util.str_tools._to_bytes(keyword), keyword) for keyword in keywords])
+
   if ignore_first:
     first_line = descriptor_file.readline()
 
     if content is not None and first_line is not None:
       content.append(first_line)
 
+  # Files are usually read in binary mode, so rather than calling tell() for
+  # each line we can count how far we've read. Text mode files (as parse_file()
+  # opens paths in python 3) are measured in characters, so for those we need
+  # to ask.
+
+  position = descriptor_file.tell()
+
   while True:
-    last_position = descriptor_file.tell()
+    last_position = position
 
     if end_position and last_position >= end_position:
       break
@@ -394,16 +840,23 @@ def _read_until_keywords(keywords, descriptor_file, inclusive = False, ignore_fi
     if not line:
       break  # EOF
 
-    line_match = KEYWORD_LINE.match(stem.util.str_tools._to_unicode(line))
+    if isinstance(line, bytes):
+      position += len(line)
+      line_bytes = line
+    else:
+      position = descriptor_file.tell()
+      line_bytes = stem.util.str_tools._to_bytes(line)
+
+    line_match = KEYWORD_LINE_BYTES.match(line_bytes)
 
     if not line_match:
       # no spaces or tabs in the line
-      line_keyword = stem.util.str_tools._to_unicode(line.strip())
+      line_keyword = line_bytes.strip()
     else:
-      line_keyword = line_match.groups()[0]
+      line_keyword = line_match.group(1)
 
     if line_keyword in keywords:
-      ending_keyword = line_keyword
+      ending_keyword = keywords[line_keyword]
 
       if not inclusive:
         descriptor_file.seek(last_position)
@@ -0,0 +1,280 @@
+# Copyright 2013, Damian Johnson
+# See LICENSE for licensing information
+
+"""
+On-disk cache of parsed descriptors. Parsing and validating descriptors is far
+more expensive than reading them, so when the same files are processed again
+and again (for instance archives from `CollecTor
+<https://collector.torproject.org/>`_) we can instead load the descriptors we
+parsed last time.
+
+Cached entries are keyed on the identity of the file they came from (its path,
+archive member, size, and last modified timestamp) along with a hash of its
+content, so changed files are never provided stale results. The cache is
+limited in size, evicting the least recently used entries when we exceed it.
+
+Entries are stored with :mod:`~stem.descriptor.serialization`, so only the
+descriptor types it supports are cached and, like that module, references to
+other descriptors (such as the document of a router status entry) are not
+retained.
+
+::
+
+  from stem.descriptor import parse_file
+  from stem.descriptor.cache import DescriptorCache
+  from stem.descriptor.reader import DescriptorReader
+
+  cache = DescriptorCache("/tmp/descriptor_cache", max_size = 1073741824)
+
+  for desc in parse_file("/tmp/cached-descriptors", cache = cache):
+    print desc.nickname
+
+  with DescriptorReader(["/tmp/archives"], cache = cache) as reader:
+    for desc in reader:
+      print desc
+
+**Module Overview:**
+
+::
+
+  DescriptorCache - Size limited on-disk cache of parsed descriptors
+    |- get_key - provides the cache key for some descriptor content
+    |- get - provides the cached descriptors for a key
+    |- put - caches descriptors under a key
+    |- get_size - bytes used by the cache
+    +- clear - removes all cached descriptors
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+import stem.descriptor.serialization
+import stem.util.str_tools
+
+try:
+  # added in python 2.7
+  from collections import OrderedDict
+except ImportError:
+  from stem.util.ordereddict import OrderedDict
+
+DEFAULT_MAX_SIZE = 536870912  # 512 MB
+
+# Identifier for how cached entries are formatted. If the way we persist
+# descriptors changes then this should be incremented so older entries are no
+# longer used.
+
+CACHE_VERSION = 2
+
+
+class DescriptorCache(object):
+  """
+  Size limited on-disk cache of parsed descriptors. Each entry is a file
+  within our cache directory, and when our total size exceeds **max_size** we
+  evict the least recently used.
+
+  This can be used from multiple threads. Multiple processes can also share
+  the directory since entries are written atomically, though each process
+  enforces the size limit on its own.
+
+  :param str path: directory where cached descriptors are stored, this is
+    created if it doesn't already exist
+  :param int max_size: maximum number of bytes the cache may use, this is
+    unbounded if zero
+
+  :raises: **IOError** if our cache directory can't be created
+  """
+
+  def __init__(self, path, max_size = DEFAULT_MAX_SIZE):
+    self.path = os.path.abspath(path)
+    self.max_size = max_size
+
+    self._lock = threading.RLock()
+    self._size = 0
+
+    # mapping of our keys to their size, ordered from least to most recently used
+
+    self._entries = OrderedDict()
+
+    try:
+      if not os.path.exists(self.path):
+        os.makedirs(self.path)
+
+      entries = []
+
+      for filename in os.listdir(self.path):
+        if filename.endswith(".tmp"):
+          # Left behind by a process that didn't finish writing an entry. If
+          # another process is still writing it then its rename fails, and
+          # it doesn't cache that entry.
+
+          try:
+            os.remove(os.path.join(self.path, filename))
+          except OSError:
+            pass
+
+          continue
+        elif not filename.endswith(".cache"):
+          continue
+
+        entry_stat = os.stat(os.path.join(self.path, filename))
+        entries.append((entry_stat.st_mtime, filename[:-6], entry_stat.st_size))
+    except OSError as exc:
+      raise IOError(exc)
+
+    for _, key, size in sorted(entries):
+      self._entries[key] = size
+      self._size += size
+
+    self._evict()
+
+  def get_key(self, path, content, archive_path = None, last_modified = None, settings = ()):
+    """
+    Provides the key that descriptor content is cached under.
+
+    :param str path: file that the descriptors came from (or archive that
+      contains them), this can be **None** if it's not from a file
+    :param bytes content: content that the descriptors are parsed from
+    :param str archive_path: member of the archive that the descriptors came from
+    :param int last_modified: unix timestamp for when the file was last modified
+    :param tuple settings: any other parameters that influence how the
+      descriptors are parsed, such as if they are validated
+
+    :returns: **str** with the key for this content
+    """
+
+    if path is not None:
+      path = os.path.abspath(path)
+
+    identity = (CACHE_VERSION, path, archive_path, len(content), last_modified, hashlib.sha1(content).hexdigest(), settings)
+    return hashlib.sha1(stem.util.str_tools._to_bytes(repr(identity))).hexdigest()
+
+  def get(self, key):
+    """
+    Provides the descriptors that were cached under the given key.
+
+    :param str key: key provided by
+      :func:`~stem.descriptor.cache.DescriptorCache.get_key`
+
+    :returns: **list** of cached descriptors, **None** if we don't have them
+    """
+
+    with self._lock:
+      if not key in self._entries:
+        return None
+
+      entry_path = self._entry_path(key)
+
+      try:
+        with open(entry_path, 'rb') as entry_file:
+          descriptors = list(stem.descriptor.serialization.read_descriptors(entry_file))
+
+        os.utime(entry_path, None)
+      except (IOError, OSError, ValueError):
+        # entry is missing or malformed (maybe another process evicted it)
+
+        self._remove(key)
+        return None
+
+      self._entries[key] = self._entries.pop(key)
+      return descriptors
+
+  def put(self, key, descriptors):
+    """
+    Caches the given descriptors, evicting older entries if this puts us over
+    our size limit.
+
+    :param str key: key provided by
+      :func:`~stem.descriptor.cache.DescriptorCache.get_key`
+    :param list descriptors: descriptors to be cached
+
+    :returns: **True** if the descriptors were cached, **False** otherwise
+      (such as if they're a type we can't serialize)
+    """
+
+    entry_content = io.BytesIO()
+
+    try:
+      stem.descriptor.serialization.write_descriptors(entry_content, descriptors)
+    except ValueError:
+      return False
+
+    content = entry_content.getvalue()
+
+    if self.max_size and len(content) > self.max_size:
+      return False
+
+    with self._lock:
+      tmp_path = None
+
+      try:
+        # writing to a temporary file first so other readers never see a
+        # partially written entry
+
+        entry_fd, tmp_path = tempfile.mkstemp(dir = self.path, suffix = ".tmp")
+
+        with os.fdopen(entry_fd, 'wb') as entry_file:
+          entry_file.write(content)
+
+        os.rename(tmp_path, self._entry_path(key))
+      except (IOError, OSError):
+        if tmp_path:
+          try:
+            os.remove(tmp_path)
+          except OSError:
+            pass
+
+        return False
+
+      if key in self._entries:
+        self._size -= self._entries.pop(key)
+
+      self._entries[key] = len(content)
+      self._size += len(content)
+      self._evict()
+
+      return True
+
+  def get_size(self):
+    """
+    Provides the number of bytes that our cached descriptors are using.
+
+    :returns: **int** with the size of our cache
+    """
+
+    return self._size
+
+  def clear(self):
+    """
+    Removes all of our cached descriptors.
+    """
+
+    with self._lock:
+      for key in list(self._entries):
+        self._remove(key)
+
+  def _entry_path(self, key):
+    return os.path.join(self.path, key + ".cache")
+
+  def _evict(self):
+    # removes our least recently used entries until we're within our size limit
+
+    with self._lock:
+      while self.max_size and self._size > self.max_size:
+        self._remove(next(iter(self._entries)))
+
+  def _remove(self, key):
+    self._size -= self._entries.pop(key, 0)
+
+    try:
+      os.remove(self._entry_path(key))
+    except OSError:
+      pass
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, key):
+    return key in self._entries
@@ -0,0 +1,325 @@
+# Copyright 2013, Damian Johnson
+# See LICENSE for licensing information
+
+"""
+De-duplication of descriptors we've already seen. CollecTor archives, recent
+descriptor directories, and tor's cached files overlap heavily, so when
+reading all of them we encounter the same server descriptors and
+microdescriptors many times over.
+
+A :class:`~stem.descriptor.dedup.DigestSet` remembers the digest of each
+descriptor it's given. Membership is first checked against a bloom filter
+with a fixed size, so memory usage is bounded regardless of how many
+descriptors we've seen. Only digests the filter might already have are
+checked against the exact set, which is kept in a SQLite database. By
+providing a path the database persists between runs...
+
+::
+
+  from stem.descriptor.dedup import DigestSet
+  from stem.descriptor.reader import DescriptorReader
+
+  with DigestSet("/tmp/seen_descriptors.sqlite") as seen:
+    with DescriptorReader(["/tmp/archives", "/home/atagar/.tor"], seen = seen) as reader:
+      for desc in reader:
+        print desc  # only descriptors we haven't already provided
+
+Descriptors are identified by the SHA1 digest of their content, excluding
+annotations and surrounding whitespace. This matches the content that
+descriptor equality is based on, and is available for any type of descriptor
+before it's parsed. When files with a series of server descriptors,
+extra-info descriptors, or microdescriptors are read through
+:func:`~stem.descriptor.__init__.parse_file` the duplicates are dropped
+before they're parsed. Other descriptors, such as router status entries, are
+checked after they've been parsed. Either way descriptors are only added to
+our set once they've been parsed, so if one is malformed a later copy of it
+isn't dropped.
+
+**Module Overview:**
+
+::
+
+  get_digest - digest that identifies a descriptor's content
+
+  BloomFilter - Probabilistic set of digests
+    |- add - adds a digest to the filter
+    +- __contains__ - checks if the filter might have a digest
+
+  DigestSet - Set of digests with bounded memory usage
+    |- add - adds a digest, checking if it's new
+    |- __contains__ - checks if we have a digest
+    |- flush - writes pending digests to our database
+    +- close - writes pending digests and closes our database
+"""
+
+import hashlib
+import math
+import sqlite3
+import struct
+
+# Number of digests we insert with each executemany() call.
+
+DIGEST_BATCH_SIZE = 10000
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS digests (digest BLOB PRIMARY KEY)"
+
+
+def get_digest(content):
+  """
+  Provides the digest that identifies a descriptor's content. Annotations
+  (lines starting with an '@') and surrounding whitespace are excluded, so
+  this is the same for the content of a descriptor file and the parsed
+  descriptor.
+
+  :param bytes content: descriptor content
+
+  :returns: **bytes** with the SHA1 digest of the content
+  """
+
+  while content.startswith(b"@"):
+    line_end = content.find(b"\n")
+
+    if line_end == -1:
+      content = b""
+    else:
+      content = content[line_end + 1:]
+
+  return hashlib.sha1(content.strip()).digest()
+
+
+class BloomFilter(object):
+  """
+  Probabilistic set of digests. Checking membership might provide a false
+  positive, but never a false negative. The chance of a false positive is
+  roughly our error_rate until we've had more than our capacity of digests
+  added, after which it climbs.
+
+  Digests are expected to be uniformly distributed (such as the output of a
+  cryptographic hash), so rather than hashing them again we derive our bit
+  positions from the digest itself.
+
+  :param int capacity: number of digests we expect to add
+  :param float error_rate: chance of a false positive when we're at capacity
+
+  :var int size: number of bits in the filter
+  :var int hash_count: number of bits that are set for each digest
+  """
+
+  def __init__(self, capacity, error_rate = 0.001):
+    if capacity <= 0:
+      raise ValueError("Bloom filter capacity must be positive: %s" % capacity)
+    elif not 0 < error_rate < 1:
+      raise ValueError("Bloom filter error rate must be between zero and one: %s" % error_rate)
+
+    self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+    self.hash_count = max(1, int(round(float(self.size) / capacity * math.log(2))))
+    self._bits = bytearray((self.size + 7) // 8)
+
+  def add(self, digest):
+    """
+    Adds a digest to the filter.
+
+    :param bytes digest: digest to be added, this must be at least sixteen
+      bytes
+    """
+
+    bits = self._bits
+
+    for position in self._get_positions(digest):
+      bits[position >> 3] |= 1 << (position & 7)
+
+  def _get_positions(self, digest):
+    first, second = struct.unpack("!QQ", digest[:16])
+    size = self.size
+
+    for i in range(self.hash_count):
+      yield (first + i * second) % size
+
+  def __contains__(self, digest):
+    bits = self._bits
+
+    for position in self._get_positions(digest):
+      if not bits[position >> 3] & (1 << (position & 7)):
+        return False
+
+    return True
+
+
+class DigestSet(object):
+  """
+  Set of digests, with bounded memory usage. Digests are kept in a SQLite
+  database and a :class:`~stem.descriptor.dedup.BloomFilter`, so we only need
+  to query the database for digests that we might already have.
+
+  New digests are written to the database in batches. They're written when
+  we're closed, so this should be used as a context manager or have its
+  :func:`~stem.descriptor.dedup.DigestSet.close` method called when we're
+  done.
+
+  :param str path: location of the database, this is kept in memory if
+    **None**, and made if it doesn't already exist
+  :param int capacity: number of digests we expect to have, for sizing our
+    bloom filter
+  :param float error_rate: chance that we need to query the database for a
+    digest we don't have when at capacity
+
+  :raises: **IOError** if the database can't be opened
+  """
+
+  def __init__(self, path = None, capacity = 10000000, error_rate = 0.001):
+    self.path = path
+    self._bloom_filter = BloomFilter(capacity, error_rate)
+    self._pending = set()
+
+    try:
+      # our DescriptorReader uses this from its reader thread
+
+      self._connection = sqlite3.connect(path if path else ":memory:", check_same_thread = False)
+      self._connection.execute(SCHEMA)
+
+      for row in self._connection.execute("SELECT digest FROM digests"):
+        self._bloom_filter.add(bytes(row[0]))
+    except sqlite3.Error as exc:
+      raise IOError("Unable to open digest set at %s: %s" % (path, exc))
+
+  def add(self, digest):
+    """
+    Adds a digest, checking if we already had it.
+
+    :param bytes digest: digest to be added, such as one from
+      :func:`~stem.descriptor.dedup.get_digest`
+
+    :returns: **True** if the digest is new, **False** if we already had it
+
+    :raises: **IOError** if unable to write to the database
+    """
+
+    if digest in self:
+      return False
+
+    self._bloom_filter.add(digest)
+    self._pending.add(digest)
+
+    if len(self._pending) >= DIGEST_BATCH_SIZE:
+      self.flush()
+
+    return True
+
+  def flush(self):
+    """
+    Writes digests that we've been given to our database.
+
+    :raises: **IOError** if unable to write to the database
+    """
+
+    if not self._pending:
+      return
+
+    try:
+      with self._connection:
+        self._connection.executemany("INSERT OR IGNORE INTO digests (digest) VALUES (?)", [(sqlite3.Binary(digest),) for digest in self._pending])
+
+      self._pending = set()
+    except sqlite3.Error as exc:
+      raise IOError("Unable to add digests to %s: %s" % (self.path, exc))
+
+  def close(self):
+    """
+    Writes any pending digests and closes our database.
+
+    :raises: **IOError** if unable to write to the database
+    """
+
+    try:
+      self.flush()
+    finally:
+      self._connection.close()
+
+  def __contains__(self, digest):
+    if digest not in self._bloom_filter:
+      return False
+    elif digest in self._pending:
+      return True
+
+    query = "SELECT 1 FROM digests WHERE digest = ?"
+    return self._connection.execute(query, (sqlite3.Binary(digest),)).fetchone() is not None
+
+  def __len__(self):
+    return len(self._pending) + self._connection.execute("SELECT COUNT(*) FROM digests").fetchone()[0]
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exit_type, value, traceback):
+    self.close()
+
+
+def _filter_descriptors(chunks, keyword, seen):
+  """
+  Drops the descriptors we've already seen from chunks of a descriptor file,
+  such as those from :func:`~stem.descriptor.__init__._split_descriptor_file`.
+  This doesn't add to our digest set. That's left for once the descriptors
+  are parsed (see :func:`~stem.descriptor.__init__._filter_seen`), so ones
+  that fail to parse aren't regarded as seen.
+
+  :param iterator chunks: **bytes** with a series of descriptors, starting at
+    a descriptor boundary
+  :param bytes keyword: keyword that descriptors begin with
+  :param stem.descriptor.dedup.DigestSet seen: digests of the descriptors
+    we've already seen
+
+  :returns: iterator for **bytes** with each descriptor we haven't seen
+  """
+
+  for chunk in chunks:
+    for desc in _split_descriptors(chunk, keyword):
+      if get_digest(desc) not in seen:
+        yield desc
+
+
+def _filter_chunks(chunks, keyword, seen):
+  """
+  Drops the descriptors we've already seen from chunks of a descriptor file,
+  like :func:`~stem.descriptor.dedup._filter_descriptors` but keeping the
+  rest of each chunk together so it can be handed to a worker process.
+
+  :returns: iterator for **bytes** with the descriptors from each chunk that
+    we haven't seen
+  """
+
+  for chunk in chunks:
+    unseen = list(_filter_descriptors((chunk,), keyword, seen))
+
+    if unseen:
+      yield b"".join(unseen)
+
+
+def _split_descriptors(content, keyword):
+  # Divides content at the start of each descriptor, keeping annotations with
+  # the descriptor that follows them. This is the same division as
+  # _split_descriptor_file().
+
+  start, search_from = 0, 0
+
+  while True:
+    boundary = content.find(b"\n" + keyword, search_from) + 1
+
+    if boundary == 0:
+      break
+
+    search_from = boundary
+
+    while boundary > start:
+      line_start = content.rfind(b"\n", 0, boundary - 1) + 1
+
+      if content[line_start:line_start + 1] != b"@":
+        break
+
+      boundary = line_start
+
+    if boundary > start:
+      yield content[start:boundary]
+      start = boundary
+
+  if content[start:].strip():
+    yield content[start:]
@@ -0,0 +1,314 @@
+# Copyright 2013, Damian Johnson
+# See LICENSE for licensing information
+
+"""
+Differences between two v3 network status documents. Consecutive consensuses
+have most of their relays in common, so rather than parsing both in full and
+comparing every relay we walk their router status entries in fingerprint
+order, and only parse entries that aren't identical in both.
+
+::
+
+  from stem.descriptor.diff import Change, ConsensusPatch, diff_routers
+  from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+
+  with open('/tmp/consensus-old', 'rb') as old_file:
+    old = NetworkStatusDocumentV3(old_file.read(), lazy_routers = True)
+
+  with open('/tmp/consensus-new', 'rb') as new_file:
+    new = NetworkStatusDocumentV3(new_file.read(), lazy_routers = True)
+
+  for change in diff_routers(old, new):
+    if Change.FLAGS in change.changes:
+      print "%s gained %s and lost %s" % (change.fingerprint, change.added_flags, change.removed_flags)
+
+Documents can be either a
+:class:`~stem.descriptor.networkstatus.NetworkStatusDocumentV3` or
+:class:`~stem.descriptor.networkstatus.RouterIndex`. This works best with
+documents that parse their entries as they're used (either one made with
+**lazy_routers**, or a **RouterIndex**) since entries that don't differ are
+then never parsed.
+
+A :class:`~stem.descriptor.diff.ConsensusPatch` retains these differences so
+a document we have in memory can be updated to match a newer one. Relays that
+didn't change keep the entries we've already parsed...
+
+::
+
+  patch = ConsensusPatch(old, new)
+  patch.apply(current_consensus)
+
+**Module Overview:**
+
+::
+
+  diff_routers - provides the router status entries that differ between documents
+
+  RouterChange - Difference in a relay's router status entry
+
+  ConsensusPatch - Changes that update one document to match another
+    +- apply - updates a document with our changes
+
+.. data:: Change (enum)
+
+  Ways in which a relay can differ between two documents.
+
+  =============== ===========
+  Change          Description
+  =============== ===========
+  **JOINED**      relay is only in the newer document
+  **LEFT**        relay is only in the older document
+  **FLAGS**       relay gained or lost flags
+  **BANDWIDTH**   relay's bandwidth or measured bandwidth changed
+  **EXIT_POLICY** relay's exit policy summary changed
+  **OTHER**       any other part of the relay's entry changed, such as its address or published timestamp
+  =============== ===========
+"""
+
+import copy
+
+import stem.util.enum
+import stem.util.str_tools
+
+from stem.descriptor.networkstatus import ROUTERS_START, FOOTER_START, V2_FOOTER_START, RouterIndex, _LazyRouters
+
+Change = stem.util.enum.UppercaseEnum(
+  "JOINED",
+  "LEFT",
+  "FLAGS",
+  "BANDWIDTH",
+  "EXIT_POLICY",
+  "OTHER",
+)
+
+BANDWIDTH_ATTR = ('bandwidth', 'measured', 'is_unmeasured')
+
+# Entry attributes that aren't part of its content.
+
+IGNORED_ATTR = ('document', '_path', '_archive_path', '_raw_contents')
+
+
+class RouterChange(object):
+  """
+  Difference in a relay's router status entry between two documents.
+
+  :var str fingerprint: relay's fingerprint
+  :var tuple changes: :data:`~stem.descriptor.diff.Change` for how the relay
+    differs
+  :var RouterStatusEntry old_entry: relay's entry in the older document,
+    **None** if it joined
+  :var RouterStatusEntry new_entry: relay's entry in the newer document,
+    **None** if it left
+  :var list added_flags: :data:`~stem.Flag` the relay gained
+  :var list removed_flags: :data:`~stem.Flag` the relay lost
+  """
+
+  def __init__(self, fingerprint, old_entry, new_entry):
+    self.fingerprint = fingerprint
+    self.old_entry = old_entry
+    self.new_entry = new_entry
+
+    old_flags = set(old_entry.flags or ()) if old_entry else set()
+    new_flags = set(new_entry.flags or ()) if new_entry else set()
+
+    self.added_flags = sorted(new_flags - old_flags)
+    self.removed_flags = sorted(old_flags - new_flags)
+
+    if old_entry is None:
+      self.changes = (Change.JOINED,)
+    elif new_entry is None:
+      self.changes = (Change.LEFT,)
+    else:
+      changes = []
+
+      if self.added_flags or self.removed_flags:
+        changes.append(Change.FLAGS)
+
+      if _get_attr(old_entry, BANDWIDTH_ATTR) != _get_attr(new_entry, BANDWIDTH_ATTR):
+        changes.append(Change.BANDWIDTH)
+
+      if getattr(old_entry, 'exit_policy', None) != getattr(new_entry, 'exit_policy', None):
+        changes.append(Change.EXIT_POLICY)
+
+      if _get_other_attr(old_entry) != _get_other_attr(new_entry):
+        changes.append(Change.OTHER)
+
+      self.changes = tuple(changes)
+
+  def __repr__(self):
+    return "<RouterChange %s: %s>" % (self.fingerprint, ", ".join(self.changes))
+
+
+class ConsensusPatch(object):
+  """
+  Changes that update one document to match another. Only the entries that
+  differ between the documents are retained, along with the header and footer
+  of the document we update to. When applied the document's content is
+  rebuilt from these and its entries, in fingerprint order like tor's.
+
+  :param NetworkStatusDocumentV3,RouterIndex old: document to update from
+  :param NetworkStatusDocumentV3,RouterIndex new: document to update to
+
+  :var datetime base_valid_after: time when the document that we update from
+    became valid
+  :var datetime valid_after: time when the document that we update to became
+    valid
+  :var list changes: :class:`~stem.descriptor.diff.RouterChange` for the relays
+    that differ, in fingerprint order
+
+  :raises: **ValueError** if an entry that differs is malformed
+  """
+
+  def __init__(self, old, new):
+    self.base_valid_after = _get_document(old).valid_after
+    self.valid_after = _get_document(new).valid_after
+    self.changes = list(diff_routers(old, new))
+
+    # attributes of the document we update to other than its routers, and
+    # the content around its router status entries
+
+    document = _get_document(new)
+    self._attributes = dict((attr, value) for (attr, value) in vars(document).items() if attr not in ('routers', '_path', '_archive_path', '_raw_contents'))
+    self._header_content, self._footer_content = _get_header_and_footer(new)
+
+  def apply(self, document):
+    """
+    Updates a document in place so it matches the one this patch was made to.
+    Entries of relays that didn't change are kept as-is.
+
+    If the document parses its entries as they're used then the entries it
+    hasn't yet parsed are parsed first.
+
+    :param NetworkStatusDocumentV3 document: document to be updated, this
+      should match the one this patch was made from
+
+    :raises: **ValueError** if the document isn't the one this patch was made
+      from, or one of its entries is malformed
+    """
+
+    if document.valid_after != self.base_valid_after:
+      raise ValueError("Patch is for the document that became valid at %s, but this one became valid at %s" % (self.base_valid_after, document.valid_after))
+
+    if isinstance(document.routers, _LazyRouters):
+      document.routers.load()
+      document.routers = dict(document.routers.items())
+
+    for change in self.changes:
+      if change.new_entry is None:
+        document.routers.pop(change.fingerprint, None)
+      else:
+        entry = copy.copy(change.new_entry)
+        entry.document = document
+        document.routers[change.fingerprint] = entry
+
+    for attr, value in self._attributes.items():
+      setattr(document, attr, value)
+
+    routers = document.routers
+    entry_content = [routers[fingerprint].get_bytes() for fingerprint in sorted(routers.keys())]
+    document._raw_contents = self._header_content + b"".join(entry_content) + self._footer_content
+
+
+def diff_routers(old, new):
+  """
+  Provides the relays whose router status entries differ between two
+  documents. Entries are compared by their content first, and only parsed if
+  they're not identical.
+
+  :param NetworkStatusDocumentV3,RouterIndex old: older document
+  :param NetworkStatusDocumentV3,RouterIndex new: newer document
+
+  :returns: iterator for a :class:`~stem.descriptor.diff.RouterChange` of each
+    relay that differs, in fingerprint order
+
+  :raises: **ValueError** if an entry that differs is malformed
+  """
+
+  old_fingerprints, get_old_content, get_old_entry = _get_routers(old)
+  new_fingerprints, get_new_content, get_new_entry = _get_routers(new)
+
+  old_index, new_index = 0, 0
+
+  while old_index < len(old_fingerprints) or new_index < len(new_fingerprints):
+    old_fingerprint = old_fingerprints[old_index] if old_index < len(old_fingerprints) else None
+    new_fingerprint = new_fingerprints[new_index] if new_index < len(new_fingerprints) else None
+
+    if new_fingerprint is None or (old_fingerprint is not None and old_fingerprint < new_fingerprint):
+      yield RouterChange(old_fingerprint, get_old_entry(old_fingerprint), None)
+      old_index += 1
+    elif old_fingerprint is None or new_fingerprint < old_fingerprint:
+      yield RouterChange(new_fingerprint, None, get_new_entry(new_fingerprint))
+      new_index += 1
+    else:
+      if get_old_content(old_fingerprint) != get_new_content(new_fingerprint):
+        change = RouterChange(new_fingerprint, get_old_entry(old_fingerprint), get_new_entry(new_fingerprint))
+
+        if change.changes:
+          yield change
+
+      old_index += 1
+      new_index += 1
+
+
+def _get_routers(document):
+  """
+  Provides the sorted fingerprints of a document's relays, along with functions
+  for the content and parsed entry of each.
+  """
+
+  if isinstance(document, RouterIndex):
+    content, offsets, get_entry = document._content, document._offsets, document.get_entry
+  elif isinstance(document.routers, _LazyRouters):
+    content, offsets, get_entry = document.get_bytes(), document.routers._offsets, document.routers.__getitem__
+  else:
+    routers = document.routers
+    return sorted(routers.keys()), lambda fingerprint: routers[fingerprint].get_bytes(), routers.__getitem__
+
+  def get_content(fingerprint):
+    offset, length = offsets[fingerprint]
+    return content[offset:offset + length]
+
+  fingerprints = sorted([fingerprint for fingerprint in offsets if fingerprint is not None])
+  return fingerprints, get_content, get_entry
+
+
+def _get_document(document):
+  return document.get_document() if isinstance(document, RouterIndex) else document
+
+
+def _get_header_and_footer(document):
+  """
+  Provides the content of a document before and after its router status
+  entries.
+  """
+
+  if isinstance(document, RouterIndex):
+    content = document._content
+    return content[document._document_start:document._routers_start], content[document._routers_end:]
+
+  content = document.get_bytes()
+  routers_end = _find_line(content, (FOOTER_START + "\n", V2_FOOTER_START + " "), len(content))
+  routers_start = _find_line(content[:routers_end], (ROUTERS_START + " ",), routers_end)
+
+  return content[:routers_start], content[routers_end:]
+
+
+def _find_line(content, prefixes, default):
+  """
+  Provides the index of the first line with one of the given prefixes, or the
+  default if there aren't any.
+  """
+
+  matches = [content.find(b"\n" + stem.util.str_tools._to_bytes(prefix)) for prefix in prefixes]
+  matches = [index + 1 for index in matches if index != -1]
+
+  return min(matches) if matches else default
+
+
+def _get_attr(entry, attributes):
+  return tuple([getattr(entry, attr, None) for attr in attributes])
+
+
+def _get_other_attr(entry):
+  excluded = IGNORED_ATTR + BANDWIDTH_ATTR + ('flags', 'exit_policy')
+  return dict((attr, value) for (attr, value) in vars(entry).items() if attr not in excluded)
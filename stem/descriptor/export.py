@@ -4,19 +4,72 @@
 """
 Toolkit for exporting descriptors to other formats.
 
+For analysis of large collections descriptors can also be exported to
+`numpy <http://www.numpy.org/>`_ arrays with a column per attribute. These can
+be saved to a directory and memory mapped back, so questions like 'how much
+bandwidth do relays with the Exit flag have' become vectorized operations
+rather than loops over descriptor objects...
+
+::
+
+  import numpy
+  import stem
+
+  from stem.descriptor import parse_file
+  from stem.descriptor.export import FLAG_BITS, export_columns, load_columns
+
+  entries = parse_file('/home/atagar/.tor/cached-consensus')
+  export_columns('/tmp/consensus_columns', entries, ('fingerprint', 'flags', 'bandwidth'))
+
+  columns = load_columns('/tmp/consensus_columns')
+  is_exit = (columns['flags'] & FLAG_BITS[stem.Flag.EXIT]) != 0
+  print numpy.sum(columns['bandwidth'][is_exit])
+
 **Module Overview:**
 
 ::
 
   export_csv - Exports descriptors to a CSV
   export_csv_file - Writes exported CSV output to a file
+  export_jsonl - Exports descriptors to JSON Lines
+  export_jsonl_file - Writes exported JSON Lines output to a file
+  export_binary_file - Writes descriptors as length-prefixed records to a file
+
+  to_columns - Provides numpy arrays with descriptor attributes
+  export_columns - Writes descriptor attributes to a directory of numpy arrays
+  load_columns - Reads arrays written by export_columns
 """
 
+import array
 import cStringIO
 import csv
+import datetime
+import itertools
+import json
+import operator
+import os
+import shutil
+import struct
+import tempfile
 
+import stem
 import stem.descriptor
 import stem.prereq
+import stem.util.str_tools
+
+try:
+  # added in python 2.7
+  from collections import OrderedDict
+except ImportError:
+  from stem.util.ordereddict import OrderedDict
+
+# Bits of the mask that a 'flags' column has for each relay flag.
+
+FLAG_BITS = dict((flag, 1 << index) for (index, flag) in enumerate(stem.Flag))
+
+EXPORT_CHUNK_SIZE = 1000
+RECORD_LENGTH = struct.Struct("!I")
+COLUMN_CHUNK_SIZE = 65536
 
 
 class _ExportDialect(csv.excel):
@@ -30,8 +83,9 @@ def export_csv(descriptors, included_fields = (), excluded_fields = (), header =
   labeled with a header row. Either 'included_fields' or 'excluded_fields' can
   be used for more granular control over its attributes and the order.
 
-  :param Descriptor,list descriptors: either a
-    :class:`~stem.descriptor.Descriptor` or list of descriptors to be exported
+  :param Descriptor,iterable descriptors: either a
+    :class:`~stem.descriptor.Descriptor` or iterable of descriptors to be
+    exported
   :param list included_fields: attributes to include in the csv
   :param list excluded_fields: attributes to exclude from the csv
   :param bool header: if **True** then the first line will be a comma separated
@@ -51,9 +105,16 @@ def export_csv_file(output_file, descriptors, included_fields = (), excluded_fie
   Similar to :func:`stem.descriptor.export.export_csv`, except that the CSV is
   written directly to a file.
 
+  Descriptors are read as we go and rows are written in chunks, so this can
+  export any number of descriptors from an iterator (such as
+  :func:`~stem.descriptor.__init__.parse_file` or a
+  :class:`~stem.descriptor.reader.DescriptorReader`) in constant memory. The
+  attributes are determined by the first descriptor.
+
   :param file output_file: file to be written to
-  :param Descriptor,list descriptors: either a
-    :class:`~stem.descriptor.Descriptor` or list of descriptors to be exported
+  :param Descriptor,iterable descriptors: either a
+    :class:`~stem.descriptor.Descriptor` or iterable of descriptors to be
+    exported
   :param list included_fields: attributes to include in the csv
   :param list excluded_fields: attributes to exclude from the csv
   :param bool header: if **True** then the first line will be a comma separated
@@ -63,13 +124,224 @@ def export_csv_file(output_file, descriptors, included_fields = (), excluded_fie
   :raises: **ValueError** if descriptors contain more than one descriptor type
   """
 
+  rows = _get_rows(descriptors, included_fields, excluded_fields, "CSV")
+
+  try:
+    included_fields = next(rows)
+  except StopIteration:
+    return
+
+  # Rows are buffered and written to the file a chunk at a time. Rather than
+  # making a dict for each descriptor we fetch just the attributes we need.
+
+  output_buffer = cStringIO.StringIO()
+  writer = csv.writer(output_buffer, dialect = _ExportDialect())
+
+  if header and stem.prereq.is_python_27():
+    writer.writerow(included_fields)
+
+  buffered_rows = 0
+  array_fields = None
+
+  for row in rows:
+    # bandwidth histories are arrays, which we write like lists
+
+    if array_fields is None:
+      array_fields = [i for (i, value) in enumerate(row) if value is None or isinstance(value, array.array)]
+
+    if array_fields:
+      row = list(row)
+
+      for i in array_fields:
+        if isinstance(row[i], array.array):
+          row[i] = row[i].tolist()
+
+    writer.writerow(row)
+    buffered_rows += 1
+
+    if buffered_rows >= EXPORT_CHUNK_SIZE:
+      output_file.write(output_buffer.getvalue())
+      output_buffer.seek(0)
+      output_buffer.truncate()
+      buffered_rows = 0
+
+  output_file.write(output_buffer.getvalue())
+
+
+def export_jsonl(descriptors, included_fields = (), excluded_fields = ()):
+  """
+  Provides `JSON Lines <http://jsonlines.org/>`_ for one or more descriptors,
+  each line being a JSON object with the descriptor's attributes. Like
+  :func:`~stem.descriptor.export.export_csv` this includes all public
+  attributes by default, and 'included_fields' or 'excluded_fields' can be
+  used to pick specific ones.
+
+  Rather than flattening values to strings they're converted as follows...
+
+  * **datetime** to an ISO 8601 string such as '2012-03-01T17:15:27'
+  * exit policies and versions to their string representation
+  * sets and tuples to lists
+
+  References to other descriptors, such as a router status entry's document,
+  are excluded unless explicitly included.
+
+  :param Descriptor,iterable descriptors: either a
+    :class:`~stem.descriptor.Descriptor` or iterable of descriptors to be
+    exported
+  :param list included_fields: attributes to include in the output
+  :param list excluded_fields: attributes to exclude from the output
+
+  :returns: **str** with a JSON object for each descriptor, one per line
+  :raises: **ValueError** if descriptors contain more than one descriptor type
+  """
+
+  output_buffer = cStringIO.StringIO()
+  export_jsonl_file(output_buffer, descriptors, included_fields, excluded_fields)
+  return output_buffer.getvalue()
+
+
+def export_jsonl_file(output_file, descriptors, included_fields = (), excluded_fields = ()):
+  """
+  Similar to :func:`stem.descriptor.export.export_jsonl`, except that the
+  output is written directly to a file. Like
+  :func:`~stem.descriptor.export.export_csv_file` this reads descriptors as it
+  goes and writes in chunks, so it can be used with an iterator for any
+  number of descriptors.
+
+  :param file output_file: file to be written to, this should be in text
+    mode
+  :param Descriptor,iterable descriptors: either a
+    :class:`~stem.descriptor.Descriptor` or iterable of descriptors to be
+    exported
+  :param list included_fields: attributes to include in the output
+  :param list excluded_fields: attributes to exclude from the output
+
+  :raises: **ValueError** if descriptors contain more than one descriptor type
+  """
+
+  _write_records(output_file, descriptors, included_fields, excluded_fields, "JSON Lines", False)
+
+
+def export_binary_file(output_file, descriptors, included_fields = (), excluded_fields = ()):
+  """
+  Writes a stream of length-prefixed records for our descriptors. Each record
+  is a four byte (network order) length followed by a UTF-8 JSON object with
+  the descriptor's attributes, converted as described in
+  :func:`~stem.descriptor.export.export_jsonl`.
+
+  Unlike JSON Lines readers can skip over records, or hand them off, without
+  scanning for newlines.
+
+  :param file output_file: file to be written to, this should be in binary
+    mode
+  :param Descriptor,iterable descriptors: either a
+    :class:`~stem.descriptor.Descriptor` or iterable of descriptors to be
+    exported
+  :param list included_fields: attributes to include in the output
+  :param list excluded_fields: attributes to exclude from the output
+
+  :raises: **ValueError** if descriptors contain more than one descriptor type
+  """
+
+  _write_records(output_file, descriptors, included_fields, excluded_fields, "binary records", True)
+
+
+def _write_records(output_file, descriptors, included_fields, excluded_fields, export_label, is_binary):
+  """
+  Writes the JSON for each of our descriptors, a chunk at a time.
+
+  :param bool is_binary: provides length-prefixed records if **True**,
+    otherwise JSON Lines
+  """
+
+  rows = _get_rows(descriptors, included_fields, excluded_fields, export_label, True)
+
+  try:
+    included_fields = next(rows)
+  except StopIteration:
+    return
+
+  # JSON Lines are text like our other exports, while binary records are
+  # bytes. These are the same under python 2.
+
+  encode = _get_json_encoder()
+  is_python_3 = stem.prereq.is_python_3()
+  separator = b"" if is_binary else ""
+  records = []
+
+  for row in rows:
+    content = encode(dict(itertools.izip(included_fields, row)))
+
+    if is_binary:
+      if is_python_3:
+        content = stem.util.str_tools._to_bytes(content)
+
+      records.append(RECORD_LENGTH.pack(len(content)) + content)
+    else:
+      records.append(content + "\n")
+
+    if len(records) >= EXPORT_CHUNK_SIZE:
+      output_file.write(separator.join(records))
+      records = []
+
+  output_file.write(separator.join(records))
+
+
+def _get_json_encoder():
+  """
+  Provides a function that converts values to compact JSON. We make a single
+  encoder and reuse it for all of our records.
+  """
+
+  return json.JSONEncoder(separators = (',', ':'), default = _to_json_value).encode
+
+
+def _to_json_value(value):
+  """
+  Converts values that json can't natively encode.
+  """
+
+  if isinstance(value, datetime.datetime):
+    return value.isoformat()
+  elif isinstance(value, (set, frozenset)):
+    return sorted(value)
+  elif isinstance(value, array.array):
+    return value.tolist()
+  elif isinstance(value, bytes):
+    return stem.util.str_tools._to_unicode(value)
+  else:
+    return str(value)  # exit policies, versions, etc
+
+
+def _get_rows(descriptors, included_fields, excluded_fields, export_label, skip_references = False):
+  """
+  Provides the attributes that we're exporting, followed by a tuple with those
+  attributes for each descriptor.
+
+  :param Descriptor,iterable descriptors: descriptors to be exported
+  :param list included_fields: attributes to include
+  :param list excluded_fields: attributes to exclude
+  :param str export_label: name of the format we're exporting to
+  :param bool skip_references: excludes attributes that reference other
+    descriptors unless they're explicitly included
+
+  :returns: iterator with a **list** of our attributes followed by a **tuple**
+    for each descriptor
+
+  :raises: **ValueError** if descriptors contain more than one descriptor type
+  """
+
   if isinstance(descriptors, stem.descriptor.Descriptor):
     descriptors = (descriptors,)
 
-  if not descriptors:
+  descriptors = iter(descriptors)
+
+  try:
+    first_descriptor = next(descriptors)
+  except StopIteration:
     return
 
-  descriptor_type = type(descriptors[0])
+  descriptor_type = type(first_descriptor)
   descriptor_type_label = descriptor_type.__name__
   included_fields = list(included_fields)
 
@@ -77,7 +349,7 @@ def export_csv_file(output_file, descriptors, included_fields = (), excluded_fie
   # ordered alphabetically. If they did specify fields then make sure that
   # they exist.
 
-  desc_attr = sorted(vars(descriptors[0]).keys())
+  desc_attr = sorted(vars(first_descriptor).keys())
 
   if included_fields:
     for field in included_fields:
@@ -86,21 +358,347 @@ def export_csv_file(output_file, descriptors, included_fields = (), excluded_fie
   else:
     included_fields = [attr for attr in desc_attr if not attr.startswith('_')]
 
+    if skip_references:
+      included_fields = [attr for attr in included_fields if not isinstance(getattr(first_descriptor, attr), stem.descriptor.Descriptor)]
+
   for field in excluded_fields:
     try:
       included_fields.remove(field)
     except ValueError:
       pass
 
-  writer = csv.DictWriter(output_file, included_fields, dialect = _ExportDialect(), extrasaction='ignore')
+  yield included_fields
 
-  if header and stem.prereq.is_python_27():
-    writer.writeheader()
+  get_row = _get_attribute_fetcher(included_fields)
+
+  for desc in itertools.chain((first_descriptor,), descriptors):
+    if descriptor_type != type(desc):
+      if not isinstance(desc, stem.descriptor.Descriptor):
+        raise ValueError("Unable to export a descriptor %s since %s is not a descriptor." % (export_label, type(desc).__name__))
+      else:
+        raise ValueError("To export a descriptor %s all of the descriptors must be of the same type. First descriptor was a %s but we later got a %s." % (export_label, descriptor_type_label, type(desc)))
+
+    yield get_row(desc)
+
+
+def _get_attribute_fetcher(fields):
+  """
+  Provides a functor that fetches the given attributes of an object as a
+  tuple.
+  """
+
+  if len(fields) == 1:
+    getter = operator.attrgetter(fields[0])
+    return lambda desc: (getter(desc),)
+  elif fields:
+    return operator.attrgetter(*fields)
+  else:
+    return lambda desc: ()
+
+
+def to_columns(descriptors, fields, chunk_size = COLUMN_CHUNK_SIZE):
+  """
+  Provides numpy arrays with the given attributes of our descriptors. This
+  accepts any iterable, and only holds **chunk_size** descriptors worth of
+  values as python objects at a time. The type of each column is based on its
+  values...
+
+  ======================= ==================== ================
+  Attribute Type          Column Type          Missing Values
+  ======================= ==================== ================
+  **int**                 int64                -1
+  **float**               float64              NaN
+  **bool**                bool                 **False**
+  **datetime**            datetime64[s]        NaT
+  flags                   uint32 bitmask       0
+  anything else           fixed width bytes    empty string
+  ======================= ==================== ================
+
+  Strings are fixed width so fingerprints, for instance, are 'S40' columns.
+  Lists and sets are comma separated, and other values such as exit policies
+  or versions are stored as their string representation. The 'flags'
+  attribute of router status entries is a bitmask of
+  :data:`~stem.descriptor.export.FLAG_BITS`, and unrecognized flags are
+  omitted.
+
+  The arrays we provide are in memory, so for collections larger than that
+  use :func:`~stem.descriptor.export.export_columns` instead.
+
+  :param iterable descriptors: descriptors to be exported
+  :param list fields: attributes to provide columns for
+  :param int chunk_size: number of descriptors to read before converting their
+    values to arrays
+
+  :returns: **collections.OrderedDict** mapping attribute names to their
+    **numpy.ndarray**
+
+  :raises:
+    * **ImportError** if numpy is unavailable
+    * **ValueError** if descriptors lack one of the attributes
+  """
+
+  if not stem.prereq.is_numpy_available():
+    raise ImportError("Exporting descriptors to columns requires numpy")
+
+  import numpy
+
+  columns, _ = _fill_columns(descriptors, fields, chunk_size)
+  return OrderedDict([(field, column.get_array(numpy)) for (field, column) in columns.items()])
+
+
+def export_columns(path, descriptors, fields, chunk_size = COLUMN_CHUNK_SIZE):
+  """
+  Writes the columns from :func:`~stem.descriptor.export.to_columns` to a
+  directory, with a numpy '.npy' file for each attribute. These can be read
+  with :func:`~stem.descriptor.export.load_columns`.
+
+  Unlike :func:`~stem.descriptor.export.to_columns` this doesn't keep our
+  columns in memory. Each chunk is written to a scratch file as it's
+  converted, and these are then copied into each column's file, so at most
+  **chunk_size** descriptors worth of values are in memory at a time.
+
+  :param str path: directory to write to, this is created if it doesn't exist
+  :param iterable descriptors: descriptors to be exported
+  :param list fields: attributes to export
+  :param int chunk_size: number of descriptors to read before converting their
+    values to arrays
+
+  :returns: **int** for the number of descriptors that were exported
+
+  :raises:
+    * **ImportError** if numpy is unavailable
+    * **ValueError** if descriptors lack one of the attributes
+    * **IOError** if unable to write to the directory
+  """
+
+  if not stem.prereq.is_numpy_available():
+    raise ImportError("Exporting descriptors to columns requires numpy")
+
+  import numpy
+
+  try:
+    if not os.path.exists(path):
+      os.makedirs(path)
+
+    chunk_path = tempfile.mkdtemp(prefix = '.chunks-', dir = path)
+  except OSError as exc:
+    raise IOError(exc)
+
+  try:
+    columns, count = _fill_columns(descriptors, fields, chunk_size, chunk_path)
+
+    for field, column in columns.items():
+      column.save(numpy, os.path.join(path, field + '.npy'))
+  finally:
+    shutil.rmtree(chunk_path, ignore_errors = True)
+
+  return count
+
+
+def _fill_columns(descriptors, fields, chunk_size, chunk_path = None):
+  """
+  Reads the given attributes from our descriptors, converting them to arrays
+  a chunk at a time.
+
+  :param str chunk_path: directory to write each chunk to, if **None** then
+    they're kept in memory
+
+  :returns: **tuple** of the form (columns, count) with a
+    **collections.OrderedDict** mapping our attributes to their _Column, and
+    the number of descriptors that we read
+
+  :raises: **ValueError** if descriptors lack one of the attributes
+  """
+
+  fields = list(fields)
+  columns = OrderedDict([(field, _Column(field, chunk_path)) for field in fields])
+  chunk = [[] for field in fields]
+  count = 0
 
   for desc in descriptors:
-    if not isinstance(desc, stem.descriptor.Descriptor):
-      raise ValueError("Unable to export a descriptor CSV since %s is not a descriptor." % type(desc).__name__)
-    elif descriptor_type != type(desc):
-      raise ValueError("To export a descriptor CSV all of the descriptors must be of the same type. First descriptor was a %s but we later got a %s." % (descriptor_type_label, type(desc)))
+    for field, values in zip(fields, chunk):
+      try:
+        values.append(getattr(desc, field))
+      except AttributeError:
+        raise ValueError("%s does not have a '%s' attribute" % (type(desc).__name__, field))
+
+    count += 1
+
+    if len(chunk[0]) >= chunk_size:
+      for field, values in zip(fields, chunk):
+        columns[field].add(values)
+        del values[:]
+
+  for field, values in zip(fields, chunk):
+    columns[field].add(values)
+
+  return columns, count
 
-    writer.writerow(vars(desc))
+
+def load_columns(path, fields = None, mmap = True):
+  """
+  Reads columns written by :func:`~stem.descriptor.export.export_columns`. By
+  default these are memory mapped so only the parts that you use are read
+  from disk.
+
+  :param str path: directory to read from
+  :param list fields: attributes to load, if unset then this provides all of
+    them
+  :param bool mmap: memory maps the arrays in read-only mode if **True**,
+    otherwise reads them into memory
+
+  :returns: **dict** mapping attribute names to their **numpy.ndarray**
+
+  :raises:
+    * **ImportError** if numpy is unavailable
+    * **IOError** if unable to read the directory or one of its columns
+  """
+
+  if not stem.prereq.is_numpy_available():
+    raise ImportError("Loading descriptor columns requires numpy")
+
+  import numpy
+
+  if fields is None:
+    fields = [filename[:-4] for filename in os.listdir(path) if filename.endswith('.npy')]
+
+  mmap_mode = 'r' if mmap else None
+  return dict([(field, numpy.load(os.path.join(path, field + '.npy'), mmap_mode = mmap_mode)) for field in fields])
+
+
+class _Column(object):
+  """
+  Values for a column of :func:`~stem.descriptor.export.to_columns`. We
+  convert these to arrays a chunk at a time, which are either kept in memory
+  or written to **chunk_path**. The column's type is determined by its first
+  value that isn't **None**, so until we have one we only keep track of how
+  many values we've had.
+  """
+
+  def __init__(self, field, chunk_path = None):
+    self.field = field
+    self.chunk_path = chunk_path
+    self.column_type = None
+    self.chunks = []  # arrays, or tuples of the form (path, dtype, size)
+    self.leading_missing = 0
+
+  def add(self, values):
+    if not values:
+      return
+
+    if self.column_type is None:
+      for value in values:
+        if value is not None:
+          self.column_type = _get_column_type(self.field, value)
+          break
+      else:
+        self.leading_missing += len(values)
+        return
+
+      if self.leading_missing:
+        values = [None] * self.leading_missing + values
+        self.leading_missing = 0
+
+    chunk = self.column_type.to_array(values)
+
+    if self.chunk_path is None:
+      self.chunks.append(chunk)
+    else:
+      import numpy
+
+      path = os.path.join(self.chunk_path, '%s.%i.npy' % (self.field, len(self.chunks)))
+      numpy.save(path, chunk)
+      self.chunks.append((path, chunk.dtype, len(chunk)))
+
+  def get_array(self, numpy):
+    if self.column_type is None:
+      return numpy.array([b''] * self.leading_missing, dtype = 'S')
+    elif len(self.chunks) == 1:
+      return self.chunks[0]
+    else:
+      return numpy.concatenate(self.chunks)
+
+  def save(self, numpy, path):
+    """
+    Writes the chunks from our **chunk_path** to a '.npy' file, reading one at
+    a time. String columns are as wide as the widest of their chunks.
+    """
+
+    if self.column_type is None:
+      numpy.save(path, self.get_array(numpy))
+      return
+
+    dtype = numpy.result_type(*[chunk_dtype for (_, chunk_dtype, _) in self.chunks])
+    size = sum([chunk_size for (_, _, chunk_size) in self.chunks])
+    column = numpy.lib.format.open_memmap(path, mode = 'w+', dtype = dtype, shape = (size,))
+    offset = 0
+
+    for chunk_path, _, chunk_size in self.chunks:
+      column[offset:offset + chunk_size] = numpy.load(chunk_path, mmap_mode = 'r')
+      offset += chunk_size
+      os.remove(chunk_path)
+
+    column.flush()
+    del column
+
+
+class _ColumnType(object):
+  """
+  Conversion of attribute values to an array.
+
+  :var str dtype: numpy type of the array
+  :var object missing: value used in place of **None**
+  :var functor converter: converts values to something numpy accepts
+  """
+
+  def __init__(self, dtype, missing, converter = None):
+    self.dtype = dtype
+    self.missing = missing
+    self.converter = converter
+
+  def to_array(self, values):
+    import numpy
+
+    missing, converter = self.missing, self.converter
+
+    if converter:
+      values = [missing if value is None else converter(value) for value in values]
+    else:
+      values = [missing if value is None else value for value in values]
+
+    return numpy.array(values, dtype = self.dtype)
+
+
+def _flags_to_bitmask(flags):
+  mask = 0
+
+  for flag in flags:
+    mask |= FLAG_BITS.get(flag, 0)
+
+  return mask
+
+
+def _to_column_bytes(value):
+  if isinstance(value, (set, frozenset)):
+    value = ','.join(sorted([str(entry) for entry in value]))
+  elif isinstance(value, (list, tuple, array.array)):
+    value = ','.join([str(entry) for entry in value])
+  elif not isinstance(value, (bytes, unicode)):
+    value = str(value)
+
+  return stem.util.str_tools._to_bytes(value)
+
+
+def _get_column_type(field, value):
+  if field == 'flags':
+    return _ColumnType('uint32', 0, _flags_to_bitmask)
+  elif isinstance(value, bool):
+    return _ColumnType('bool', False)
+  elif isinstance(value, (int, long)):
+    return _ColumnType('int64', -1)
+  elif isinstance(value, float):
+    return _ColumnType('float64', float('nan'))
+  elif isinstance(value, datetime.datetime):
+    return _ColumnType('datetime64[s]', None)
+  else:
+    return _ColumnType('S', b'', _to_column_bytes)
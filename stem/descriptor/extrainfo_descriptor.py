@@ -27,6 +27,9 @@ Extra-info descriptors are available from a few sources...
 
 ::
 
+  align_histories - aligns the bandwidth histories of descriptors by time
+  sum_histories - adds bandwidth histories together
+
   ExtraInfoDescriptor - Tor extra-info descriptor.
     |  |- RelayExtraInfoDescriptor - Extra-info descriptor for a relay.
     |  +- BridgeExtraInfoDescriptor - Extra-info descriptor for a bridge.
@@ -34,6 +37,24 @@ Extra-info descriptors are available from a few sources...
     |- digest - calculates the upper-case hex digest value for our content
     +- get_unrecognized_lines - lines with unrecognized content
 
+Bandwidth histories and cell statistics are kept as an :class:`array.array`
+rather than a list, which takes a fraction of the memory. These can be used
+like a list, or provided to numpy without being copied...
+
+::
+
+  history = numpy.frombuffer(desc.read_history_values, dtype = desc.read_history_values.typecode)
+
+Relays measure their bandwidth over intervals that end at different times.
+:func:`~stem.descriptor.extrainfo_descriptor.align_histories` places their
+values on a common time grid, for instance to sum the traffic of the whole
+network...
+
+::
+
+  start, interval, histories = align_histories(extrainfo_descriptors)
+  network_total = sum_histories(histories.values())
+
 .. data:: DirResponse (enum)
 
   Enumeration for known statuses for ExtraInfoDescriptor's dir_*_responses.
@@ -68,11 +89,14 @@ Extra-info descriptors are available from a few sources...
   ===================== ===========
 """
 
+import array
+import calendar
 import datetime
 import hashlib
 import re
 
 import stem.descriptor
+import stem.prereq
 import stem.util.connection
 import stem.util.enum
 import stem.util.str_tools
@@ -93,6 +117,18 @@ dir_stats += ['d%i' % i for i in range(1, 5)]
 dir_stats += ['d%i' % i for i in range(6, 10)]
 DirStat = stem.util.enum.Enum(*[(stat.upper(), stat) for stat in dir_stats])
 
+# Bandwidth histories are arrays of 64 bit integers. Python 2 only has these as
+# a 'long' on some platforms, in which case we fall back to doubles (which are
+# exact for any value we'd realistically see).
+
+try:
+  HISTORY_TYPECODE = 'q'
+  array.array(HISTORY_TYPECODE)
+except ValueError:
+  HISTORY_TYPECODE = 'l' if array.array('l').itemsize >= 8 else 'd'
+
+HISTORY_ATTR = ('read', 'write', 'dir_read', 'dir_write')
+
 # relay descriptors must have exactly one of the following
 REQUIRED_FIELDS = (
   "extra-info",
@@ -171,6 +207,135 @@ def _parse_file(descriptor_file, is_bridge = False, validate = True):
       break  # done parsing file
 
 
+def align_histories(descriptors, history = 'read'):
+  """
+  Aligns the bandwidth histories of several descriptors on a common grid of
+  intervals. The grid's intervals start at multiples of the interval since
+  the unix epoch, and each value is placed in the one containing the middle
+  of the period it was measured over.
+
+  A relay's descriptors usually have overlapping histories. Where more than
+  one covers an interval the value from the later descriptor is used.
+
+  :param iterable descriptors:
+    :class:`~stem.descriptor.extrainfo_descriptor.ExtraInfoDescriptor` or
+    :class:`~stem.descriptor.server_descriptor.ServerDescriptor` instances
+  :param str history: history to provide, this can be **read**, **write**,
+    **dir_read**, or **dir_write**
+
+  :returns: **tuple** of the form (start, interval, histories), where **start**
+    is the **datetime** our grid begins at, the **interval** is its seconds per
+    interval, and the **histories** are a dict of relay fingerprints to an
+    **array** of bytes for each interval (zero where we lack a value). This is
+    **(None, None, {})** if none of the descriptors have the history.
+
+  :raises: **ValueError** if the history isn't recognized or descriptors have
+    histories with different intervals
+  """
+
+  if history not in HISTORY_ATTR:
+    raise ValueError("History must be one of %s, not '%s'" % (", ".join(HISTORY_ATTR), history))
+
+  end_attr, interval_attr, values_attr = ["%s_history_%s" % (history, suffix) for suffix in ("end", "interval", "values")]
+  interval, histories = None, []
+
+  for desc in descriptors:
+    values = getattr(desc, values_attr, None)
+
+    if not values:
+      continue
+
+    desc_interval = getattr(desc, interval_attr)
+
+    if interval is None:
+      interval = desc_interval
+    elif desc_interval != interval:
+      raise ValueError("Unable to align histories with different intervals (%i and %i seconds)" % (interval, desc_interval))
+
+    end = calendar.timegm(getattr(desc, end_attr).utctimetuple())
+    last_slot = (end - interval // 2) // interval
+    histories.append((desc.fingerprint, last_slot - len(values) + 1, values))
+
+  if not histories:
+    return None, None, {}
+
+  first_slot = min([entry[1] for entry in histories])
+  slot_count = max([entry[1] + len(entry[2]) for entry in histories]) - first_slot
+  aligned = {}
+
+  for fingerprint, start, values in histories:
+    if fingerprint not in aligned:
+      aligned[fingerprint] = array.array(HISTORY_TYPECODE, [0]) * slot_count
+
+    if not isinstance(values, array.array) or values.typecode != HISTORY_TYPECODE:
+      values = array.array(HISTORY_TYPECODE, values)
+
+    offset = start - first_slot
+    aligned[fingerprint][offset:offset + len(values)] = values
+
+  start = datetime.datetime.utcfromtimestamp(first_slot * interval)
+  return start, interval, aligned
+
+
+def sum_histories(histories):
+  """
+  Adds bandwidth histories together, such as those from
+  :func:`~stem.descriptor.extrainfo_descriptor.align_histories`. This uses
+  numpy if it's available.
+
+  :param iterable histories: **array** or **list** of the values for each
+    history, these must all be the same length
+
+  :returns: **array** with the sum of each interval
+
+  :raises: **ValueError** if the histories are different lengths
+  """
+
+  histories = list(histories)
+
+  if not histories:
+    return array.array(HISTORY_TYPECODE)
+
+  length = len(histories[0])
+
+  for values in histories:
+    if len(values) != length:
+      raise ValueError("Unable to sum histories of different lengths (%i and %i)" % (length, len(values)))
+
+  if stem.prereq.is_numpy_available():
+    import numpy
+
+    total = numpy.zeros(length, dtype = HISTORY_TYPECODE)
+
+    for values in histories:
+      if isinstance(values, array.array):
+        total += numpy.frombuffer(values, dtype = values.typecode)
+      else:
+        total += numpy.array(values, dtype = HISTORY_TYPECODE)
+
+    return array.array(HISTORY_TYPECODE, total.tolist())
+
+  return array.array(HISTORY_TYPECODE, map(sum, zip(*histories)))
+
+
+def _parse_history_values(keyword, line, remainder):
+  """
+  Parses the comma separated values of a bandwidth history.
+
+  :returns: **array** with the history's values
+
+  :raises: **ValueError** if the values are malformed
+  """
+
+  if not remainder:
+    return array.array(HISTORY_TYPECODE)
+
+  try:
+    return array.array(HISTORY_TYPECODE, [int(entry) for entry in remainder.split(",")])
+  except (ValueError, OverflowError):
+    raise ValueError("%s line has non-numeric values: %s" % (keyword, line))
+
+
 def _parse_timestamp_and_interval(keyword, content):
   """
   Parses a 'YYYY-MM-DD HH:MM:SS (NSEC s) *' entry.
@@ -199,7 +364,7 @@ def _parse_timestamp_and_interval(keyword, content):
     raise ValueError("%s line's interval wasn't a number: %s" % (keyword, line))
 
   try:
-    timestamp = datetime.datetime.strptime(timestamp_str, "%Y-%m-%d %H:%M:%S")
+    timestamp = stem.util.str_tools._parse_timestamp(timestamp_str)
     return timestamp, int(interval), remainder
   except ValueError:
     raise ValueError("%s line's timestamp wasn't parsable: %s" % (keyword, line))
@@ -231,19 +396,19 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
 
   :var datetime read_history_end: end of the sampling interval
   :var int read_history_interval: seconds per interval
-  :var list read_history_values: bytes read during each interval
+  :var array read_history_values: bytes read during each interval
 
   :var datetime write_history_end: end of the sampling interval
   :var int write_history_interval: seconds per interval
-  :var list write_history_values: bytes written during each interval
+  :var array write_history_values: bytes written during each interval
 
   **Cell relaying statistics:**
 
   :var datetime cell_stats_end: end of the period when stats were gathered
   :var int cell_stats_interval: length in seconds of the interval
-  :var list cell_processed_cells: measurement of processed cells per circuit
-  :var list cell_queued_cells: measurement of queued cells per circuit
-  :var list cell_time_in_queue: mean enqueued time in milliseconds for cells
+  :var array cell_processed_cells: measurement of processed cells per circuit
+  :var array cell_queued_cells: measurement of queued cells per circuit
+  :var array cell_time_in_queue: mean enqueued time in milliseconds for cells
   :var int cell_circuits_per_decile: mean number of circuits in a decile
 
   **Directory Mirror Attributes:**
@@ -276,11 +441,11 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
 
   :var datetime dir_read_history_end: end of the sampling interval
   :var int dir_read_history_interval: seconds per interval
-  :var list dir_read_history_values: bytes read during each interval
+  :var array dir_read_history_values: bytes read during each interval
 
   :var datetime dir_write_history_end: end of the sampling interval
   :var int dir_write_history_interval: seconds per interval
-  :var list dir_write_history_values: bytes read during each interval
+  :var array dir_write_history_values: bytes read during each interval
 
   **Guard Attributes:**
 
@@ -603,7 +768,7 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
       elif keyword in ("cell-processed-cells", "cell-queued-cells", "cell-time-in-queue"):
         # "<keyword>" num,...,num
 
-        entries = []
+        entries = array.array('d')
 
         if value:
           for entry in value.split(","):
@@ -626,7 +791,7 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
         # "<keyword>" YYYY-MM-DD HH:MM:SS
 
         try:
-          timestamp = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+          timestamp = stem.util.str_tools._parse_timestamp(value)
 
           if keyword == "published":
             self.published = timestamp
@@ -683,13 +848,7 @@ class ExtraInfoDescriptor(stem.descriptor.Descriptor):
         # "<keyword>" YYYY-MM-DD HH:MM:SS (NSEC s) NUM,NUM,NUM,NUM,NUM...
         try:
           timestamp, interval, remainder = _parse_timestamp_and_interval(keyword, value)
-          history_values = []
-
-          if remainder:
-            try:
-              history_values = [int(entry) for entry in remainder.split(",")]
-            except ValueError:
-              raise ValueError("%s line has non-numeric values: %s" % (keyword, line))
+          history_values = _parse_history_values(keyword, line, remainder)
 
           if keyword == "read-history":
             self.read_history_end = timestamp
@@ -0,0 +1,311 @@
+# Copyright 2013, Damian Johnson
+# See LICENSE for licensing information
+
+"""
+Filtering of the descriptors we read. Most jobs only want descriptors that
+were published within a time window, for certain relays, or of a certain
+type. Rather than parsing everything and discarding most of it, a
+:class:`~stem.descriptor.filters.DescriptorFilter` can be given to
+:func:`~stem.descriptor.__init__.parse_file` or the
+:class:`~stem.descriptor.reader.DescriptorReader`...
+
+::
+
+  import datetime
+
+  from stem.descriptor.filters import DescriptorFilter
+  from stem.descriptor.reader import DescriptorReader
+
+  descriptor_filter = DescriptorFilter(
+    published_after = datetime.datetime(2013, 3, 1),
+    published_before = datetime.datetime(2013, 3, 2),
+    fingerprints = ["9695DFC35FFEB861329B9F1AB04C46397020CE31"],
+  )
+
+  with DescriptorReader(["/tmp/archives"], descriptor_filter = descriptor_filter) as reader:
+    for desc in reader:
+      print desc  # only moria1's descriptors from the first of march
+
+Filters are checked as early as we can...
+
+  * Files and archive members that are named for when they were made (such
+    as CollecTor's 'consensuses-2013-03.tar.bz2' and
+    '2013-03-01-00-00-00-consensus') are skipped without being read if that
+    is before our time window. Nothing they contain was published after they
+    were made.
+
+  * Files with an @type annotation or name that isn't one of our descriptor
+    types are skipped after reading their first line.
+
+  * Server descriptors, extra-info descriptors, and router status entries are
+    checked against their 'published', 'fingerprint', 'extra-info', 'r', and
+    's' lines before they're parsed.
+
+  * Finally, parsed descriptors are checked against their attributes.
+
+Descriptors aren't filtered by attributes they lack. For instance,
+microdescriptors have neither a publication time nor a fingerprint so they're
+only filtered by their type, and only router status entries have flags.
+Network status documents are checked against our time window by when they
+became valid (or their publication time for older documents).
+
+**Module Overview:**
+
+::
+
+  DescriptorFilter - Criteria for the descriptors that we want
+    |- accepts_type - checks if we want a type of descriptor
+    |- accepts_path - checks if a file might have descriptors we want
+    |- accepts_content - checks descriptor content before it's parsed
+    +- accepts - checks a parsed descriptor
+"""
+
+import base64
+import binascii
+import datetime
+import os
+import re
+
+import stem.util.str_tools
+import stem.util.tor_tools
+
+# Timestamps that CollecTor names files and archives with. These are when the
+# documents were made, and the end of the month that an archive covers.
+
+TIMESTAMP_NAME = re.compile("(\d{4})-(\d{2})-(\d{2})-(\d{2})-(\d{2})-(\d{2})")
+MONTH_NAME = re.compile("(?<!\d)(\d{4})-(\d{2})(?![\d-])")
+
+PUBLISHED_LINE = re.compile(b"^(?:opt )?published ([^\n]+)$", re.MULTILINE)
+FINGERPRINT_LINE = re.compile(b"^(?:opt )?fingerprint ([^\n]+)$", re.MULTILINE)
+EXTRA_INFO_LINE = re.compile(b"^(?:opt )?extra-info \\S+ ([0-9a-fA-F]{40})", re.MULTILINE)
+FLAGS_LINE = re.compile(b"^s ([^\n]*)$", re.MULTILINE)
+
+
+class DescriptorFilter(object):
+  """
+  Criteria for the descriptors that we want. Each criterion is optional, and
+  descriptors must satisfy all of those that we're given.
+
+  :param datetime published_after: skips descriptors published before this
+  :param datetime published_before: skips descriptors published after this
+  :param list fingerprints: relay fingerprints that we want descriptors for
+  :param list descriptor_types: `descriptor types
+    <https://metrics.torproject.org/formats.html#descriptortypes>`_ that we
+    want, without their version (for instance 'server-descriptor')
+  :param list flags: flags that router status entries must all have
+
+  :raises: **ValueError** if a fingerprint is malformed
+  """
+
+  def __init__(self, published_after = None, published_before = None, fingerprints = None, descriptor_types = None, flags = None):
+    self.published_after = published_after
+    self.published_before = published_before
+    self.fingerprints = None
+    self.descriptor_types = set(descriptor_types) if descriptor_types is not None else None
+    self.flags = set(flags) if flags else None
+
+    # 'r' lines have the base64 encoded identity rather than its fingerprint,
+    # so we compare against that to avoid converting each of them
+
+    self._identities = None
+
+    if fingerprints is not None:
+      self.fingerprints = set([fingerprint.upper() for fingerprint in fingerprints])
+      self._identities = set()
+
+      for fingerprint in self.fingerprints:
+        if not stem.util.tor_tools.is_valid_fingerprint(fingerprint):
+          raise ValueError("'%s' isn't a valid relay fingerprint" % fingerprint)
+
+        identity = base64.b64encode(binascii.unhexlify(stem.util.str_tools._to_bytes(fingerprint)))
+        self._identities.add(identity.rstrip(b"="))
+
+  def accepts_type(self, descriptor_type):
+    """
+    Checks if we want descriptors of the given type.
+
+    :param str descriptor_type: type of descriptor, such as 'server-descriptor'
+
+    :returns: **True** if we want descriptors of this type, **False** otherwise
+    """
+
+    return self.descriptor_types is None or descriptor_type in self.descriptor_types
+
+  def accepts_path(self, path):
+    """
+    Checks if a file or archive member might have descriptors that we want,
+    based on its name.
+
+    :param str path: path of the file or name of the archive member
+
+    :returns: **False** if the file is named for a time before our window,
+      **True** otherwise
+    """
+
+    if self.published_after is None or not path:
+      return True
+
+    filename = os.path.basename(path)
+
+    try:
+      timestamp_match = TIMESTAMP_NAME.search(filename)
+
+      if timestamp_match:
+        made_at = datetime.datetime(*map(int, timestamp_match.groups()))
+        return made_at >= self.published_after
+
+      month_match = MONTH_NAME.search(filename)
+
+      if month_match:
+        year, month = map(int, month_match.groups())
+
+        if not 1 <= month <= 12:
+          return True
+
+        month_end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+        return month_end > self.published_after
+    except ValueError:
+      pass  # not actually a date
+
+    return True
+
+  def accepts_content(self, content):
+    """
+    Checks the content of a server descriptor, extra-info descriptor, or router
+    status entry before it's parsed. This only looks at a few lines, so if
+    they're missing or malformed then we accept the descriptor and leave it to
+    :func:`~stem.descriptor.filters.DescriptorFilter.accepts` once it's
+    parsed.
+
+    :param bytes content: content of a single descriptor
+
+    :returns: **False** if the descriptor doesn't satisfy our criteria, **True**
+      otherwise
+    """
+
+    if self.published_after is None and self.published_before is None and self.fingerprints is None and self.flags is None:
+      return True
+
+    published, identity, fingerprint, flags = None, None, None, None
+
+    if content.startswith(b"r "):
+      # Router status entries start with an 'r' line of the form...
+      #
+      #   r nickname identity [digest] publication IP ORPort DirPort
+      #
+      # ... where the publication has both a date and time.
+
+      r_line = content[:content.find(b"\n")] if b"\n" in content else content
+      r_comp = r_line.split()
+
+      if len(r_comp) in (8, 9):
+        identity = r_comp[2]
+        published = r_comp[-5] + b" " + r_comp[-4]
+
+      if self.flags is not None:
+        flags_match = FLAGS_LINE.search(content)
+
+        if flags_match:
+          flags = set(stem.util.str_tools._to_unicode(flags_match.group(1)).split())
+    else:
+      if self.published_after is not None or self.published_before is not None:
+        published_match = PUBLISHED_LINE.search(content)
+
+        if published_match:
+          published = published_match.group(1)
+
+      if self.fingerprints is not None:
+        fingerprint_match = FINGERPRINT_LINE.search(content) or EXTRA_INFO_LINE.search(content)
+
+        if fingerprint_match:
+          fingerprint = stem.util.str_tools._to_unicode(fingerprint_match.group(1).replace(b" ", b"")).upper()
+
+    if published is not None:
+      try:
+        published = stem.util.str_tools._parse_timestamp(stem.util.str_tools._to_unicode(published).strip())
+      except ValueError:
+        published = None
+
+    if identity is not None and self._identities is not None and identity.rstrip(b"=") not in self._identities:
+      return False
+
+    return self._accepts(published, fingerprint, flags)
+
+  def accepts(self, desc):
+    """
+    Checks if a parsed descriptor satisfies our criteria. This doesn't check
+    its type, which is done for the file it came from.
+
+    :param stem.descriptor.__init__.Descriptor desc: descriptor to check
+
+    :returns: **True** if we want this descriptor, **False** otherwise
+    """
+
+    import stem.descriptor.networkstatus
+
+    if isinstance(desc, stem.descriptor.networkstatus.NetworkStatusDocument):
+      published = getattr(desc, 'valid_after', None) or getattr(desc, 'published', None)
+      return self._accepts(published, None, None)
+
+    flags = getattr(desc, 'flags', None)
+
+    return self._accepts(
+      getattr(desc, 'published', None),
+      getattr(desc, 'fingerprint', None),
+      set(flags) if flags is not None else None,
+    )
+
+  def _accepts(self, published, fingerprint, flags):
+    if published is not None:
+      if self.published_after is not None and published < self.published_after:
+        return False
+      elif self.published_before is not None and published > self.published_before:
+        return False
+
+    if fingerprint is not None and self.fingerprints is not None and fingerprint.upper() not in self.fingerprints:
+      return False
+
+    if flags is not None and self.flags is not None and not self.flags.issubset(flags):
+      return False
+
+    return True
+
+
+def _filter_descriptors(chunks, keyword, descriptor_filter):
+  """
+  Drops the descriptors that we don't want from chunks of a descriptor file,
+  such as those from :func:`~stem.descriptor.__init__._split_descriptor_file`.
+
+  :param iterator chunks: **bytes** with a series of descriptors, starting at
+    a descriptor boundary
+  :param bytes keyword: keyword that descriptors begin with
+  :param stem.descriptor.filters.DescriptorFilter descriptor_filter: criteria
+    for the descriptors that we want
+
+  :returns: iterator for **bytes** with each descriptor we might want
+  """
+
+  from stem.descriptor.dedup import _split_descriptors
+
+  for chunk in chunks:
+    for desc in _split_descriptors(chunk, keyword):
+      if descriptor_filter.accepts_content(desc):
+        yield desc
+
+
+def _filter_chunks(chunks, keyword, descriptor_filter):
+  """
+  Drops the descriptors that we don't want from chunks of a descriptor file,
+  like :func:`~stem.descriptor.filters._filter_descriptors` but keeping the
+  rest of each chunk together so it can be handed to a worker process.
+
+  :returns: iterator for **bytes** with the descriptors from each chunk that
+    we might want
+  """
+
+  for chunk in chunks:
+    accepted = list(_filter_descriptors((chunk,), keyword, descriptor_filter))
+
+    if accepted:
+      yield b"".join(accepted)
+
@@ -0,0 +1,310 @@
+# Copyright 2013, Damian Johnson
+# See LICENSE for licensing information
+
+"""
+Joins the router status entries of a consensus with the descriptors they
+reference. Entries of a microdescriptor flavored consensus reference the
+digest of a :class:`~stem.descriptor.microdescriptor.Microdescriptor`, other
+entries reference the digest of a
+:class:`~stem.descriptor.server_descriptor.ServerDescriptor`, and server
+descriptors in turn reference the digest of their
+:class:`~stem.descriptor.extrainfo_descriptor.ExtraInfoDescriptor`.
+
+::
+
+  from stem.descriptor import parse_file
+  from stem.descriptor.join import join
+
+  entries = parse_file('/home/atagar/.tor/cached-microdesc-consensus')
+  microdescriptors = parse_file('/home/atagar/.tor/cached-microdescs')
+
+  for relay in join(entries, microdescriptors):
+    print "%s: %s" % (relay.entry.nickname, relay.microdescriptor.exit_policy)
+
+Descriptors are read into a :class:`~stem.descriptor.join.DescriptorIndex`
+before we go through the entries. These keep a bounded number of descriptors
+in memory, and the rest are written to a SQLite database on disk. Indexes
+can also be made ahead of time and used for several consensuses...
+
+::
+
+  with DescriptorIndex() as server_descriptors:
+    server_descriptors.add(parse_file('/home/atagar/.tor/cached-descriptors'))
+
+    for path in consensus_paths:
+      for relay in join(parse_file(path), server_descriptors = server_descriptors):
+        print relay.server_descriptor.platform
+
+**Module Overview:**
+
+::
+
+  join - provides router status entries with the descriptors they reference
+
+  RelayView - router status entry with the descriptors it references
+
+  DescriptorIndex - descriptors by their digest
+    |- add - adds descriptors to the index
+    |- get - provides the descriptor with a digest
+    |- __contains__ - checks if we have a descriptor with a digest
+    +- close - closes our database
+"""
+
+import sqlite3
+
+import stem.descriptor
+import stem.descriptor.serialization
+
+from stem.descriptor.extrainfo_descriptor import ExtraInfoDescriptor
+from stem.descriptor.microdescriptor import Microdescriptor
+from stem.descriptor.router_status_entry import RouterStatusEntryMicroV3
+from stem.descriptor.server_descriptor import ServerDescriptor
+
+try:
+  # added in python 2.7
+  from collections import OrderedDict
+except ImportError:
+  from stem.util.ordereddict import OrderedDict
+
+# Number of descriptors an index keeps in memory by default, and the number
+# of descriptors we write to disk with each executemany() call.
+
+INDEX_SIZE = 100000
+SPILL_BATCH_SIZE = 1000
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS descriptors (digest TEXT PRIMARY KEY, content BLOB NOT NULL)"
+
+
+class RelayView(object):
+  """
+  Router status entry along with the descriptors that it references. These
+  are **None** if we don't have them.
+
+  :var RouterStatusEntry entry: relay's entry in the consensus
+  :var ServerDescriptor server_descriptor: server descriptor that the entry
+    references
+  :var ExtraInfoDescriptor extrainfo_descriptor: extra-info descriptor that
+    the server descriptor references
+  :var Microdescriptor microdescriptor: microdescriptor that the entry
+    references
+  """
+
+  def __init__(self, entry, server_descriptor = None, extrainfo_descriptor = None, microdescriptor = None):
+    self.entry = entry
+    self.server_descriptor = server_descriptor
+    self.extrainfo_descriptor = extrainfo_descriptor
+    self.microdescriptor = microdescriptor
+
+  def __repr__(self):
+    return "<RelayView %s>" % getattr(self.entry, 'fingerprint', None)
+
+
+class DescriptorIndex(object):
+  """
+  Descriptors by their digest, with bounded memory usage. Once we have more
+  than **size** descriptors the oldest are serialized to a SQLite database,
+  and read back if they're requested. This can be used as a context manager,
+  in which case the database is closed when we're done.
+
+  :param int size: maximum number of descriptors to keep in memory
+  :param str path: location for the descriptors we write to disk, a
+    temporary database that's removed when we're closed is used if **None**
+  """
+
+  def __init__(self, size = INDEX_SIZE, path = None):
+    self.size = size
+    self.path = path
+
+    self._descriptors = OrderedDict()
+    self._pending = {}  # spilled descriptors we've yet to write
+    self._connection = None
+
+  def add(self, descriptors):
+    """
+    Adds descriptors to the index. Descriptors without a digest are skipped,
+    and ones with a digest we already have replace it.
+
+    :param iterable descriptors: descriptors to be added, this can be a single
+      :class:`~stem.descriptor.__init__.Descriptor`
+
+    :returns: **int** for the number of descriptors that were added
+
+    :raises:
+      * **ValueError** if a descriptor can't be written to disk
+      * **IOError** if unable to write to our database
+    """
+
+    if isinstance(descriptors, stem.descriptor.Descriptor):
+      descriptors = (descriptors,)
+
+    added = 0
+
+    for desc in descriptors:
+      digest = _get_digest(desc)
+
+      if digest is None:
+        continue
+
+      self._descriptors.pop(digest, None)
+      self._descriptors[digest] = desc
+      added += 1
+
+      if len(self._descriptors) > self.size:
+        spilled_digest, spilled_desc = self._descriptors.popitem(last = False)
+        self._pending[spilled_digest] = stem.descriptor.serialization.serialize(spilled_desc)
+
+        if len(self._pending) >= SPILL_BATCH_SIZE:
+          self._flush()
+
+    return added
+
+  def get(self, digest, default = None):
+    """
+    Provides the descriptor with the given digest.
+
+    :param str digest: hex encoded digest of the descriptor
+    :param object default: response if we don't have the descriptor
+
+    :returns: :class:`~stem.descriptor.__init__.Descriptor` with the digest,
+      or the default if we don't have it
+    """
+
+    if digest is None:
+      return default
+
+    digest = digest.upper()
+    desc = self._descriptors.get(digest)
+
+    if desc is not None:
+      return desc
+
+    content = self._pending.get(digest)
+
+    if content is None and self._connection is not None:
+      row = self._connection.execute("SELECT content FROM descriptors WHERE digest = ?", (digest,)).fetchone()
+
+      if row is not None:
+        content = bytes(row[0])
+
+    if content is None:
+      return default
+
+    return stem.descriptor.serialization.deserialize(content)
+
+  def close(self):
+    """
+    Closes our database.
+    """
+
+    if self._connection is not None:
+      self._connection.close()
+      self._connection = None
+
+  def _flush(self):
+    try:
+      if self._connection is None:
+        # SQLite makes a temporary database on disk when given an empty path
+
+        self._connection = sqlite3.connect(self.path if self.path else "")
+        self._connection.execute(SCHEMA)
+
+      with self._connection:
+        self._connection.executemany("INSERT OR REPLACE INTO descriptors (digest, content) VALUES (?, ?)", [(digest, sqlite3.Binary(content)) for (digest, content) in self._pending.items()])
+
+      self._pending = {}
+    except sqlite3.Error as exc:
+      raise IOError("Unable to write descriptors to %s: %s" % (self.path if self.path else "a temporary database", exc))
+
+  def __contains__(self, digest):
+    return self.get(digest) is not None
+
+  def __len__(self):
+    spilled = 0
+
+    if self._connection is not None:
+      spilled = self._connection.execute("SELECT COUNT(*) FROM descriptors").fetchone()[0]
+
+    return len(self._descriptors) + len(self._pending) + spilled
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exit_type, value, traceback):
+    self.close()
+
+
+def join(entries, descriptors = (), server_descriptors = None, extrainfo_descriptors = None, microdescriptors = None, size = INDEX_SIZE):
+  """
+  Provides router status entries along with the descriptors that they
+  reference. We first read the descriptors into indexes by their digest, then
+  go through the entries in a single pass.
+
+  :param iterable entries: router status entries to join, this can also be a
+    :class:`~stem.descriptor.networkstatus.NetworkStatusDocument`
+  :param iterable descriptors: any mix of server descriptors, extra-info
+    descriptors, and microdescriptors that the entries might reference
+  :param DescriptorIndex server_descriptors: index of server descriptors to
+    use in addition to our descriptors
+  :param DescriptorIndex extrainfo_descriptors: index of extra-info
+    descriptors to use in addition to our descriptors
+  :param DescriptorIndex microdescriptors: index of microdescriptors to use in
+    addition to our descriptors
+  :param int size: maximum number of each type of descriptor to keep in
+    memory
+
+  :returns: iterator for a :class:`~stem.descriptor.join.RelayView` of each
+    entry
+
+  :raises:
+    * **ValueError** if the descriptors include a type that entries don't
+      reference
+    * **IOError** if unable to write descriptors to disk
+  """
+
+  if hasattr(entries, 'routers'):
+    entries = entries.routers.values()
+
+  if isinstance(descriptors, stem.descriptor.Descriptor):
+    descriptors = (descriptors,)
+
+  indexes, made_indexes = [], []
+
+  for index in (server_descriptors, extrainfo_descriptors, microdescriptors):
+    if index is None:
+      index = DescriptorIndex(size)
+      made_indexes.append(index)
+
+    indexes.append(index)
+
+  server_index, extrainfo_index, micro_index = indexes
+
+  try:
+    for desc in descriptors:
+      if isinstance(desc, ServerDescriptor):
+        server_index.add(desc)
+      elif isinstance(desc, ExtraInfoDescriptor):
+        extrainfo_index.add(desc)
+      elif isinstance(desc, Microdescriptor):
+        micro_index.add(desc)
+      else:
+        raise ValueError("Router status entries don't reference %s instances" % type(desc).__name__)
+
+    for entry in entries:
+      if isinstance(entry, RouterStatusEntryMicroV3):
+        yield RelayView(entry, microdescriptor = micro_index.get(entry.digest))
+      else:
+        server_desc = server_index.get(entry.digest)
+        extrainfo_desc = extrainfo_index.get(server_desc.extra_info_digest) if server_desc else None
+        yield RelayView(entry, server_desc, extrainfo_desc)
+  finally:
+    for index in made_indexes:
+      index.close()
+
+
+def _get_digest(desc):
+  digest = getattr(desc, 'digest', None)
+
+  if callable(digest):
+    digest = digest()
+
+  return digest.upper() if digest else None
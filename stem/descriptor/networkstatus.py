@@ -44,17 +44,36 @@ For more information see :func:`~stem.descriptor.__init__.DocumentHandler`...
   KeyCertificate - Certificate used to authenticate an authority
   DocumentSignature - Signature of a document by a directory authority
   DirectoryAuthority - Directory authority as defined in a v3 network status document
+
+  RouterIndex - Random access to the router status entries of a v3 document
+    |- get_entry - provides the router status entry for a relay
+    |- get_entries - provides the router status entries for several relays
+    |- get_document - provides the document without its router status entries
+    |- fingerprints - provides the fingerprints of the relays in the document
+    +- close - releases the document
 """
 
-import datetime
+import collections
 import io
+import mmap
+import os
+import tempfile
 
 import stem.descriptor
 import stem.descriptor.router_status_entry
+import stem.prereq
 import stem.util.str_tools
 import stem.util.tor_tools
 import stem.version
 
+from stem.util import log
+
+try:
+  # added in python 2.7
+  from collections import OrderedDict
+except ImportError:
+  from stem.util.ordereddict import OrderedDict
+
 # Version 2 network status document fields, tuples of the form...
 # (keyword, is_mandatory)
 
@@ -145,8 +164,19 @@ BANDWIDTH_WEIGHT_ENTRIES = (
   "Wmb", "Wmd", "Wme", "Wmg", "Wmm",
 )
 
+# Sidecar files of a RouterIndex. Its first line identifies the format, and its
+# second has the size and modification time of the document it was made from.
+
+ROUTER_INDEX_SUFFIX = ".index"
+ROUTER_INDEX_HEADER = b"router-index 2"
+
+# Number of router status entries that each of our workers parse at a time
+# when loading a document's routers in parallel.
 
-def _parse_file(document_file, document_type = None, validate = True, is_microdescriptor = False, document_handler = stem.descriptor.DocumentHandler.ENTRIES):
+ROUTER_CHUNK_SIZE = 500
+
+
+def _parse_file(document_file, document_type = None, validate = True, is_microdescriptor = False, document_handler = stem.descriptor.DocumentHandler.ENTRIES, entry_filter = None):
   """
   Parses a network status and iterates over the RouterStatusEntry in it. The
   document that these instances reference have an empty 'routers' attribute to
@@ -160,6 +190,8 @@ def _parse_file(document_file, document_type = None, validate = True, is_microde
     consensus, **False** otherwise
   :param stem.descriptor.__init__.DocumentHandler document_handler: method in
     which to parse :class:`~stem.descriptor.networkstatus.NetworkStatusDocument`
+  :param functor entry_filter: if provided, router status entries are only
+    parsed if this returns **True** for their content
 
   :returns: :class:`stem.descriptor.networkstatus.NetworkStatusDocument` object
 
@@ -214,6 +246,7 @@ def _parse_file(document_file, document_type = None, validate = True, is_microde
       start_position = routers_start,
       end_position = routers_end,
       extra_args = (document_type(document_content, validate),),
+      entry_filter = entry_filter,
     )
 
     for desc in desc_iterator:
@@ -222,6 +255,54 @@ def _parse_file(document_file, document_type = None, validate = True, is_microde
     raise ValueError("Unrecognized document_handler: %s" % document_handler)
 
 
+def _read_router_offsets(document_file, validate = True):
+  """
+  Reads through the router status entries starting at our present position,
+  noting where each of them are without parsing them. When finished the
+  document is left at the end of the routers section.
+
+  :param file document_file: file with network status document content
+  :param bool validate: if **False** then entries without a fingerprint are
+    noted under **None** rather than raising an exception
+
+  :returns: **OrderedDict** of fingerprint => (offset, length) for the entries
+
+  :raises:
+    * **ValueError** if an 'r' line doesn't have a fingerprint and validate
+      is **True**
+    * **IOError** if the file can't be read
+  """
+
+  offsets = OrderedDict()
+  fingerprint, entry_start = None, None
+
+  while True:
+    position = document_file.tell()
+    line = document_file.readline()
+
+    if line.startswith(b"r ") or line.startswith(b"r\t") or not line or line.startswith(b"directory-footer") or line.startswith(b"directory-signature"):
+      if entry_start is not None:
+        offsets[fingerprint] = (entry_start, position - entry_start)
+
+      if not line.startswith(b"r"):
+        document_file.seek(position)
+        return offsets
+
+      # The second value of the 'r' line is the relay's base64 identity, with
+      # its trailing equal sign stripped.
+
+      r_comp = line.split()
+
+      if len(r_comp) > 2:
+        fingerprint = stem.descriptor.router_status_entry._base64_to_hex(stem.util.str_tools._to_unicode(r_comp[2]), validate)
+      elif validate:
+        raise ValueError("Router status entry's 'r' line lacks a fingerprint: %s" % stem.util.str_tools._to_unicode(line.strip()))
+      else:
+        fingerprint = None
+
+      entry_start = position
+
+
 class NetworkStatusDocument(stem.descriptor.Descriptor):
   """
   Common parent for network status documents.
@@ -375,7 +456,7 @@ class NetworkStatusDocumentV2(NetworkStatusDocument):
             self.server_versions.append(version_str)
       elif keyword == "published":
         try:
-          self.published = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+          self.published = stem.util.str_tools._parse_timestamp(value)
         except ValueError:
           if validate:
             raise ValueError("Version 2 network status document's 'published' time wasn't parsable: %s" % value)
@@ -414,8 +495,9 @@ class NetworkStatusDocumentV3(NetworkStatusDocument):
   """
   Version 3 network status document. This could be either a vote or consensus.
 
-  :var tuple routers: :class:`~stem.descriptor.router_status_entry.RouterStatusEntryV3`
-    contained in the document
+  :var dict routers: fingerprint => :class:`~stem.descriptor.router_status_entry.RouterStatusEntryV3`
+    mapping for the relays in the document, this is parsed as it's used if
+    the document has **lazy_routers**
 
   :var int version: **\*** document version
   :var str version_flavor: **\*** flavor associated with the document (such as 'microdesc')
@@ -454,14 +536,23 @@ class NetworkStatusDocumentV3(NetworkStatusDocument):
   a default value, others are left as None if undefined
   """
 
-  def __init__(self, raw_content, validate = True, default_params = True):
+  def __init__(self, raw_content, validate = True, default_params = True, lazy_routers = False):
     """
     Parse a v3 network status document.
 
+    Parsing the router status entries is most of the work, so if you only need
+    the document's header and footer or a few relays then you might want
+    **lazy_routers**. Entries are then parsed as they're retrieved from our
+    routers mapping, and any that are malformed raise a **ValueError** at that
+    time rather than when the document is constructed. The remaining entries
+    can be parsed with a pool of processes by calling **routers.load(workers)**.
+
     :param str raw_content: raw network status document data
     :param bool validate: **True** if the document is to be validated, **False** otherwise
     :param bool default_params: includes defaults in our params dict, otherwise
       it just contains values from the document
+    :param bool lazy_routers: parses router status entries only when they're
+      used if **True**
 
     :raises: **ValueError** if the document is invalid
     """
@@ -492,16 +583,19 @@ class NetworkStatusDocumentV3(NetworkStatusDocument):
     else:
       router_type = stem.descriptor.router_status_entry.RouterStatusEntryMicroV3
 
-    router_iter = stem.descriptor.router_status_entry._parse_file(
-      document_file,
-      validate,
-      entry_class = router_type,
-      entry_keyword = ROUTERS_START,
-      section_end_keywords = (FOOTER_START, V2_FOOTER_START),
-      extra_args = (self,),
-    )
+    if lazy_routers:
+      self.routers = _LazyRouters(self, router_type, validate, _read_router_offsets(document_file, validate))
+    else:
+      router_iter = stem.descriptor.router_status_entry._parse_file(
+        document_file,
+        validate,
+        entry_class = router_type,
+        entry_keyword = ROUTERS_START,
+        section_end_keywords = (FOOTER_START, V2_FOOTER_START),
+        extra_args = (self,),
+      )
 
-    self.routers = dict((desc.fingerprint, desc) for desc in router_iter)
+      self.routers = dict((desc.fingerprint, desc) for desc in router_iter)
 
     self._footer = _DocumentFooter(document_file, validate, self._header)
 
@@ -541,6 +635,106 @@ class NetworkStatusDocumentV3(NetworkStatusDocument):
     return self._compare(other, lambda s, o: s <= o)
 
 
+class _LazyRouters(collections.Mapping):
+  """
+  Mapping of fingerprints to the router status entries of a document, which
+  are parsed when they're first retrieved.
+
+  :param stem.descriptor.networkstatus.NetworkStatusDocumentV3 document:
+    document that the entries are within
+  :param class router_type: router status entry class for the entries
+  :param bool validate: checks the validity of the entries if **True**
+  :param OrderedDict offsets: fingerprint => (offset, length) for each entry
+    within the document's content
+  """
+
+  def __init__(self, document, router_type, validate, offsets):
+    self._document = document
+    self._router_type = router_type
+    self._validate = validate
+    self._offsets = offsets
+    self._entries = {}
+
+  def load(self, workers = None):
+    """
+    Parses all of the entries that we haven't yet.
+
+    :param int workers: number of processes to parse with, if **None** then
+      this is done in our own process
+
+    :raises: **ValueError** if an entry is malformed and we're validating
+    """
+
+    unparsed = [fingerprint for fingerprint in self._offsets if fingerprint not in self._entries]
+
+    if not workers:
+      for fingerprint in unparsed:
+        self[fingerprint]
+
+      return
+
+    content = self._document.get_bytes()
+    chunks = []
+
+    for i in xrange(0, len(unparsed), ROUTER_CHUNK_SIZE):
+      chunk = []
+
+      for fingerprint in unparsed[i:i + ROUTER_CHUNK_SIZE]:
+        offset, length = self._offsets[fingerprint]
+        chunk.append(content[offset:offset + length])
+
+      chunks.append(chunk)
+
+    parser_args = (self._router_type, self._validate, _DocumentStatus(self._document))
+    entries = stem.descriptor._parse_with_workers(chunks, parser_args, workers, True, _parse_router_chunk)
+
+    for fingerprint, entry in zip(unparsed, entries):
+      entry.document = self._document
+      self._entries[fingerprint] = entry
+
+  def __getitem__(self, fingerprint):
+    entry = self._entries.get(fingerprint)
+
+    if entry is None:
+      offset, length = self._offsets[fingerprint]
+      content = self._document.get_bytes()[offset:offset + length]
+
+      entry = self._router_type(content, self._validate, self._document)
+      self._entries[fingerprint] = entry
+
+    return entry
+
+  def __contains__(self, fingerprint):
+    return fingerprint in self._offsets
+
+  def __iter__(self):
+    return iter(self._offsets)
+
+  def __len__(self):
+    return len(self._offsets)
+
+
+class _DocumentStatus(object):
+  """
+  Stand-in for a document while its router status entries are parsed in
+  worker processes, which would otherwise need the whole document pickled
+  along with them. Entries only check if their document is a vote or
+  consensus while they're being parsed.
+  """
+
+  def __init__(self, document):
+    self.is_vote = document.is_vote
+    self.is_consensus = document.is_consensus
+    self.is_microdescriptor = document.is_microdescriptor
+
+
+def _parse_router_chunk(chunk, router_type, validate, document_status):
+  # Runs within our worker processes, parsing a list of router status entries.
+  # The caller then replaces their document_status with the actual document.
+
+  return [router_type(content, validate, document_status) for content in chunk]
+
+
 class _DocumentHeader(object):
   def __init__(self, document_file, validate, default_params):
     self.version = None
@@ -651,7 +845,7 @@ class _DocumentHeader(object):
           raise ValueError("A network status document's consensus-method must be an integer, but was '%s'" % value)
       elif keyword in ('published', 'valid-after', 'fresh-until', 'valid-until'):
         try:
-          date_value = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+          date_value = stem.util.str_tools._parse_timestamp(value)
 
           if keyword == 'published':
             self.published = date_value
@@ -1302,7 +1496,7 @@ class KeyCertificate(stem.descriptor.Descriptor):
         # "dir-key-expires" YYYY-MM-DD HH:MM:SS
 
         try:
-          date_value = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+          date_value = stem.util.str_tools._parse_timestamp(value)
 
           if keyword == 'dir-key-published':
             self.published = date_value
@@ -1427,7 +1621,7 @@ class BridgeNetworkStatusDocument(NetworkStatusDocument):
       published_line = published_line.split(" ", 1)[1].strip()
 
       try:
-        self.published = datetime.datetime.strptime(published_line, "%Y-%m-%d %H:%M:%S")
+        self.published = stem.util.str_tools._parse_timestamp(published_line)
       except ValueError:
         if validate:
           raise ValueError("Bridge network status document's 'published' time wasn't parsable: %s" % published_line)
@@ -1442,3 +1636,234 @@ class BridgeNetworkStatusDocument(NetworkStatusDocument):
     )
 
     self.routers = dict((desc.fingerprint, desc) for desc in router_iter)
+
+
+class RouterIndex(object):
+  """
+  Random access to the router status entries of a v3 network status document
+  on disk. This notes where each relay's entry is within the document so we
+  can parse only the ones that we want, rather than the thousands that a
+  consensus contains.
+
+  Offsets are saved to a file next to the document, so after the first time a
+  document is indexed we don't need to read it again. The index is rebuilt if
+  the document has changed since then.
+
+  ::
+
+    from stem.descriptor.networkstatus import RouterIndex
+
+    with RouterIndex('/home/atagar/.tor/cached-consensus') as index:
+      entry = index.get_entry('9695DFC35FFEB861329B9F1AB04C46397020CE31')
+      print entry.nickname
+
+  :param str path: location of the network status document
+  :param bool validate: checks the validity of the document's contents if
+    **True**, skips these checks otherwise
+  :param str index_path: location of the index, this defaults to the
+    document's path with a **.index** suffix
+
+  :raises:
+    * **ValueError** if the document's contents are malformed
+    * **IOError** if the document can't be read
+  """
+
+  def __init__(self, path, validate = True, index_path = None):
+    self.path = path
+    self.validate = validate
+    self.index_path = index_path if index_path else path + ROUTER_INDEX_SUFFIX
+
+    self._document = None
+    self._content = None
+    self._document_file = open(path, 'rb')
+
+    try:
+      document_stat = os.fstat(self._document_file.fileno())
+      self._content = mmap.mmap(self._document_file.fileno(), 0, access = mmap.ACCESS_READ) if document_stat.st_size else b""
+      self._identity = (document_stat.st_size, document_stat.st_mtime)
+
+      index = self._load_index()
+
+      if index is None:
+        index = self._build_index()
+        self._save_index(index)
+
+      self._document_start, self._routers_start, self._routers_end, self._offsets = index
+    except:
+      self.close()
+      raise
+
+  def get_entry(self, fingerprint):
+    """
+    Provides the router status entry for a relay.
+
+    :param str fingerprint: fingerprint of the relay
+
+    :returns: :class:`~stem.descriptor.router_status_entry.RouterStatusEntryV3`
+      or :class:`~stem.descriptor.router_status_entry.RouterStatusEntryMicroV3`
+      for the relay, **None** if it isn't in the document
+
+    :raises: **ValueError** if the entry is malformed and validate is **True**
+    """
+
+    offset = self._offsets.get(fingerprint.upper())
+
+    if offset is None:
+      return None
+
+    document = self.get_document()
+    entry_start, entry_length = offset
+
+    if document.is_microdescriptor:
+      router_type = stem.descriptor.router_status_entry.RouterStatusEntryMicroV3
+    else:
+      router_type = stem.descriptor.router_status_entry.RouterStatusEntryV3
+
+    entry = router_type(self._content[entry_start:entry_start + entry_length], self.validate, document)
+    entry._set_path(os.path.abspath(self.path))
+    return entry
+
+  def get_entries(self, fingerprints):
+    """
+    Provides the router status entries for several relays.
+
+    :param list fingerprints: fingerprints of the relays
+
+    :returns: **dict** of fingerprint => router status entry for the relays
+      that are in the document
+
+    :raises: **ValueError** if an entry is malformed and validate is **True**
+    """
+
+    entries = {}
+
+    for fingerprint in fingerprints:
+      entry = self.get_entry(fingerprint)
+
+      if entry is not None:
+        entries[fingerprint] = entry
+
+    return entries
+
+  def get_document(self):
+    """
+    Provides the document without its router status entries, like the
+    :data:`~stem.descriptor.__init__.DocumentHandler` **BARE_DOCUMENT**. This
+    is what router status entries we provide refer to.
+
+    :returns: :class:`~stem.descriptor.networkstatus.NetworkStatusDocumentV3`
+      without a populated **routers** attribute
+
+    :raises: **ValueError** if the document is malformed and validate is **True**
+    """
+
+    if self._document is None:
+      content = self._content[self._document_start:self._routers_start] + self._content[self._routers_end:]
+      self._document = NetworkStatusDocumentV3(content, self.validate)
+      self._document._set_path(os.path.abspath(self.path))
+
+    return self._document
+
+  def fingerprints(self):
+    """
+    Provides the fingerprints of the relays in the document.
+
+    :returns: **list** of relay fingerprints, in the order they appear
+    """
+
+    return list(self._offsets.keys())
+
+  def close(self):
+    """
+    Releases the document.
+    """
+
+    if isinstance(self._content, mmap.mmap):
+      self._content.close()
+
+    self._document_file.close()
+
+  def _build_index(self):
+    # reads through the document once, noting where it starts (after any
+    # annotations such as CollecTor's '@type' line), where its routers section
+    # starts and ends, and each of the entries within it
+
+    content_file = self._content if self._content else io.BytesIO(self._content)
+    content_file.seek(0)
+
+    while True:
+      document_start = content_file.tell()
+
+      if not content_file.readline().startswith(b"@"):
+        break
+
+    content_file.seek(document_start)
+
+    stem.descriptor._read_until_keywords((ROUTERS_START, FOOTER_START, V2_FOOTER_START), content_file, skip = True)
+    routers_start = content_file.tell()
+    offsets = _read_router_offsets(content_file)
+    routers_end = content_file.tell()
+
+    return document_start, routers_start, routers_end, offsets
+
+  def _load_index(self):
+    # provides the index we saved earlier, or None if it's missing or stale
+
+    try:
+      with open(self.index_path, 'rb') as index_file:
+        lines = index_file.read().splitlines()
+    except IOError:
+      return None
+
+    try:
+      if lines[0] != ROUTER_INDEX_HEADER:
+        return None
+
+      size, mtime, document_start, routers_start, routers_end = lines[1].split()
+
+      if (int(size), float(mtime)) != self._identity:
+        return None
+
+      offsets = OrderedDict()
+
+      for line in lines[2:]:
+        fingerprint, offset, length = line.split()
+        if stem.prereq.is_python_3():
+          fingerprint = stem.util.str_tools._to_unicode(fingerprint)
+
+        offsets[fingerprint] = (int(offset), int(length))
+
+      return int(document_start), int(routers_start), int(routers_end), offsets
+    except (IndexError, ValueError):
+      log.info("Router index at %s is malformed, rebuilding it" % self.index_path)
+      return None
+
+  def _save_index(self, index):
+    document_start, routers_start, routers_end, offsets = index
+
+    lines = [
+      ROUTER_INDEX_HEADER,
+      stem.util.str_tools._to_bytes("%i %r %i %i %i" % (self._identity + (document_start, routers_start, routers_end))),
+    ]
+
+    for fingerprint, (offset, length) in offsets.items():
+      lines.append(stem.util.str_tools._to_bytes("%s %i %i" % (fingerprint, offset, length)))
+
+    # writing to a temporary file first so other readers never see a
+    # partially written index
+
+    try:
+      index_fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(self.index_path)), suffix = ".tmp")
+
+      with os.fdopen(index_fd, 'wb') as index_file:
+        index_file.write(b"\n".join(lines) + b"\n")
+
+      os.rename(tmp_path, self.index_path)
+    except (IOError, OSError) as exc:
+      log.info("Unable to save router index to %s: %s" % (self.index_path, exc))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exit_type, value, traceback):
+    self.close()
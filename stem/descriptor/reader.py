@@ -52,16 +52,62 @@ and picks up where it left off if ran again...
 
   save_processed_files("/tmp/used_descriptors", reader.get_processed_files())
 
+Files that are a series of descriptors which tor appends to (such as its
+cached-microdescs.new and cached-extrainfo.new) are also tracked by how far
+we've read them. When these grow we only read what's been appended, and if
+they're rewritten we read them again from the start. These positions are
+persisted along with the processed files...
+
+::
+
+  save_processed_files("/tmp/used_descriptors", reader.get_processed_files(), reader.get_file_positions())
+
+Rather than reading our targets repeatedly, a reader can follow them. It then
+keeps running after reading everything that's there, providing descriptors
+from new or changed files as they land until it's stopped. On Linux we're
+notified of changes through inotify, and elsewhere we check for them every
+FOLLOW_INTERVAL seconds...
+
+::
+
+  with DescriptorReader(["/home/atagar/.tor"], follow = True, persistence_path = "/tmp/used_descriptors") as reader:
+    for descriptor in reader:
+      print descriptor  # runs until interrupted
+
+Parsing is usually the bottleneck when reading large collections such as
+`CollecTor <https://collector.torproject.org/>`_ archives. With the processes
+argument files and archive members are parsed by a pool of worker processes,
+while descriptors are still provided in the same order as if we'd read them
+ourselves...
+
+::
+
+  with DescriptorReader(my_descriptors, processes = 4) as reader:
+    for descriptor in reader:
+      print descriptor
+
+Archives and tor's data directory often have the same descriptors. These can
+be skipped by providing a :class:`~stem.descriptor.dedup.DigestSet` of the
+descriptors we've already read.
+
+If you only want some of the descriptors, such as those published within a
+time window or for certain relays, then provide a
+:class:`~stem.descriptor.filters.DescriptorFilter`. Files and archive members
+that its criteria rule out are skipped without being parsed.
+
 **Module Overview:**
 
 ::
 
   load_processed_files - Loads a listing of processed files
+  load_file_positions - Loads how far we've read processed files
   save_processed_files - Saves a listing of processed files
 
   DescriptorReader - Iterator for descriptor data on the local file system
     |- get_processed_files - provides the listing of files that we've processed
     |- set_processed_files - sets our tracking of the files we have processed
+    |- get_file_positions - provides how far we've read appendable files
+    |- set_file_positions - sets how far we've read appendable files
     |- register_read_listener - adds a listener for when files are read
     |- register_skip_listener - adds a listener that's notified of skipped files
     |- start - begins reading descriptor data
@@ -77,18 +123,86 @@ and picks up where it left off if ran again...
        +- FileMissing - File does not exist
 """
 
+import collections
+import hashlib
+import io
 import mimetypes
 import os
-import Queue
+import re
+import select
+import stat
+import struct
+import sys
 import tarfile
 import threading
+import time
 
 import stem.descriptor
 import stem.prereq
+import stem.util.str_tools
+
+try:
+  # added in python 3.5, and available as a separate module for earlier
+  # versions
+  from os import scandir as _scandir
+except ImportError:
+  try:
+    from scandir import scandir as _scandir
+  except ImportError:
+    _scandir = None
 
 # flag to indicate when the reader thread is out of descriptor files to read
 FINISHED = "DONE"
 
+# Our reader thread hands descriptors to the iterator in batches of what it
+# reads within BATCH_LATENCY seconds. Batches are also limited to
+# MAX_BATCH_SIZE descriptors, and half of our buffer_size and
+# max_buffer_bytes.
+
+BATCH_LATENCY = 0.005
+MAX_BATCH_SIZE = 1000
+
+# Bytes from the start of a file, and before the position we've read to, that
+# we hash to check if the content we've read is unchanged.
+
+POSITION_DIGEST_WINDOW = 4096
+
+# How often we check for changes when following our targets without inotify.
+# This is also how long stop() can take when following them.
+
+FOLLOW_INTERVAL = 1.0
+
+# inotify events that we watch directories for...
+#
+#   IN_CLOSE_WRITE - a file that was opened for writing is closed
+#   IN_MOVED_TO - a file was moved into the directory
+#   IN_CREATE - a file was made, we only use these for new subdirectories
+#
+# ... and flags it can report.
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+TYPE_ANNOTATION = re.compile(b"^@type (\S+) (\d+)\.(\d+)$")
+
+# We read this much of a descriptor file's first line to check it for an
+# @type annotation, and this much of other files to check if they're a
+# tarball. Uncompressed tarballs have 'ustar' at TAR_MAGIC_OFFSET, and
+# compressed ones start with the magic bytes of their compression.
+
+TYPE_ANNOTATION_SIZE = 1024
+TAR_HEADER_SIZE = 512
+TAR_MAGIC_OFFSET = 257
+COMPRESSED_MAGIC = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
+POSITION_DIGEST = re.compile("^[0-9a-fA-F]{40}$")
+
 
 class FileSkipped(Exception):
   "Base error when we can't provide descriptor data from a file."
@@ -170,7 +284,30 @@ def load_processed_files(path):
     * **TypeError** if unable to parse the file's contents
   """
 
-  processed_files = {}
+  return _load_listing(path)[0]
+
+
+def load_file_positions(path):
+  """
+  Loads a dictionary of 'path => (offset, digest, tail size)' mappings for how
+  far we've read files, as persisted by
+  :func:`~stem.descriptor.reader.save_processed_files`.
+
+  :param str path: location to load the processed files dictionary from
+
+  :returns: **dict** of 'path (**str**) => (offset (**int**), digest
+    (**str**), tail size (**int**))' mappings
+
+  :raises:
+    * **IOError** if unable to read the file
+    * **TypeError** if unable to parse the file's contents
+  """
+
+  return _load_listing(path)[1]
+
+
+def _load_listing(path):
+  processed_files, positions = {}, {}
 
   with open(path) as input_file:
     for line in input_file.readlines():
@@ -182,7 +319,19 @@ def load_processed_files(path):
       if not " " in line:
         raise TypeError("Malformed line: %s" % line)
 
-      path, timestamp = line.rsplit(" ", 1)
+      # lines are either 'path timestamp' or 'path timestamp offset digest',
+      # the later optionally followed by the size of the file's last descriptor
+
+      fields = line.rsplit(" ", 4)
+
+      if len(fields) == 5 and fields[1].isdigit() and fields[2].isdigit() and POSITION_DIGEST.match(fields[3]) and fields[4].isdigit():
+        path, timestamp, offset, digest, tail_size = fields
+        positions[path] = (int(offset), digest.upper(), int(tail_size))
+      elif len(fields) >= 4 and fields[-3].isdigit() and fields[-2].isdigit() and POSITION_DIGEST.match(fields[-1]):
+        path, timestamp, offset, digest = line.rsplit(" ", 3)
+        positions[path] = (int(offset), digest.upper(), 0)
+      else:
+        path, timestamp = line.rsplit(" ", 1)
 
       if not os.path.isabs(path):
         raise TypeError("'%s' is not an absolute path" % path)
@@ -191,19 +340,23 @@ def load_processed_files(path):
 
       processed_files[path] = int(timestamp)
 
-  return processed_files
+  return processed_files, positions
 
 
-def save_processed_files(path, processed_files):
+def save_processed_files(path, processed_files, positions = None):
   """
   Persists a dictionary of 'path => last modified timestamp' mappings (as
   provided by the DescriptorReader's
   :func:`~stem.descriptor.reader.DescriptorReader.get_processed_files` method)
   so that they can be loaded later and applied to another
-  :class:`~stem.descriptor.reader.DescriptorReader`.
+  :class:`~stem.descriptor.reader.DescriptorReader`. How far we've read files
+  (from :func:`~stem.descriptor.reader.DescriptorReader.get_file_positions`)
+  can be saved with them.
 
   :param str path: location to save the processed files dictionary to
   :param dict processed_files: 'path => last modified' mappings
+  :param dict positions: 'path => (offset, digest, tail size)' mappings for
+    files in the processed_files
 
   :raises:
     * **IOError** if unable to write to the file
@@ -224,7 +377,14 @@ def save_processed_files(path, processed_files):
       if not os.path.isabs(path):
         raise TypeError("Only absolute paths are acceptable: %s" % path)
 
-      output_file.write("%s %i\n" % (path, timestamp))
+      position = positions.get(path) if positions else None
+
+      if position and len(position) > 2 and position[2]:
+        output_file.write("%s %i %i %s %i\n" % (path, timestamp, position[0], position[1], position[2]))
+      elif position:
+        output_file.write("%s %i %i %s\n" % (path, timestamp, position[0], position[1]))
+      else:
+        output_file.write("%s %i\n" % (path, timestamp))
 
 
 class DescriptorReader(object):
@@ -234,12 +394,17 @@ class DescriptorReader(object):
 
   By default this limits the number of descriptors that we'll read ahead before
   waiting for our caller to fetch some of them. This is included to avoid
-  unbounded memory usage.
+  unbounded memory usage. Descriptors vary a lot in size (a hundred
+  microdescriptors are tiny, while a hundred votes can be gigabytes), so the
+  read ahead can also be limited by the size of the buffered descriptors'
+  content with max_buffer_bytes. A descriptor larger than this is still
+  provided, but only once everything before it has been read.
 
   Our persistence_path argument is a convenient method to persist the listing
   of files we have processed between runs, however it doesn't allow for error
   handling. If you want that then use the
-  :func:`~stem.descriptor.reader.load_processed_files` and
+  :func:`~stem.descriptor.reader.load_processed_files`,
+  :func:`~stem.descriptor.reader.load_file_positions`, and
   :func:`~stem.descriptor.reader.save_processed_files` functions instead.
 
   :param str,list target: path or list of paths for files or directories to be read from
@@ -249,13 +414,25 @@ class DescriptorReader(object):
     directories (requires python 2.6)
   :param int buffer_size: descriptors we'll buffer before waiting for some to
     be read, this is unbounded if zero
+  :param int max_buffer_bytes: bytes of descriptor content we'll buffer before
+    waiting for some to be read, this is unbounded if zero
   :param str persistence_path: if set we will load and save processed file
     listings from this path, errors are ignored
   :param stem.descriptor.__init__.DocumentHandler document_handler: method in
     which to parse :class:`~stem.descriptor.networkstatus.NetworkStatusDocument`
+  :param int processes: number of worker processes to parse descriptors with,
+    if unset then these are parsed by our reader thread
+  :param stem.descriptor.cache.DescriptorCache cache: cache to load
+    previously parsed descriptors from, and save newly parsed ones to
+  :param stem.descriptor.dedup.DigestSet seen: digests of descriptors we've
+    already read, these are skipped and the rest are added to it
+  :param stem.descriptor.filters.DescriptorFilter descriptor_filter: criteria
+    for the descriptors that we want, others are skipped
+  :param bool follow: keeps reading new or changed files in our targets until
+    we're stopped if **True**, otherwise we're done once we've read them
   """
 
-  def __init__(self, target, validate = True, follow_links = False, buffer_size = 100, persistence_path = None, document_handler = stem.descriptor.DocumentHandler.ENTRIES):
+  def __init__(self, target, validate = True, follow_links = False, buffer_size = 100, persistence_path = None, document_handler = stem.descriptor.DocumentHandler.ENTRIES, processes = None, cache = None, seen = None, descriptor_filter = None, max_buffer_bytes = 0, follow = False):
     if isinstance(target, (bytes, unicode)):
       self._targets = [target]
     else:
@@ -269,15 +446,33 @@ class DescriptorReader(object):
     self._follow_links = follow_links
     self._persistence_path = persistence_path
     self._document_handler = document_handler
+    self._processes = processes
+    self._cache = cache
+    self._seen = seen
+    self._filter = descriptor_filter
+    self._follow = follow
     self._read_listeners = []
     self._skip_listeners = []
     self._processed_files = {}
+    self._file_positions = {}
+    self._new_file_positions = {}
 
     self._reader_thread = None
     self._reader_thread_lock = threading.RLock()
 
+    # Worker pool when parsing with multiple processes, and tasks that we're
+    # yet to enqueue the descriptors of. Tasks are tuples of the form...
+    #
+    #   (result, path, archive_path, mime_type, cache_key, position)
+    #
+    # ... where the result is an AsyncResult from our pool or, if we already
+    # have it, a (descriptors, exception) tuple. The position is how far
+    # we'll have read the file once the task is done, if we track that.
+
+    self._pool = None
+    self._pending_tasks = collections.deque()
+
     self._iter_lock = threading.RLock()
-    self._iter_notice = threading.Event()
 
     self._is_stopped = threading.Event()
     self._is_stopped.set()
@@ -285,12 +480,13 @@ class DescriptorReader(object):
     # Descriptors that we have read but not yet provided to the caller. A
     # FINISHED entry is used by the reading thread to indicate the end.
 
-    self._unreturned_descriptors = Queue.Queue(buffer_size)
+    self._unreturned_descriptors = _DescriptorBuffer(buffer_size, max_buffer_bytes)
 
     if self._persistence_path:
       try:
-        processed_files = load_processed_files(self._persistence_path)
+        processed_files, positions = _load_listing(self._persistence_path)
         self.set_processed_files(processed_files)
+        self.set_file_positions(positions)
       except:
         pass
 
@@ -327,6 +523,44 @@ class DescriptorReader(object):
 
     self._processed_files = dict(processed_files)
 
+  def get_file_positions(self):
+    """
+    For files that are a series of independent descriptors (like tor's
+    cached-microdescs.new) this provides how far we've read them, a digest
+    of the content up to that point, and the size of the last descriptor we
+    read. This is a mapping of the form...
+
+    ::
+
+      absolute path (str) => (offset (int), digest (str), tail size (int))
+
+    If one of these files has grown when we next read it, and the content
+    we've already read is unchanged, then we only read what's been appended.
+    Tor might have been part way through writing the last descriptor when we
+    read it, so if what's been appended continues that descriptor rather than
+    starting a new one then we read the last descriptor again.
+    Like :func:`~stem.descriptor.reader.DescriptorReader.get_processed_files`
+    each run resets this to only the files that were present during that
+    run.
+
+    :returns: **dict** with the absolute paths and positions of the files
+      we've read
+    """
+
+    return dict((os.path.abspath(k), v) for (k, v) in self._file_positions.items())
+
+  def set_file_positions(self, positions):
+    """
+    Sets how far we've read files. These are only used for files that are
+    also in our processed files, so files can still be read again from the
+    start by removing them from that listing.
+
+    :param dict positions: mapping of absolute paths (**str**) to an (offset,
+      digest, tail size) tuple
+    """
+
+    self._file_positions = dict(positions)
+
   def register_read_listener(self, listener):
     """
     Registers a listener for when files are read. This is executed prior to
@@ -367,6 +601,19 @@ class DescriptorReader(object):
 
     return self._unreturned_descriptors.qsize()
 
+  def get_buffered_descriptor_bytes(self):
+    """
+    Provides the size of the descriptors that are waiting to be iterated over,
+    by the length of their content. This is limited to the max_buffer_bytes
+    that we were constructed with, unless a single descriptor is larger than
+    that.
+
+    :returns: **int** for the bytes of descriptor content that's currently
+      enqueued
+    """
+
+    return self._unreturned_descriptors.get_bytes()
+
   def start(self):
     """
     Starts reading our descriptor files.
@@ -390,141 +637,308 @@ class DescriptorReader(object):
 
     with self._reader_thread_lock:
       self._is_stopped.set()
-      self._iter_notice.set()
 
-      # clears our queue to unblock enqueue calls
-
-      try:
-        while True:
-          self._unreturned_descriptors.get_nowait()
-      except Queue.Empty:
-        pass
+      # clears our buffer to unblock enqueue calls, and again after our reader
+      # thread is done to discard anything it added in the meantime
 
+      self._unreturned_descriptors.clear()
       self._reader_thread.join()
       self._reader_thread = None
+      self._unreturned_descriptors.clear()
+      self._save_persistence()
 
-      if self._persistence_path:
-        try:
-          processed_files = self.get_processed_files()
-          save_processed_files(self._persistence_path, processed_files)
-        except:
-          pass
+  def _save_persistence(self):
+    if self._persistence_path:
+      try:
+        processed_files = self.get_processed_files()
+        save_processed_files(self._persistence_path, processed_files, self.get_file_positions())
+      except:
+        pass
 
   def _read_descriptor_files(self):
     new_processed_files = {}
     remaining_files = list(self._targets)
+    self._new_file_positions = {}
+    watcher = None
 
-    while remaining_files and not self._is_stopped.is_set():
-      target = remaining_files.pop(0)
+    if self._processes and self._processes > 1:
+      import multiprocessing
+      self._pool = multiprocessing.Pool(self._processes)
 
-      if not os.path.exists(target):
-        self._notify_skip_listeners(target, FileMissing())
-        continue
+    try:
+      # Start watching before we read our targets so we don't miss changes
+      # in the meantime. Files we're told about that we've already read are
+      # skipped by their modification time.
 
-      if os.path.isdir(target):
-        walker = os.walk(target, followlinks = self._follow_links)
-        self._handle_walker(walker, new_processed_files)
-      else:
-        self._handle_file(target, new_processed_files)
+      if self._follow:
+        watcher = _get_watcher(self._targets, self._follow_links)
+
+      while remaining_files and not self._is_stopped.is_set():
+        target = remaining_files.pop(0)
+
+        if not os.path.exists(target):
+          self._notify_skip_listeners(target, FileMissing())
+          continue
+
+        if os.path.isdir(target):
+          walker = _walk(target, self._follow_links)
+          self._handle_walker(walker, new_processed_files)
+        else:
+          self._handle_file(target, new_processed_files)
+
+      while self._pending_tasks and not self._is_stopped.is_set():
+        self._handle_parsed_task()
+
+      if watcher:
+        self._follow_targets(watcher, new_processed_files)
+    finally:
+      if watcher:
+        watcher.close()
+
+      if self._pool:
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+      self._pending_tasks.clear()
 
     self._processed_files = new_processed_files
+    self._file_positions = self._new_file_positions
 
     if not self._is_stopped.is_set():
-      self._unreturned_descriptors.put(FINISHED)
+      self._unreturned_descriptors.add(FINISHED)
+      self._unreturned_descriptors.flush()
+
+    self._unreturned_descriptors.wake()
+
+  def _follow_targets(self, watcher, new_processed_files):
+    """
+    Reads the files that our watcher tells us are new or changed until we're
+    stopped. Files are checked against what we've read so far, which is
+    persisted as we go.
+    """
+
+    self._processed_files = dict(new_processed_files)
+    self._file_positions = dict(self._new_file_positions)
+    self._save_persistence()
 
-    self._iter_notice.set()
+    while not self._is_stopped.is_set():
+      changed_files = watcher.wait(FOLLOW_INTERVAL, self._is_stopped)
+
+      for path in changed_files:
+        if self._is_stopped.is_set():
+          return
+
+        self._handle_file(path, new_processed_files)
+
+      while self._pending_tasks and not self._is_stopped.is_set():
+        self._handle_parsed_task()
+
+      if changed_files and not self._is_stopped.is_set():
+        self._processed_files = dict(new_processed_files)
+        self._file_positions = dict(self._new_file_positions)
+        self._save_persistence()
 
   def __iter__(self):
     with self._iter_lock:
       while not self._is_stopped.is_set():
-        try:
-          descriptor = self._unreturned_descriptors.get_nowait()
+        for descriptor in self._unreturned_descriptors.get_batch():
+          if descriptor is FINISHED or self._is_stopped.is_set():
+            self._unreturned_descriptors.release()
+            return
 
-          if descriptor == FINISHED:
-            break
-          else:
-            yield descriptor
-        except Queue.Empty:
-          self._iter_notice.wait()
-          self._iter_notice.clear()
+          yield descriptor
 
   def _handle_walker(self, walker, new_processed_files):
-    for root, _, files in walker:
-      for filename in files:
-        self._handle_file(os.path.join(root, filename), new_processed_files)
+    for path, path_stat in walker:
+      self._handle_file(path, new_processed_files, path_stat)
 
-        # this can take a while if, say, we're including the root directory
-        if self._is_stopped.is_set():
-          return
+      # this can take a while if, say, we're including the root directory
+      if self._is_stopped.is_set():
+        return
+
+  def _handle_file(self, target, new_processed_files, target_stat = None):
+    # Files named for a time before what our filter wants are skipped without
+    # being registered, so we'll still read them if our filter changes.
+
+    if self._filter is not None and not self._filter.accepts_path(target):
+      return
 
-  def _handle_file(self, target, new_processed_files):
     # This is a file. Register its last modified timestamp and check if
-    # it's a file that we should skip.
+    # it's a file that we should skip. When walking directories we already
+    # have its stat() result.
 
     try:
-      last_modified = int(os.stat(target).st_mtime)
+      if target_stat is None:
+        target_stat = os.stat(target)
+
+      last_modified = int(target_stat.st_mtime)
       last_used = self._processed_files.get(target)
       new_processed_files[target] = last_modified
     except OSError as exc:
       self._notify_skip_listeners(target, ReadFailed(exc))
       return
 
+    if target in self._file_positions:
+      self._new_file_positions[target] = self._file_positions[target]
+
+    # Timestamps are in seconds so a file can be appended to several times
+    # without its timestamp changing. If we're tracking how far we've read it
+    # then also check if it's grown.
+
     if last_used and last_used >= last_modified:
-      self._notify_skip_listeners(target, AlreadyRead(last_modified, last_used))
-      return
+      position = self._file_positions.get(target)
+
+      if not position or position[0] == target_stat.st_size:
+        self._notify_skip_listeners(target, AlreadyRead(last_modified, last_used))
+        return
 
     # Block devices and such are never descriptors, and can cause us to block
     # for quite a while so skipping anything that isn't a regular file.
 
-    if not os.path.isfile(target):
+    if not stat.S_ISREG(target_stat.st_mode):
       return
 
-    # The mimetypes module only checks the file extension. To actually
-    # check the content (like the 'file' command) we'd need something like
-    # pymagic (https://github.com/cloudburst/pymagic).
+    # The mimetypes module only checks the file extension. Files it doesn't
+    # recognize are read as descriptors, and for others we check the content
+    # for a tarball.
 
     target_type = mimetypes.guess_type(target)
 
-    # Checking if it's a tar file may fail due to permissions so failing back
-    # to the mime type...
-    #
-    #   IOError: [Errno 13] Permission denied: '/vmlinuz.old'
-    #
-    # With python 3 insuffient permissions raises an AttributeError instead...
-    #
-    #   http://bugs.python.org/issue17059
-
-    try:
-      is_tar = tarfile.is_tarfile(target)
-    except (IOError, AttributeError):
-      is_tar = target_type[0] == 'application/x-tar'
-
     if target_type[0] in (None, 'text/plain'):
       # either '.txt' or an unknown type
-      self._handle_descriptor_file(target, target_type)
-    elif is_tar:
+      self._handle_descriptor_file(target, target_type, last_modified, last_used, target_stat.st_size)
+    elif _is_tar(target, target_type):
       # handles gzip, bz2, and decompressed tarballs among others
       self._handle_archive(target)
     else:
       self._notify_skip_listeners(target, UnrecognizedType(target_type))
 
-  def _handle_descriptor_file(self, target, mime_type):
+  def _handle_descriptor_file(self, target, mime_type, last_modified, last_used, size):
+    # We only open the file once. Its type is determined from its first line
+    # or filename, which we then provide to the parser so it doesn't need to
+    # guess it again.
+
+    try:
+      target_file = open(target, 'rb')
+    except IOError as exc:
+      self._notify_skip_listeners(target, ReadFailed(exc))
+      return
+
     try:
+      file_type = _get_file_type(target_file)
+      descriptor_type = "%s %i.%i" % file_type if file_type else None
+
+      # Files that are a series of independent descriptors are resumed from
+      # where we left off if we've read them before, and the content up to
+      # that point is unchanged.
+
+      is_appendable = file_type is not None and file_type[0] in stem.descriptor.SPLITTABLE_TYPES
+      keyword = stem.descriptor.SPLITTABLE_TYPES[file_type[0]] if is_appendable else None
+      offset = self._get_unread_offset(target, target_file, keyword) if (is_appendable and last_used is not None) else 0
+
+      if offset and offset >= size:
+        # nothing has been appended since we last read it
+        self._notify_skip_listeners(target, AlreadyRead(last_modified, last_used))
+        return
+
+      if not offset:
+        self._new_file_positions.pop(target, None)
+
       self._notify_read_listeners(target)
 
-      with open(target, 'rb') as target_file:
-        for desc in stem.descriptor.parse_file(target_file, validate = self._validate, document_handler = self._document_handler):
+      if descriptor_type is None:
+        self._notify_skip_listeners(target, UnrecognizedType(mime_type))
+        return
+
+      target_file.seek(offset)
+
+      if is_appendable:
+        # Tor might be part way through writing the last descriptor, so we
+        # parse it on its own. That way a malformed descriptor at the end only
+        # causes us to read it again rather than the whole file. Each part
+        # only records its position if the part before it succeeded.
+        #
+        # When reading the file from its start we parse everything before the
+        # last descriptor as it's read, like other files, so our buffer_size
+        # still limits how far ahead of our caller we get.
+
+        end = os.fstat(target_file.fileno()).st_size
+        tail_start = _get_tail_start(target_file, offset, end, keyword)
+        previous_position = self._new_file_positions.get(target)
+
+        if tail_start > offset:
+          tail_position = _get_position(target_file, tail_start)
+          target_file.seek(offset)
+
+          if offset or self._pool or self._cache is not None:
+            self._submit_task(target, None, target_file.read(tail_start - offset), mime_type, last_modified, descriptor_type, (previous_position, tail_position))
+          else:
+            head_file = io.BufferedReader(_FileHead(target_file, tail_start))
+
+            for desc in stem.descriptor.parse_file(head_file, descriptor_type, validate = self._validate, document_handler = self._document_handler, seen = self._seen, descriptor_filter = self._filter):
+              if self._is_stopped.is_set():
+                return
+
+              self._unreturned_descriptors.add(desc)
+
+            if self._new_file_positions.get(target) == previous_position:
+              self._new_file_positions[target] = tail_position
+
+          previous_position = tail_position
+
+        end_position = _get_position(target_file, end, end - tail_start)
+        target_file.seek(tail_start)
+        self._submit_task(target, None, target_file.read(end - tail_start), mime_type, last_modified, descriptor_type, (previous_position, end_position))
+      elif self._cache is not None:
+        # we need the file's content to check if it's in our cache
+
+        self._submit_task(target, None, target_file.read(), mime_type, last_modified, descriptor_type)
+      elif self._pool:
+        self._submit_task(target, None, None, mime_type, last_modified, descriptor_type)
+      else:
+        for desc in stem.descriptor.parse_file(target_file, descriptor_type, validate = self._validate, document_handler = self._document_handler, seen = self._seen, descriptor_filter = self._filter):
           if self._is_stopped.is_set():
             return
 
-          self._unreturned_descriptors.put(desc)
-          self._iter_notice.set()
+          self._unreturned_descriptors.add(desc)
     except TypeError as exc:
       self._notify_skip_listeners(target, UnrecognizedType(mime_type))
     except ValueError as exc:
       self._notify_skip_listeners(target, ParsingFailure(exc))
     except IOError as exc:
       self._notify_skip_listeners(target, ReadFailed(exc))
+    finally:
+      target_file.close()
+      self._unreturned_descriptors.flush()
+
+  def _get_unread_offset(self, target, target_file, keyword):
+    """
+    Provides where we left off reading a file, or zero if we haven't read it
+    or its content up to that point has changed. If what's been appended
+    continues the last descriptor we read, rather than starting a new one,
+    then this is the start of that descriptor.
+    """
+
+    position = self._file_positions.get(target)
+
+    if position is None:
+      return 0
+
+    offset, digest = position[:2]
+    tail_size = position[2] if len(position) > 2 else 0
+
+    if _get_position_digest(target_file, offset) != digest:
+      return 0  # file has been rewritten
+
+    if tail_size:
+      target_file.seek(offset)
+      appended_line = target_file.readline()
+
+      if appended_line and not (appended_line.startswith(b"@") or appended_line.startswith(keyword)):
+        return offset - tail_size
+
+    return offset
 
   def _handle_archive(self, target):
     # TODO: This would be nicer via the 'with' keyword, but tarfile's __exit__
@@ -538,23 +952,37 @@ class DescriptorReader(object):
       tar_file = tarfile.open(target)
 
       for tar_entry in tar_file:
+        if self._filter is not None and not self._filter.accepts_path(tar_entry.name):
+          continue
+
         if tar_entry.isfile():
           entry = tar_file.extractfile(tar_entry)
 
+          if self._pool or self._cache is not None:
+            try:
+              self._submit_task(target, entry.name, entry.read(), None, tar_entry.mtime)
+            finally:
+              entry.close()
+
+            if self._is_stopped.is_set():
+              return
+
+            continue
+
           try:
-            for desc in stem.descriptor.parse_file(entry, validate = self._validate, document_handler = self._document_handler):
+            for desc in stem.descriptor.parse_file(entry, validate = self._validate, document_handler = self._document_handler, seen = self._seen, descriptor_filter = self._filter):
               if self._is_stopped.is_set():
                 return
 
               desc._set_path(os.path.abspath(target))
               desc._set_archive_path(entry.name)
-              self._unreturned_descriptors.put(desc)
-              self._iter_notice.set()
+              self._unreturned_descriptors.add(desc)
           except TypeError as exc:
             self._notify_skip_listeners(target, ParsingFailure(exc))
           except ValueError as exc:
             self._notify_skip_listeners(target, ParsingFailure(exc))
           finally:
+            self._unreturned_descriptors.flush()
             entry.close()
     except IOError as exc:
       self._notify_skip_listeners(target, ReadFailed(exc))
@@ -562,6 +990,108 @@ class DescriptorReader(object):
       if tar_file:
         tar_file.close()
 
+  def _submit_task(self, target, archive_path, content, mime_type, last_modified, descriptor_type = None, position = None):
+    """
+    Parses a file or archive member, either providing it to our worker pool or
+    parsing it ourselves. Content in our cache is used instead when we have it.
+    If we already have enough tasks in flight then this blocks until the
+    oldest is done and its descriptors have been enqueued.
+
+    For files that we track how far we've read, the position is a tuple of
+    our position before and after this content. We only advance to the later
+    if we're still at the former when the task succeeds.
+    """
+
+    result, cache_key = None, None
+
+    if self._cache is not None and content is not None:
+      # Descriptors that we cache are unfiltered, so our filter can only check
+      # their type before we look them up.
+
+      if self._filter is not None:
+        if descriptor_type is None:
+          file_type = _get_content_type(content[:TYPE_ANNOTATION_SIZE].split(b"\n", 1)[0], archive_path if archive_path else target)
+          descriptor_type = "%s %i.%i" % file_type if file_type else None
+
+        if descriptor_type is not None and not self._filter.accepts_type(descriptor_type.split()[0]):
+          return
+
+      settings = (descriptor_type, self._validate, self._document_handler)
+      cache_key = self._cache.get_key(target, content, archive_path, last_modified, settings)
+      descriptors = self._cache.get(cache_key)
+
+      if descriptors is not None:
+        result, cache_key = (descriptors, None), None
+
+    if result is None:
+      # descriptors that we cache are unfiltered, we filter them when they're
+      # enqueued instead
+
+      descriptor_filter = self._filter if cache_key is None else None
+      args = (archive_path if archive_path else target, content, self._validate, self._document_handler, descriptor_filter, descriptor_type)
+
+      if self._pool:
+        result = self._pool.apply_async(_parse_in_worker, args)
+      else:
+        result = _parse_in_worker(*args)
+
+    self._pending_tasks.append((result, target, archive_path, mime_type, cache_key, position))
+    max_pending = self._processes * stem.descriptor.WORKER_QUEUE_SIZE if self._pool else 1
+
+    while len(self._pending_tasks) >= max_pending:
+      if self._is_stopped.is_set():
+        return
+
+      self._handle_parsed_task()
+
+  def _handle_parsed_task(self):
+    """
+    Enqueues the descriptors from our oldest task in the worker pool, notifying
+    our skip listeners if it encountered an error. This is done in the order
+    that tasks were submitted so the ordering of our descriptors is the same as
+    when we parse them ourselves.
+    """
+
+    result, target, archive_path, mime_type, cache_key, position = self._pending_tasks.popleft()
+
+    # tasks that we parsed ourselves or found in our cache are already done
+
+    descriptors, exc = result if isinstance(result, tuple) else result.get()
+
+    if cache_key and exc is None:
+      self._cache.put(cache_key, descriptors)
+
+    if self._cache is not None and self._filter is not None:
+      descriptors = stem.descriptor._filter_accepted(descriptors, self._filter)
+
+    if self._seen is not None:
+      descriptors = stem.descriptor._filter_seen(descriptors, self._seen)
+
+    for desc in descriptors:
+      if self._is_stopped.is_set():
+        return
+
+      if archive_path:
+        desc._set_path(os.path.abspath(target))
+        desc._set_archive_path(archive_path)
+
+      self._unreturned_descriptors.add(desc)
+
+    self._unreturned_descriptors.flush()
+
+    if position and exc is None:
+      previous_position, new_position = position
+
+      if self._new_file_positions.get(target) == previous_position:
+        self._new_file_positions[target] = new_position
+
+    if isinstance(exc, TypeError) and not archive_path:
+      self._notify_skip_listeners(target, UnrecognizedType(mime_type))
+    elif isinstance(exc, (TypeError, ValueError)):
+      self._notify_skip_listeners(target, ParsingFailure(exc))
+    elif isinstance(exc, IOError):
+      self._notify_skip_listeners(target, ReadFailed(exc))
+
   def _notify_read_listeners(self, path):
     for listener in self._read_listeners:
       listener(path)
@@ -576,3 +1106,709 @@ class DescriptorReader(object):
 
   def __exit__(self, exit_type, value, traceback):
     self.stop()
+
+
+class _DescriptorBuffer(object):
+  """
+  Descriptors that we've read, limited by both the number of descriptors and
+  the size of their content. Our reader thread hands descriptors over in
+  batches to avoid synchronizing with the iterator for each of them...
+
+    * The reader add()s descriptors to a batch of its own, which is put into
+      the buffer at the end of each file or when it's large enough. Batches
+      are sized by how quickly we're reading descriptors, so microdescriptors
+      are handed over by the hundred while a slowly parsed vote is handed
+      over right away.
+
+    * The iterator takes everything we have with get_batch(). These continue
+      to count against our limits until its next get_batch() or release()
+      call.
+
+  When full, putting a batch blocks until enough descriptors have been fetched
+  to make room. A batch is always accepted when we're empty, so descriptors
+  larger than our byte limit don't block us forever.
+
+  :param int max_size: maximum number of descriptors, unbounded if zero
+  :param int max_bytes: maximum bytes of descriptor content, unbounded if
+    zero
+  """
+
+  def __init__(self, max_size = 0, max_bytes = 0):
+    self.max_size = max_size
+    self.max_bytes = max_bytes
+
+    self._queue = collections.deque()
+    self._size = 0   # descriptors in our queue or taken by the iterator
+    self._bytes = 0  # and the size of their content
+    self._cond = threading.Condition()
+
+    self._taken_size, self._taken_bytes = 0, 0
+    self._woken = False
+
+    # Batch that our reader is filling, and a moving average of the time
+    # between its descriptors. These are only used by the reader's thread.
+
+    self._batch, self._batch_bytes, self._batch_started = [], 0, None
+    self._last_added, self._interval = None, BATCH_LATENCY
+    self._max_batch_size = min(MAX_BATCH_SIZE, max(1, max_size // 2)) if max_size > 0 else MAX_BATCH_SIZE
+    self._max_batch_bytes = max(1, max_bytes // 2) if max_bytes > 0 else 0
+
+  def add(self, desc):
+    """
+    Adds a descriptor to the batch that we're filling, putting the batch into
+    the buffer when it's ready. This is only for our reader thread.
+    """
+
+    size, now = _get_size(desc), time.time()
+
+    if self._last_added is not None:
+      self._interval = 0.9 * self._interval + 0.1 * (now - self._last_added)
+
+    self._last_added = now
+
+    if self._batch and self._max_batch_bytes and self._batch_bytes + size > self._max_batch_bytes:
+      self.flush()
+
+    if not self._batch:
+      self._batch_started = now
+
+    self._batch.append(desc)
+    self._batch_bytes += size
+
+    if len(self._batch) >= self._max_batch_size:
+      self.flush()
+    elif len(self._batch) * self._interval >= BATCH_LATENCY or now - self._batch_started >= BATCH_LATENCY:
+      self.flush()
+
+  def flush(self):
+    """
+    Puts the batch that we're filling into the buffer, blocking until there's
+    room for it.
+    """
+
+    if self._batch:
+      batch, batch_bytes = self._batch, self._batch_bytes
+      self._batch, self._batch_bytes = [], 0
+      self.put(batch, batch_bytes)
+
+  def put(self, batch, batch_bytes = None):
+    if batch_bytes is None:
+      batch_bytes = sum(map(_get_size, batch))
+
+    with self._cond:
+      while self._size and self._is_full(len(batch), batch_bytes):
+        self._cond.wait()
+
+      self._queue.extend(batch)
+      self._size += len(batch)
+      self._bytes += batch_bytes
+      self._cond.notify_all()
+
+  def get_batch(self):
+    """
+    Provides all of the descriptors that we have, releasing the last batch
+    that we provided. If we're empty this waits until a batch is put or we're
+    woken, in which case this can be an empty list.
+
+    :returns: **list** of the descriptors in our buffer
+    """
+
+    with self._cond:
+      self._release()
+
+      if not self._queue and not self._woken:
+        self._cond.wait()
+
+      self._woken = False
+
+      batch = list(self._queue)
+      self._queue.clear()
+
+      self._taken_size = len(batch)
+      self._taken_bytes = self._bytes
+
+      return batch
+
+  def release(self):
+    """
+    Frees the room taken by the last batch that get_batch() provided.
+    """
+
+    with self._cond:
+      self._release()
+
+  def wake(self):
+    """
+    Wakes the iterator if it's waiting on us. If it isn't then its next
+    get_batch() call returns without waiting.
+    """
+
+    with self._cond:
+      self._woken = True
+      self._cond.notify_all()
+
+  def clear(self):
+    """
+    Discards all of our descriptors, and wakes anything waiting on us.
+    """
+
+    with self._cond:
+      self._queue.clear()
+      self._batch, self._batch_bytes = [], 0
+      self._size, self._bytes = 0, 0
+      self._taken_size, self._taken_bytes = 0, 0
+      self._woken = True
+      self._cond.notify_all()
+
+  def qsize(self):
+    return self._size
+
+  def get_bytes(self):
+    return self._bytes
+
+  def _release(self):
+    if self._taken_size:
+      self._size -= self._taken_size
+      self._bytes -= self._taken_bytes
+      self._taken_size, self._taken_bytes = 0, 0
+      self._cond.notify_all()
+
+  def _is_full(self, size, content_bytes):
+    if self.max_size > 0 and self._size + size > self.max_size:
+      return True
+    elif self.max_bytes > 0 and self._bytes + content_bytes > self.max_bytes:
+      return True
+    else:
+      return False
+
+
+def _get_size(desc):
+  """
+  Provides the size we count a descriptor as. This is the length of its
+  content, which is the bulk of its footprint.
+  """
+
+  if isinstance(desc, stem.descriptor.Descriptor):
+    return len(desc.get_bytes())
+  else:
+    return 0  # our FINISHED flag
+
+
+def _parse_in_worker(target, content, validate, document_handler, descriptor_filter = None, descriptor_type = None):
+  """
+  Parses a descriptor file or archive member within a worker process. Rather
+  than raising exceptions we provide them back with the descriptors that we
+  read before encountering it, so our reader can treat these just like the
+  files it parses itself.
+
+  :param str target: path of the descriptor file, or name of the archive
+    member if we're provided its content
+  :param bytes content: content of the archive member, **None** if we should
+    read the target file instead
+  :param bool validate: checks the validity of the descriptor's content if
+    **True**, skips these checks otherwise
+  :param stem.descriptor.__init__.DocumentHandler document_handler: method in
+    which to parse a :class:`~stem.descriptor.networkstatus.NetworkStatusDocument`
+  :param stem.descriptor.filters.DescriptorFilter descriptor_filter: criteria
+    for the descriptors that we want
+  :param str descriptor_type: descriptor type to parse the content as, this
+    is guessed if not provided
+
+  :returns: **tuple** of the form (descriptors, exception), the exception being
+    **None** if we parsed the content successfully
+  """
+
+  descriptors = []
+
+  try:
+    if content is None:
+      with open(target, 'rb') as target_file:
+        for desc in stem.descriptor.parse_file(target_file, descriptor_type, validate = validate, document_handler = document_handler, descriptor_filter = descriptor_filter):
+          descriptors.append(desc)
+    else:
+      entry = io.BytesIO(content)
+      entry.name = target  # member's filename can indicate the descriptor type
+
+      for desc in stem.descriptor.parse_file(entry, descriptor_type, validate = validate, document_handler = document_handler, descriptor_filter = descriptor_filter):
+        descriptors.append(desc)
+  except (TypeError, ValueError, IOError) as exc:
+    return descriptors, exc
+
+  return descriptors, None
+
+
+def _get_watcher(targets, follow_links):
+  """
+  Provides a watcher for changes to our targets, using inotify if it's
+  available and polling otherwise.
+  """
+
+  try:
+    return _InotifyWatcher(targets, follow_links)
+  except (OSError, IOError, AttributeError, ImportError):
+    return _PollingWatcher(targets, follow_links)
+
+
+class _PollingWatcher(object):
+  """
+  Notices new and changed files by comparing their stat() results with what
+  they were when we last checked. Directories are only listed again when
+  their modification time changes, which is when files are added to them or
+  removed.
+
+  Paths are provided in the same form as our targets (relative paths stay
+  relative).
+
+  :param list targets: files and directories to watch
+  :param bool follow_links: descends into symlinked directories if **True**
+  """
+
+  def __init__(self, targets, follow_links):
+    self._targets = targets
+    self._follow_links = follow_links
+
+    self._directories = {}  # path => (modification time, subdirectories, files)
+    self._files = {}  # path => (modification time, size)
+
+    self._check()  # our baseline for what's changed
+
+  def wait(self, timeout, is_stopped):
+    """
+    Provides the files that were added or changed since we were last called.
+    We wait for the timeout before checking, or until we're stopped.
+
+    :param float timeout: seconds to wait before checking our targets
+    :param threading.Event is_stopped: event for when we should stop waiting
+
+    :returns: **list** of paths for files that were added or changed
+    """
+
+    is_stopped.wait(timeout)
+
+    if is_stopped.is_set():
+      return []
+
+    return self._check()
+
+  def close(self):
+    pass
+
+  def _check(self):
+    changed, checked = [], set()
+
+    for target in self._targets:
+      if os.path.isdir(target):
+        self._check_directory(target, changed, checked)
+      else:
+        self._check_file(target, changed, checked)
+
+    for path in set(self._files) - checked:
+      del self._files[path]  # removed files
+
+    return changed
+
+  def _check_directory(self, path, changed, checked):
+    try:
+      modified = os.stat(path).st_mtime
+    except OSError:
+      self._directories.pop(path, None)
+      return
+
+    listing = self._directories.get(path)
+
+    if listing is None or listing[0] != modified:
+      subdirectories, files = [], []
+
+      try:
+        for name in sorted(os.listdir(path)):
+          entry_path = os.path.join(path, name)
+
+          if os.path.isdir(entry_path):
+            if self._follow_links or not os.path.islink(entry_path):
+              subdirectories.append(entry_path)
+          else:
+            files.append(entry_path)
+      except OSError:
+        return
+
+      listing = (modified, subdirectories, files)
+      self._directories[path] = listing
+
+    for file_path in listing[2]:
+      self._check_file(file_path, changed, checked)
+
+    for subdirectory in listing[1]:
+      self._check_directory(subdirectory, changed, checked)
+
+  def _check_file(self, path, changed, checked):
+    try:
+      path_stat = os.stat(path)
+    except OSError:
+      return
+
+    checked.add(path)
+    attributes = (path_stat.st_mtime, path_stat.st_size)
+
+    if self._files.get(path) != attributes:
+      self._files[path] = attributes
+      changed.append(path)
+
+
+class _InotifyWatcher(object):
+  """
+  Notices new and changed files through Linux's inotify. We watch the
+  directories of our targets and are told when files in them are closed after
+  being written to or moved there. Subdirectories that are made while we're
+  watching are watched too.
+
+  Paths are provided in the same form as our targets (relative paths stay
+  relative).
+
+  :param list targets: files and directories to watch
+  :param bool follow_links: descends into symlinked directories if **True**
+
+  :raises: **OSError** if inotify is unavailable or we're unable to watch a
+    directory
+  """
+
+  def __init__(self, targets, follow_links):
+    import ctypes
+    import ctypes.util
+
+    libc_path = ctypes.util.find_library("c")
+
+    if not libc_path:
+      raise OSError("Unable to find libc")
+
+    self._libc = ctypes.CDLL(libc_path, use_errno = True)
+    self._get_errno = ctypes.get_errno
+    self._follow_links = follow_links
+    self._targets = targets
+
+    self._fd = self._libc.inotify_init()
+
+    if self._fd < 0:
+      raise OSError(self._get_errno(), "Unable to initialize inotify")
+
+    self._watches = {}  # watch descriptor => directory
+    self._names = {}  # directory => filenames we want from it, None if all
+
+    try:
+      for target in targets:
+        if os.path.isdir(target):
+          self._watch_tree(target)
+        else:
+          self._watch(os.path.dirname(target), os.path.basename(target))
+    except:
+      self.close()
+      raise
+
+  def wait(self, timeout, is_stopped):
+    """
+    Provides the files that were added or changed since we were last called,
+    waiting up to the timeout for some.
+
+    :param float timeout: seconds to wait for changes
+    :param threading.Event is_stopped: event for when we should stop waiting
+
+    :returns: **list** of paths for files that were added or changed
+    """
+
+    try:
+      if not select.select([self._fd], [], [], timeout)[0] or is_stopped.is_set():
+        return []
+
+      data = os.read(self._fd, 65536)
+    except (OSError, select.error):
+      return []  # interrupted
+
+    changed, offset = [], 0
+
+    while offset + INOTIFY_EVENT.size <= len(data):
+      wd, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+      name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + name_length].rstrip(b"\0")
+      offset += INOTIFY_EVENT.size + name_length
+
+      if stem.prereq.is_python_3():
+        name = name.decode(sys.getfilesystemencoding())
+
+      if mask & IN_Q_OVERFLOW:
+        # we missed events, so everything might've changed
+        changed += self._list_files()
+        continue
+
+      directory = self._watches.get(wd)
+
+      if directory is None:
+        continue
+      elif mask & IN_IGNORED:
+        del self._watches[wd]  # directory was removed
+        continue
+      elif not name:
+        continue
+
+      path = os.path.join(directory, name)
+      wants_name = self._names.get(directory) is None or name in self._names[directory]
+
+      if mask & IN_ISDIR:
+        if self._names.get(directory) is None and (self._follow_links or not os.path.islink(path)):
+          # Watch the new directory, then provide the files that it already
+          # has since we weren't watching when they were made.
+
+          try:
+            self._watch_tree(path)
+            changed += self._list_files([path])
+          except OSError:
+            pass
+      elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and wants_name:
+        changed.append(path)
+
+    # provides each file once, in the order that they changed
+
+    seen_paths, results = set(), []
+
+    for path in changed:
+      if path not in seen_paths:
+        seen_paths.add(path)
+        results.append(path)
+
+    return results
+
+  def close(self):
+    if self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
+
+  def _watch_tree(self, root):
+    for directory, _, _ in os.walk(root, followlinks = self._follow_links):
+      self._watch(directory)
+
+  def _watch(self, directory, name = None):
+    path = directory if directory else "."
+
+    if stem.prereq.is_python_3():
+      path = path.encode(sys.getfilesystemencoding())
+
+    wd = self._libc.inotify_add_watch(self._fd, path, INOTIFY_MASK)
+
+    if wd < 0:
+      raise OSError(self._get_errno(), "Unable to watch %s" % directory)
+
+    self._watches[wd] = directory
+
+    if name is None:
+      self._names[directory] = None
+    elif self._names.get(directory, set()) is not None:
+      self._names.setdefault(directory, set()).add(name)
+
+  def _list_files(self, targets = None):
+    files = []
+
+    for target in (targets if targets is not None else self._targets):
+      if os.path.isdir(target):
+        for root, _, filenames in os.walk(target, followlinks = self._follow_links):
+          files += [os.path.join(root, filename) for filename in sorted(filenames)]
+      elif os.path.exists(target):
+        files.append(target)
+
+    return files
+
+
+def _walk(root, follow_links):
+  """
+  Provides the files within a directory and its subdirectories, like
+  os.walk(). With scandir we get each file's stat() result from listing the
+  directory, and don't need to stat() entries to tell if they're a
+  directory.
+
+  :param str root: directory to provide the files of
+  :param bool follow_links: descends into symlinked directories if **True**
+
+  :returns: iterator for (path, stat) tuples, the stat being **None** if we
+    were unable to get it
+  """
+
+  if _scandir is None:
+    for directory, _, filenames in os.walk(root, followlinks = follow_links):
+      for filename in filenames:
+        path = os.path.join(directory, filename)
+
+        try:
+          yield path, os.stat(path)
+        except OSError:
+          yield path, None
+
+    return
+
+  try:
+    entries = list(_scandir(root))
+  except OSError:
+    return  # os.walk() also ignores directories that we can't list
+
+  subdirectories = []
+
+  for entry in entries:
+    try:
+      is_dir = entry.is_dir()
+    except OSError:
+      is_dir = False
+
+    if is_dir:
+      if follow_links or not entry.is_symlink():
+        subdirectories.append(entry.path)
+
+      continue
+
+    try:
+      yield entry.path, entry.stat()
+    except OSError:
+      yield entry.path, None
+
+  for subdirectory in subdirectories:
+    for path, path_stat in _walk(subdirectory, follow_links):
+      yield path, path_stat
+
+
+def _is_tar(target, mime_type):
+  """
+  Checks if a file is a tarball. Uncompressed tarballs are recognized by the
+  magic bytes of their header, and compressed files are checked with the
+  tarfile module.
+  """
+
+  # Reading the file may fail due to permissions so failing back to the mime
+  # type...
+  #
+  #   IOError: [Errno 13] Permission denied: '/vmlinuz.old'
+  #
+  # With python 3 insuffient permissions raises an AttributeError instead...
+  #
+  #   http://bugs.python.org/issue17059
+
+  try:
+    with open(target, 'rb') as target_file:
+      header = target_file.read(TAR_HEADER_SIZE)
+
+    if header[TAR_MAGIC_OFFSET:TAR_MAGIC_OFFSET + 5] == b"ustar":
+      return True
+    elif header.startswith(COMPRESSED_MAGIC) or mime_type[0] == 'application/x-tar':
+      return tarfile.is_tarfile(target)
+    else:
+      return False
+  except (IOError, AttributeError):
+    return mime_type[0] == 'application/x-tar'
+
+
+def _get_file_type(target_file):
+  """
+  Provides the (type, major_version, minor_version) of a descriptor file from
+  its @type annotation or filename, like
+  :func:`~stem.descriptor.__init__.parse_file`.
+
+  :returns: **tuple** for the file's type, **None** if it's unrecognized
+  """
+
+  return _get_content_type(target_file.readline(TYPE_ANNOTATION_SIZE), target_file.name)
+
+
+def _get_content_type(first_line, name):
+  """
+  Provides the (type, major_version, minor_version) of descriptor content from
+  its first line or the name of the file or archive member it's from.
+
+  :returns: **tuple** for the content's type, **None** if it's unrecognized
+  """
+
+  type_match = TYPE_ANNOTATION.match(first_line.strip())
+
+  if type_match:
+    desc_type, major_version, minor_version = type_match.groups()
+    return (stem.util.str_tools._to_unicode(desc_type), int(major_version), int(minor_version))
+
+  return stem.descriptor.DATA_DIRECTORY_TYPES.get(os.path.basename(name))
+
+
+def _get_tail_start(target_file, start, end, keyword):
+  """
+  Provides where the last descriptor between two offsets of a file begins.
+  This reads backward from the end so we only read a little more than that
+  descriptor.
+  """
+
+  read_size = POSITION_DIGEST_WINDOW
+
+  while True:
+    block_start = max(start, end - read_size)
+    target_file.seek(block_start)
+    boundary = stem.descriptor._get_last_descriptor_start(target_file.read(end - block_start), keyword)
+
+    if boundary > 0 or block_start == start:
+      return block_start + boundary
+
+    read_size *= 2
+
+
+class _FileHead(io.RawIOBase):
+  """
+  Read-only view of a file that ends at the given offset, so we can parse the
+  start of a file as it's read.
+  """
+
+  def __init__(self, target_file, end):
+    self.name = target_file.name
+    self._file = target_file
+    self._end = end
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def tell(self):
+    return self._file.tell()
+
+  def seek(self, offset, whence = os.SEEK_SET):
+    if whence == os.SEEK_END:
+      offset, whence = self._end + offset, os.SEEK_SET
+
+    self._file.seek(offset, whence)
+    return self._file.tell()
+
+  def readinto(self, buffer):
+    content = self._file.read(max(0, min(len(buffer), self._end - self._file.tell())))
+    buffer[:len(content)] = content
+    return len(content)
+
+
+def _get_position(target_file, offset, tail_size = 0):
+  """
+  Provides the (offset, digest, tail size) for how far we've read a file.
+  """
+
+  return (offset, _get_position_digest(target_file, offset), tail_size)
+
+
+def _get_position_digest(target_file, offset):
+  """
+  Provides a digest of a file's content up to an offset, or **None** if the
+  file is shorter than that. Rather than reading all of it this hashes the
+  start of the file and the content just before the offset, which changes
+  when tor rewrites the file.
+  """
+
+  target_file.seek(0, os.SEEK_END)
+
+  if target_file.tell() < offset:
+    return None
+
+  head_size = min(offset, POSITION_DIGEST_WINDOW)
+  tail_start = max(head_size, offset - POSITION_DIGEST_WINDOW)
+
+  digest = hashlib.sha1()
+  target_file.seek(0)
+  digest.update(target_file.read(head_size))
+  target_file.seek(tail_start)
+  digest.update(target_file.read(offset - tail_start))
+
+  return digest.hexdigest().upper()
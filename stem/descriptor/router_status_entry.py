@@ -19,16 +19,46 @@ sources...
     +- RouterStatusEntryMicroV3 - Entry for a microdescriptor flavored v3 document
 """
 
-import base64
 import binascii
-import datetime
+import re
 
 import stem.descriptor
 import stem.exit_policy
+import stem.prereq
+import stem.util.connection
 import stem.util.str_tools
+import stem.util.tor_tools
+import stem.version
 
+# Lines of router status entries from a v3 document. Entries where each line
+# is a single keyword, a space, and its value skip our generic descriptor
+# parsing.
 
-def _parse_file(document_file, validate, entry_class, entry_keyword = "r", start_position = None, end_position = None, section_end_keywords = (), extra_args = ()):
+V3_ENTRY_LINE = re.compile("^([rasvwpm]) ([^ \t\n].*)$", re.MULTILINE)
+MICRO_V3_ENTRY_LINE = re.compile("^([rsvwm]) ([^ \t\n].*)$", re.MULTILINE)
+
+# Flags, versions, and exit policy summaries are shared by many relays, so we
+# reuse their parsed values. Each of these caches is cleared when it exceeds
+# PARSE_CACHE_SIZE entries.
+
+PARSE_CACHE_SIZE = 1000
+
+# 'r' lines with valid nicknames, addresses, and ports, and a publication time
+# in the format tor provides. These are nearly all of them, and can be read
+# with a single match.
+
+IPV4_OCTET = "(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+R_LINE_END = "([0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}) (%s(?:\\.%s){3}) ([1-9][0-9]{0,4}) (0|[1-9][0-9]{0,4})$" % (IPV4_OCTET, IPV4_OCTET)
+
+R_LINE = re.compile("^([a-zA-Z0-9]{1,19}) (\\S+) (\\S+) " + R_LINE_END)
+MICRO_R_LINE = re.compile("^([a-zA-Z0-9]{1,19}) (\\S+) " + R_LINE_END)
+
+_FLAGS_CACHE = {}
+_VERSION_CACHE = {}
+_EXIT_POLICY_CACHE = {}
+
+
+def _parse_file(document_file, validate, entry_class, entry_keyword = "r", start_position = None, end_position = None, section_end_keywords = (), extra_args = (), entry_filter = None):
   """
   Reads a range of the document_file containing some number of entry_class
   instances. We deliminate the entry_class entries by the keyword on their
@@ -48,6 +78,8 @@ def _parse_file(document_file, validate, entry_class, entry_keyword = "r", start
     section if no end_position was provided
   :param tuple extra_args: extra arguments for the entry_class (after the
     content and validate flag)
+  :param functor entry_filter: if provided, entries are only parsed if this
+    returns **True** for their content
 
   :returns: iterator over entry_class instances
 
@@ -74,6 +106,15 @@ def _parse_file(document_file, validate, entry_class, entry_keyword = "r", start
     if first_keyword in section_end_keywords:
       return
 
+  if entry_keyword == "r" and entry_class in (RouterStatusEntryV3, RouterStatusEntryMicroV3):
+    routers_section = _read_routers_section(document_file, end_position, section_end_keywords)
+
+    if routers_section is not None:
+      for desc in _parse_routers_section(routers_section, validate, entry_class, extra_args, entry_filter):
+        yield desc
+
+      return
+
   while end_position is None or document_file.tell() < end_position:
     desc_lines, ending_keyword = stem.descriptor._read_until_keywords(
       (entry_keyword,) + section_end_keywords,
@@ -86,7 +127,8 @@ def _parse_file(document_file, validate, entry_class, entry_keyword = "r", start
     desc_content = bytes.join(b"", desc_lines)
 
     if desc_content:
-      yield entry_class(desc_content, validate, *extra_args)
+      if entry_filter is None or entry_filter(desc_content):
+        yield entry_class(desc_content, validate, *extra_args)
 
       # check if we stopped at the end of the section
       if ending_keyword in section_end_keywords:
@@ -95,6 +137,128 @@ def _parse_file(document_file, validate, entry_class, entry_keyword = "r", start
       break
 
 
+def _read_routers_section(document_file, end_position, section_end_keywords):
+  """
+  Reads the router status entries of a v3 document from our current position,
+  leaving the file at the end of the section. This is only for sections in
+  the common format (each entry starting with 'r ' and no 'opt' prefixes) so
+  they can be split apart without parsing each line.
+
+  :param file document_file: file with network status document content
+  :param int end_position: end of the section
+  :param tuple section_end_keywords: keyword(s) that deliminate the end of the
+    section if no end_position was provided
+
+  :returns: **bytes** with the section's content, **None** if it isn't in the
+    common format (in which case the file is left unchanged)
+  """
+
+  start_position = document_file.tell()
+
+  if end_position is None:
+    content = document_file.read()
+  else:
+    content = document_file.read(end_position - start_position)
+
+  section_end = len(content)
+
+  for keyword in section_end_keywords:
+    keyword = stem.util.str_tools._to_bytes("\n" + keyword)
+    keyword_index = content.find(keyword)
+
+    while keyword_index != -1:
+      if content[keyword_index + len(keyword):keyword_index + len(keyword) + 1] in (b" ", b"\t", b"\n", b""):
+        section_end = min(section_end, keyword_index + 1)
+        break
+
+      keyword_index = content.find(keyword, keyword_index + 1)
+
+  content = content[:section_end]
+
+  if not content.startswith(b"r ") or b"\nr\t" in content or b"\nopt " in content:
+    document_file.seek(start_position)
+    return None
+
+  document_file.seek(start_position + section_end)
+  return content
+
+
+def _parse_routers_section(content, validate, entry_class, extra_args, entry_filter = None):
+  """
+  Iterates over the router status entries from
+  :func:`~stem.descriptor.router_status_entry._read_routers_section`.
+
+  :param bytes content: router status entries
+  :param bool validate: checks the validity of the content if **True**
+  :param class entry_class: class to construct instances for
+  :param tuple extra_args: extra arguments for the entry_class
+  :param functor entry_filter: if provided, entries are only parsed if this
+    returns **True** for their content
+
+  :returns: iterator over entry_class instances
+
+  :raises: **ValueError** if the contents is malformed and validate is **True**
+  """
+
+  entry_start = 0
+
+  while entry_start < len(content):
+    entry_end = content.find(b"\nr ", entry_start) + 1
+
+    if entry_end == 0:
+      entry_end = len(content)
+
+    if entry_filter is None or entry_filter(content[entry_start:entry_end]):
+      yield entry_class(content[entry_start:entry_end], validate, *extra_args)
+
+    entry_start = entry_end
+
+
+def _get_entry_components(content, line_pattern, required_fields, single_fields):
+  """
+  Counterpart of :func:`~stem.descriptor.__init__._get_descriptor_components`
+  for router status entries. These have a tiny grammar, so for entries in the
+  common format we can break them up far faster than the generic function. If
+  the content is unusual in any way then this provides **None** so the caller
+  can fall back to the generic parser.
+
+  :param str content: router status entry content
+  :param re.RegexObject line_pattern: pattern for the lines the entry can have
+  :param tuple required_fields: keywords that must appear in the entry
+  :param tuple single_fields: keywords that can only appear once
+
+  :returns: **dict** with the 'keyword => (value, pgp key) entries' mappings,
+    or **None** if the content isn't in the common format
+  """
+
+  # every line must match our pattern, and blank lines are unusual enough
+  # that we leave them to the generic parser
+
+  if "\n\n" in content:
+    return None
+
+  lines = line_pattern.findall(content)
+  line_count = content.count("\n") if content.endswith("\n") else content.count("\n") + 1
+
+  if len(lines) != line_count or lines[0][0] != 'r':
+    return None
+
+  entries = {}
+
+  for keyword, value in lines:
+    entries.setdefault(keyword, []).append((value, None))
+
+  for keyword in required_fields:
+    if not keyword in entries:
+      return None
+
+  for keyword in single_fields:
+    if keyword in entries and len(entries[keyword]) > 1:
+      return None
+
+  return entries
+
+
 class RouterStatusEntry(stem.descriptor.Descriptor):
   """
   Information about an individual router stored within a network status
@@ -147,13 +311,29 @@ class RouterStatusEntry(stem.descriptor.Descriptor):
 
     self._unrecognized_lines = []
 
-    entries = stem.descriptor._get_descriptor_components(content, validate)
+    entries = self._get_entry_components(content)
 
-    if validate:
-      self._check_constraints(entries)
+    if entries is None:
+      entries = stem.descriptor._get_descriptor_components(content, validate)
+
+      if validate:
+        self._check_constraints(entries)
 
     self._parse(entries, validate)
 
+  def _get_entry_components(self, content):
+    """
+    Breaks up our content if it's in the common format for this type of
+    entry. We then skip our generic parser.
+
+    :param str content: router status entry content
+
+    :returns: **dict** with the 'keyword => (value, pgp key) entries' mappings,
+      or **None** if we need to use our generic parser
+    """
+
+    return None
+
   def _parse(self, entries, validate):
     """
     Parses the given content and applies the attributes.
@@ -363,6 +543,9 @@ class RouterStatusEntryV3(RouterStatusEntry):
 
     RouterStatusEntry._parse(self, entries, validate)
 
+  def _get_entry_components(self, content):
+    return _get_entry_components(content, V3_ENTRY_LINE, self._required_fields(), self._single_fields())
+
   def _name(self, is_plural = False):
     if is_plural:
       return "Router status entries (v3)"
@@ -438,6 +621,9 @@ class RouterStatusEntryMicroV3(RouterStatusEntry):
 
     RouterStatusEntry._parse(self, entries, validate)
 
+  def _get_entry_components(self, content):
+    return _get_entry_components(content, MICRO_V3_ENTRY_LINE, self._required_fields(), self._single_fields())
+
   def _name(self, is_plural = False):
     if is_plural:
       return "Router status entries (micro v3)"
@@ -479,6 +665,9 @@ def _parse_r_line(desc, value, validate, include_digest = True):
   #   "r" nickname identity publication IP ORPort DirPort
   #   example: r Konata ARIJF2zbqirB9IwsW0mQznccWww 2012-09-24 13:40:40 69.64.48.168 9001 9030
 
+  if _parse_common_r_line(desc, value, validate, include_digest):
+    return
+
   r_comp = value.split(" ")
 
   # inject a None for the digest to normalize the field positioning
@@ -516,12 +705,56 @@ def _parse_r_line(desc, value, validate, include_digest = True):
 
   try:
     published = "%s %s" % (r_comp[3], r_comp[4])
-    desc.published = datetime.datetime.strptime(published, "%Y-%m-%d %H:%M:%S")
+    desc.published = stem.util.str_tools._parse_timestamp(published)
   except ValueError:
     if validate:
       raise ValueError("Publication time time wasn't parsable: r %s" % value)
 
 
+def _parse_common_r_line(desc, value, validate, include_digest):
+  # Parses 'r' lines matching R_LINE or MICRO_R_LINE. These pass all of the
+  # checks that _parse_r_line() would do, so we can skip them. Anything else,
+  # including invalid dates, is left to _parse_r_line().
+  #
+  # Provides True if we parsed the line, False otherwise.
+
+  if include_digest:
+    r_match = R_LINE.match(value)
+  else:
+    r_match = MICRO_R_LINE.match(value)
+
+  if not r_match:
+    return False
+
+  r_comp = list(r_match.groups())
+
+  if not include_digest:
+    r_comp.insert(2, None)
+
+  or_port, dir_port = int(r_comp[5]), int(r_comp[6])
+
+  if or_port > 65535 or dir_port > 65535:
+    return False
+
+  try:
+    published = stem.util.str_tools._parse_timestamp(r_comp[3])
+  except ValueError:
+    return False
+
+  desc.nickname = r_comp[0]
+  desc.fingerprint = _base64_to_hex(r_comp[1], validate)
+
+  if include_digest:
+    desc.digest = _base64_to_hex(r_comp[2], validate)
+
+  desc.address = r_comp[4]
+  desc.or_port = or_port
+  desc.dir_port = None if dir_port == 0 else dir_port
+  desc.published = published
+
+  return True
+
+
 def _parse_a_line(desc, value, validate):
   # "a" SP address ":" portlist
   # example: a [2001:888:2133:0:82:94:251:204]:9001
@@ -555,16 +788,29 @@ def _parse_s_line(desc, value, validate):
   # "s" Flags
   # example: s Named Running Stable Valid
 
+  flags = _FLAGS_CACHE.get(value)
+
+  if flags is not None:
+    desc.flags = list(flags)
+    return
+
   flags = [] if value == "" else value.split(" ")
   desc.flags = flags
 
-  if validate:
-    for flag in flags:
-      if flags.count(flag) > 1:
+  for flag in flags:
+    if flags.count(flag) > 1:
+      if validate:
         raise ValueError("%s had duplicate flags: s %s" % (desc._name(), value))
-      elif flag == "":
+
+      return
+    elif flag == "":
+      if validate:
         raise ValueError("%s had extra whitespace on its 's' line: s %s" % (desc._name(), value))
 
+      return
+
+  _cache(_FLAGS_CACHE, value, tuple(flags))
+
 
 def _parse_v_line(desc, value, validate):
   # "v" version
@@ -577,11 +823,16 @@ def _parse_v_line(desc, value, validate):
   desc.version_line = value
 
   if value.startswith("Tor "):
-    try:
-      desc.version = stem.version.Version(value[4:])
-    except ValueError as exc:
-      if validate:
-        raise ValueError("%s has a malformed tor version (%s): v %s" % (desc._name(), exc, value))
+    version = _VERSION_CACHE.get(value)
+
+    if version is None:
+      try:
+        version = _cache(_VERSION_CACHE, value, stem.version.Version(value[4:]))
+      except ValueError as exc:
+        if validate:
+          raise ValueError("%s has a malformed tor version (%s): v %s" % (desc._name(), exc, value))
+
+    desc.version = version
 
 
 def _parse_w_line(desc, value, validate):
@@ -637,13 +888,18 @@ def _parse_p_line(desc, value, validate):
   # p reject 1-65535
   # example: p accept 80,110,143,443,993,995,6660-6669,6697,7000-7001
 
-  try:
-    desc.exit_policy = stem.exit_policy.MicroExitPolicy(value)
-  except ValueError as exc:
-    if not validate:
-      return
+  exit_policy = _EXIT_POLICY_CACHE.get(value)
+
+  if exit_policy is None:
+    try:
+      exit_policy = _cache(_EXIT_POLICY_CACHE, value, stem.exit_policy.MicroExitPolicy(value))
+    except ValueError as exc:
+      if not validate:
+        return
+
+      raise ValueError("%s exit policy is malformed (%s): p %s" % (desc._name(), exc, value))
 
-    raise ValueError("%s exit policy is malformed (%s): p %s" % (desc._name(), exc, value))
+  desc.exit_policy = exit_policy
 
 
 def _parse_m_line(desc, value, validate):
@@ -709,35 +965,44 @@ def _base64_to_hex(identity, validate, check_if_fingerprint = True):
   missing_padding = len(identity) % 4
   identity += "=" * missing_padding
 
-  fingerprint = ""
-
   try:
-    identity_decoded = base64.b64decode(stem.util.str_tools._to_bytes(identity))
+    identity_decoded = binascii.a2b_base64(stem.util.str_tools._to_bytes(identity))
   except (TypeError, binascii.Error):
     if not validate:
       return None
 
     raise ValueError("Unable to decode identity string '%s'" % identity)
 
-  for char in identity_decoded:
-    # Individual characters are either standard ASCII or hex encoded, and each
-    # represent two hex digits. For instance...
-    #
-    # >>> ord('\n')
-    # 10
-    # >>> hex(10)
-    # '0xa'
-    # >>> '0xa'[2:].zfill(2).upper()
-    # '0A'
+  fingerprint = binascii.hexlify(identity_decoded).upper()
 
-    char_int = char if isinstance(char, int) else ord(char)
-    fingerprint += hex(char_int)[2:].zfill(2).upper()
+  if stem.prereq.is_python_3():
+    fingerprint = stem.util.str_tools._to_unicode(fingerprint)
 
   if check_if_fingerprint:
-    if not stem.util.tor_tools.is_valid_fingerprint(fingerprint):
+    # this is hex so we only need to check that it's the right length
+
+    if len(fingerprint) != 40:
       if not validate:
         return None
 
       raise ValueError("Decoded '%s' to be '%s', which isn't a valid fingerprint" % (identity, fingerprint))
 
   return fingerprint
+
+
+def _cache(cache, key, value):
+  """
+  Adds a parsed value to one of our caches, clearing it if it's full.
+
+  :param dict cache: cache to add the value to
+  :param str key: content that the value was parsed from
+  :param object value: parsed value
+
+  :returns: the value that we cached
+  """
+
+  if len(cache) >= PARSE_CACHE_SIZE:
+    cache.clear()
+
+  cache[key] = value
+  return value
@@ -0,0 +1,345 @@
+# Copyright 2013, Damian Johnson
+# See LICENSE for licensing information
+
+"""
+Compact binary format for parsed descriptors. Reading descriptors from this
+format is far faster than parsing their text again, which makes it handy for
+persisting large collections that you'll want to load repeatedly.
+
+Individual descriptors can be converted with their
+:func:`~stem.descriptor.__init__.Descriptor.to_bytes` and
+:func:`~stem.descriptor.__init__.Descriptor.from_bytes` methods. Large
+collections can be streamed to and from a file...
+
+::
+
+  from stem.descriptor import parse_file
+  from stem.descriptor.serialization import write_descriptors, read_descriptors
+
+  with open('/tmp/descriptors.bin', 'wb') as output_file:
+    write_descriptors(output_file, parse_file('/home/atagar/.tor/cached-descriptors'))
+
+  with open('/tmp/descriptors.bin', 'rb') as input_file:
+    for desc in read_descriptors(input_file):
+      print desc.nickname
+
+Each descriptor is a record with a six byte header followed by its content...
+
+::
+
+  format version (1 byte) | descriptor type (1 byte) | content length (4 bytes)
+
+Files written by :func:`~stem.descriptor.serialization.write_descriptors`
+start with a **FILE_HEADER** and are followed by any number of records.
+
+The content is a zlib compressed :mod:`marshal` dump of the descriptor's
+attributes, so it's only portable between interpreters with the same major
+python version. References to other descriptors (such as the
+:class:`~stem.descriptor.networkstatus.NetworkStatusDocumentV3` of a router
+status entry) are not retained.
+
+Only the attribute types that descriptors use are supported, and unlike
+:mod:`pickle` reading a record never constructs anything else, so loading
+serialized descriptors doesn't run arbitrary code. Versions and
+microdescriptor exit policies are immutable and common among descriptors, so
+the instances we load are shared between the descriptors that have them.
+
+**Module Overview:**
+
+::
+
+  serialize - Provides the binary representation of a descriptor
+  deserialize - Provides the descriptor for a binary representation
+  write_descriptors - Writes descriptors to a file
+  read_descriptors - Iterates over the descriptors within a file
+"""
+
+import array
+import datetime
+import marshal
+import struct
+import zlib
+
+import stem.descriptor
+import stem.exit_policy
+import stem.version
+
+from stem.descriptor.extrainfo_descriptor import RelayExtraInfoDescriptor, BridgeExtraInfoDescriptor
+from stem.descriptor.microdescriptor import Microdescriptor
+from stem.descriptor.router_status_entry import RouterStatusEntryV2, RouterStatusEntryV3, RouterStatusEntryMicroV3
+from stem.descriptor.server_descriptor import RelayDescriptor, BridgeDescriptor
+
+FORMAT_VERSION = 1
+FILE_HEADER = b"stem-descriptors\n"
+
+RECORD_HEADER = struct.Struct("!BBI")
+
+# Identifiers for the descriptor types we can serialize. These must never be
+# changed or reused since they're persisted.
+
+DESCRIPTOR_TYPES = {
+  1: RelayDescriptor,
+  2: BridgeDescriptor,
+  3: RelayExtraInfoDescriptor,
+  4: BridgeExtraInfoDescriptor,
+  5: Microdescriptor,
+  6: RouterStatusEntryV2,
+  7: RouterStatusEntryV3,
+  8: RouterStatusEntryMicroV3,
+}
+
+DESCRIPTOR_TYPE_IDS = dict((desc_type, type_id) for (type_id, desc_type) in DESCRIPTOR_TYPES.items())
+
+# Attributes are stored as-is if they're a type that marshal supports. Others
+# are stored as a (type code, value) tuple, and we refuse anything else. Lists
+# and dicts are only converted if they contain something that isn't a
+# primitive.
+
+PRIMITIVE_TYPES = (type(None), bool, int, long, float, bytes, unicode)
+
+LIST, DICT, TUPLE, SET, DATETIME, EXIT_POLICY, MICRO_EXIT_POLICY, VERSION, ARRAY = range(9)
+
+# Immutable objects that are common among descriptors, and expensive enough to
+# make that we reuse them. Descriptors we load share these instances, which
+# nearly halves the time it takes to load microdescriptors and router status
+# entries.
+
+MEMO_SIZE = 1000
+_MEMO = {}
+
+
+def serialize(descriptor):
+  """
+  Provides the binary representation of a descriptor.
+
+  :param stem.descriptor.__init__.Descriptor descriptor: descriptor to be
+    serialized
+
+  :returns: **bytes** with a record for the descriptor
+
+  :raises: **ValueError** if we can't serialize this type of descriptor, or
+    one of its attributes
+  """
+
+  type_id = DESCRIPTOR_TYPE_IDS.get(type(descriptor))
+
+  if type_id is None:
+    raise ValueError("We're unable to serialize %s instances" % type(descriptor).__name__)
+
+  attributes = {}
+
+  for attr, value in vars(descriptor).items():
+    if isinstance(value, stem.descriptor.Descriptor):
+      value = None  # reference to another descriptor
+
+    try:
+      attributes[attr] = _encode(value)
+    except ValueError as exc:
+      raise ValueError("Unable to serialize the %s attribute of %s: %s" % (attr, type(descriptor).__name__, exc))
+
+  content = zlib.compress(marshal.dumps(attributes, 2), 1)
+  return RECORD_HEADER.pack(FORMAT_VERSION, type_id, len(content)) + content
+
+
+def deserialize(content):
+  """
+  Provides the descriptor for a binary representation.
+
+  :param bytes content: record provided by
+    :func:`~stem.descriptor.serialization.serialize`
+
+  :returns: :class:`~stem.descriptor.__init__.Descriptor` for the record
+
+  :raises: **ValueError** if the content is malformed
+  """
+
+  if len(content) < RECORD_HEADER.size:
+    raise ValueError("Serialized descriptors should start with a %i byte header" % RECORD_HEADER.size)
+
+  format_version, type_id, content_length = RECORD_HEADER.unpack_from(content)
+
+  if len(content) != RECORD_HEADER.size + content_length:
+    raise ValueError("Serialized descriptor's header indicated that it should be %i bytes, but was %i" % (RECORD_HEADER.size + content_length, len(content)))
+
+  return _deserialize(format_version, type_id, content[RECORD_HEADER.size:])
+
+
+def write_descriptors(output_file, descriptors):
+  """
+  Writes descriptors to a file, which can be read with
+  :func:`~stem.descriptor.serialization.read_descriptors`. Descriptors are
+  written as we go, so this can be used with an iterator for any number of
+  them.
+
+  :param file output_file: file to write to, this should be in binary mode
+  :param iterable descriptors: descriptors to be written
+
+  :returns: **int** for the number of descriptors that we wrote
+
+  :raises:
+    * **ValueError** if we can't serialize one of the descriptors
+    * **IOError** if unable to write to the file
+  """
+
+  output_file.write(FILE_HEADER)
+  count = 0
+
+  for desc in descriptors:
+    output_file.write(serialize(desc))
+    count += 1
+
+  return count
+
+
+def read_descriptors(input_file):
+  """
+  Iterates over the descriptors within a file written by
+  :func:`~stem.descriptor.serialization.write_descriptors`.
+
+  :param file input_file: file to be read, this should be in binary mode
+
+  :returns: iterator for the :class:`~stem.descriptor.__init__.Descriptor`
+    instances in the file
+
+  :raises:
+    * **ValueError** if the file is malformed
+    * **IOError** if unable to read the file
+  """
+
+  if input_file.read(len(FILE_HEADER)) != FILE_HEADER:
+    raise ValueError("File doesn't contain serialized descriptors")
+
+  while True:
+    header = input_file.read(RECORD_HEADER.size)
+
+    if not header:
+      break
+    elif len(header) != RECORD_HEADER.size:
+      raise ValueError("File with serialized descriptors is truncated")
+
+    format_version, type_id, content_length = RECORD_HEADER.unpack(header)
+    content = input_file.read(content_length)
+
+    if len(content) != content_length:
+      raise ValueError("File with serialized descriptors is truncated")
+
+    yield _deserialize(format_version, type_id, content)
+
+
+def _deserialize(format_version, type_id, content):
+  if format_version != FORMAT_VERSION:
+    raise ValueError("We can only read version %i of serialized descriptors, this is version %i" % (FORMAT_VERSION, format_version))
+
+  desc_type = DESCRIPTOR_TYPES.get(type_id)
+
+  if desc_type is None:
+    raise ValueError("Serialized descriptor has an unrecognized type: %i" % type_id)
+
+  try:
+    attributes = marshal.loads(zlib.decompress(content))
+  except (zlib.error, ValueError, EOFError, TypeError) as exc:
+    raise ValueError("Unable to read serialized descriptor: %s" % exc)
+
+  try:
+    for attr, value in attributes.items():
+      if type(value) in (tuple, list, dict):
+        attributes[attr] = _decode(value)
+  except (TypeError, ValueError) as exc:
+    raise ValueError("Unable to read serialized descriptor: %s" % exc)
+
+  # descriptor objects are constructed from text, so skipping their
+  # constructor and restoring their attributes
+
+  desc = desc_type.__new__(desc_type)
+  desc.__dict__.update(attributes)
+  return desc
+
+
+def _encode(value):
+  """
+  Converts a value into something that marshal can store.
+  """
+
+  value_type = type(value)
+
+  if value_type in PRIMITIVE_TYPES:
+    return value
+  elif value_type == list:
+    if all([type(entry) in PRIMITIVE_TYPES for entry in value]):
+      return value
+
+    return (LIST, [_encode(entry) for entry in value])
+  elif value_type == dict:
+    if all([type(entry) in PRIMITIVE_TYPES for entry in value.values()]):
+      return value
+
+    return (DICT, [(_encode(k), _encode(v)) for (k, v) in value.items()])
+  elif value_type == tuple:
+    return (TUPLE, [_encode(entry) for entry in value])
+  elif value_type == set:
+    return (SET, [_encode(entry) for entry in value])
+  elif value_type == array.array:
+    return (ARRAY, (value.typecode, value.tolist()))
+  elif value_type == datetime.datetime:
+    return (DATETIME, value.timetuple()[:6] + (value.microsecond,))
+  elif value_type == stem.exit_policy.MicroExitPolicy:
+    return (MICRO_EXIT_POLICY, str(value))
+  elif value_type == stem.exit_policy.ExitPolicy:
+    rules = value._input_rules if value._rules is None else value._rules
+    return (EXIT_POLICY, ([str(rule) for rule in rules], value._is_allowed_default))
+  elif value_type == stem.version.Version:
+    return (VERSION, str(value))
+  else:
+    raise ValueError("%s values aren't supported" % value_type.__name__)
+
+
+def _decode(value):
+  """
+  Reverses the conversion of :func:`~stem.descriptor.serialization._encode`.
+  """
+
+  if type(value) != tuple:
+    return value  # primitive, or a list or dict of them
+
+  value_type, content = value
+
+  if value_type == LIST:
+    return [_decode(entry) for entry in content]
+  elif value_type == DICT:
+    return dict([(_decode(k), _decode(v)) for (k, v) in content])
+  elif value_type == TUPLE:
+    return tuple([_decode(entry) for entry in content])
+  elif value_type == SET:
+    return set([_decode(entry) for entry in content])
+  elif value_type == ARRAY:
+    return array.array(*content)
+  elif value_type == DATETIME:
+    return datetime.datetime(*content)
+  elif value_type == MICRO_EXIT_POLICY:
+    return _memoize(value, stem.exit_policy.MicroExitPolicy, content)
+  elif value_type == EXIT_POLICY:
+    rules, is_allowed_default = content
+    policy = stem.exit_policy.ExitPolicy(*rules)
+    policy._set_default_allowed(is_allowed_default)
+    return policy
+  elif value_type == VERSION:
+    return _memoize(value, stem.version.Version, content)
+  else:
+    raise ValueError("Serialized descriptor has an unrecognized value type: %s" % value_type)
+
+
+def _memoize(key, constructor, arg):
+  """
+  Provides an instance from our memo, or constructs it if we don't have it.
+  """
+
+  value = _MEMO.get(key)
+
+  if value is None:
+    if len(_MEMO) >= MEMO_SIZE:
+      _MEMO.clear()
+
+    value = constructor(arg)
+    _MEMO[key] = value
+
+  return value
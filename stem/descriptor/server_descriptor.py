@@ -26,11 +26,14 @@ etc). This information is provided from a few sources...
     |- get_unrecognized_lines - lines with unrecognized content
     |- get_annotations - dictionary of content prior to the descriptor entry
     +- get_annotation_lines - lines that provided the annotations
+
+  save_verified_digests - saves the relay descriptors we've verified
+  load_verified_digests - loads relay descriptors that don't need to be verified
 """
 
 import base64
+import binascii
 import codecs
-import datetime
 import hashlib
 import re
 
@@ -74,6 +77,75 @@ SINGLE_FIELDS = (
   "ntor-onion-key",
 )
 
+# Signing keys that we've decoded, mapping their DER encoding to a (modulus,
+# public exponent) tuple. Relays keep the same signing key, so when their
+# descriptors are read again we don't need to decode it.
+
+SIGNING_KEY_CACHE_SIZE = 10000
+_SIGNING_KEYS = {}
+
+# Relay descriptors whose signature we've verified, identified by the sha1 of
+# their digest and signature.
+
+VERIFIED_DIGESTS_SIZE = 100000
+VERIFIED_DIGEST_LENGTH = 20
+_VERIFIED_DIGESTS = set()
+
+
+def save_verified_digests(path):
+  """
+  Saves the relay descriptors whose signature we've verified so far, so other
+  processes can skip verifying them again through
+  :func:`~stem.descriptor.server_descriptor.load_verified_digests`.
+
+  :param str path: location to save to
+
+  :returns: **int** for the number of descriptors that were saved
+
+  :raises: **IOError** if unable to write to the path
+  """
+
+  verified = list(_VERIFIED_DIGESTS)
+
+  with open(path, 'wb') as verified_file:
+    verified_file.write(b"".join(verified))
+
+  return len(verified)
+
+
+def load_verified_digests(path):
+  """
+  Loads relay descriptors whose signature has already been verified, so
+  they're not checked again when they're parsed. We keep up to
+  **VERIFIED_DIGESTS_SIZE** of these.
+
+  Descriptors that match are trusted without checking their signature, so
+  only load files that you've saved yourself.
+
+  :param str path: file made by
+    :func:`~stem.descriptor.server_descriptor.save_verified_digests`
+
+  :returns: **int** for the number of descriptors that were loaded
+
+  :raises:
+    * **ValueError** if the file is malformed
+    * **IOError** if unable to read the path
+  """
+
+  with open(path, 'rb') as verified_file:
+    content = verified_file.read()
+
+  if len(content) % VERIFIED_DIGEST_LENGTH != 0:
+    raise ValueError("%s isn't a file of verified descriptor digests" % path)
+
+  count = 0
+
+  for i in xrange(0, len(content), VERIFIED_DIGEST_LENGTH):
+    _cache(_VERIFIED_DIGESTS, content[i:i + VERIFIED_DIGEST_LENGTH], VERIFIED_DIGESTS_SIZE)
+    count += 1
+
+  return count
+
 
 def _parse_file(descriptor_file, is_bridge = False, validate = True):
   """
@@ -180,11 +252,11 @@ class ServerDescriptor(stem.descriptor.Descriptor):
 
   :var datetime read_history_end: end of the sampling interval
   :var int read_history_interval: seconds per interval
-  :var list read_history_values: bytes read during each interval
+  :var array read_history_values: bytes read during each interval
 
   :var datetime write_history_end: end of the sampling interval
   :var int write_history_interval: seconds per interval
-  :var list write_history_values: bytes written during each interval
+  :var array write_history_values: bytes written during each interval
 
   **\*** attribute is either required when we're parsed with validation or has
   a default value, others are left as **None** if undefined
@@ -210,12 +282,7 @@ class ServerDescriptor(stem.descriptor.Descriptor):
 
     super(ServerDescriptor, self).__init__(raw_contents)
 
-    # Only a few things can be arbitrary bytes according to the dir-spec, so
-    # parsing them separately.
-
-    self.platform = stem.descriptor._get_bytes_field("platform", raw_contents)
-    self.contact = stem.descriptor._get_bytes_field("contact", raw_contents)
-
+    raw_bytes = raw_contents
     raw_contents = stem.util.str_tools._to_unicode(raw_contents)
 
     self.nickname = None
@@ -272,6 +339,12 @@ class ServerDescriptor(stem.descriptor.Descriptor):
     entries, policy = \
       stem.descriptor._get_descriptor_components(raw_contents, validate, ("accept", "reject"))
 
+    # Only a few things can be arbitrary bytes according to the dir-spec, so
+    # providing them as bytes rather than unicode.
+
+    self.platform = stem.descriptor._get_bytes_value("platform", entries, raw_bytes)
+    self.contact = stem.descriptor._get_bytes_value("contact", entries, raw_bytes)
+
     self.exit_policy = stem.exit_policy.ExitPolicy(*policy)
     self._parse(entries, validate)
 
@@ -432,7 +505,7 @@ class ServerDescriptor(stem.descriptor.Descriptor):
         # "published" YYYY-MM-DD HH:MM:SS
 
         try:
-          self.published = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+          self.published = stem.util.str_tools._parse_timestamp(value)
         except ValueError:
           if validate:
             raise ValueError("Published line's time wasn't parsable: %s" % line)
@@ -545,13 +618,7 @@ class ServerDescriptor(stem.descriptor.Descriptor):
           timestamp, interval, remainder = \
             stem.descriptor.extrainfo_descriptor._parse_timestamp_and_interval(keyword, value)
 
-          try:
-            if remainder:
-              history_values = [int(entry) for entry in remainder.split(",")]
-            else:
-              history_values = []
-          except ValueError:
-            raise ValueError("%s line has non-numeric values: %s" % (keyword, line))
+          history_values = stem.descriptor.extrainfo_descriptor._parse_history_values(keyword, line, remainder)
 
           if keyword == "read-history":
             self.read_history_end = timestamp
@@ -630,6 +697,13 @@ class RelayDescriptor(ServerDescriptor):
   :var str signature: **\*** signature for this descriptor
 
   **\*** attribute is required when we're parsed with validation
+
+  When validated we check the descriptor's signature. Descriptors we've
+  already verified (such as when reading the same cached-descriptors again)
+  are skipped, and these can be shared with other processes through
+  :func:`~stem.descriptor.server_descriptor.save_verified_digests`. To
+  verify descriptors in parallel use the **workers** argument of
+  :func:`~stem.descriptor.__init__.parse_file`.
   """
 
   def __init__(self, raw_contents, validate = True, annotations = None):
@@ -702,21 +776,23 @@ class RelayDescriptor(ServerDescriptor):
     if not stem.prereq.is_crypto_available():
       return
 
-    from Crypto.Util import asn1
-    from Crypto.Util.number import bytes_to_long, long_to_bytes
+    local_digest = self.digest()
 
-    # get the ASN.1 sequence
+    # skip descriptors that we've already verified, the signing key is part of
+    # what's digested so this and the signature are all that can differ
 
-    seq = asn1.DerSequence()
-    seq.decode(key_as_der)
-    modulus = seq[0]
-    public_exponent = seq[1]  # should always be 65537
+    verified_key = hashlib.sha1(stem.util.str_tools._to_bytes(local_digest + self.signature)).digest()
+
+    if verified_key in _VERIFIED_DIGESTS:
+      return
+
+    modulus, public_exponent = _get_signing_key(key_as_der)
 
     sig_as_bytes = RelayDescriptor._get_key_bytes(self.signature)
 
     # convert the descriptor signature to an int
 
-    sig_as_long = bytes_to_long(sig_as_bytes)
+    sig_as_long = int(binascii.hexlify(sig_as_bytes), 16)
 
     # use the public exponent[e] & the modulus[n] to decrypt the int
 
@@ -728,7 +804,7 @@ class RelayDescriptor(ServerDescriptor):
 
     # convert the int to a byte array.
 
-    decrypted_bytes = long_to_bytes(decrypted_int, blocksize)
+    decrypted_bytes = binascii.unhexlify("%0*x" % (blocksize * 2, decrypted_int))
 
     ############################################################################
     ## The decrypted bytes should have a structure exactly along these lines.
@@ -759,11 +835,11 @@ class RelayDescriptor(ServerDescriptor):
     digest_hex = codecs.encode(decrypted_bytes[seperator_index + 1:], 'hex_codec')
     digest = stem.util.str_tools._to_unicode(digest_hex.upper())
 
-    local_digest = self.digest()
-
     if digest != local_digest:
       raise ValueError("Decrypted digest does not match local digest (calculated: %s, local: %s)" % (digest, local_digest))
 
+    _cache(_VERIFIED_DIGESTS, verified_key, VERIFIED_DIGESTS_SIZE)
+
   def _parse(self, entries, validate):
     entries = dict(entries)  # shallow copy since we're destructive
 
@@ -945,3 +1021,38 @@ class BridgeDescriptor(ServerDescriptor):
 
   def __le__(self, other):
     return self._compare(other, lambda s, o: s <= o)
+
+
+def _get_signing_key(key_as_der):
+  """
+  Provides the (modulus, public exponent) of a DER encoded signing key.
+  """
+
+  key = _SIGNING_KEYS.get(key_as_der)
+
+  if key is None:
+    from Crypto.Util import asn1
+
+    # get the ASN.1 sequence
+
+    seq = asn1.DerSequence()
+    seq.decode(key_as_der)
+    key = (seq[0], seq[1])  # public exponent should always be 65537
+
+    if len(_SIGNING_KEYS) >= SIGNING_KEY_CACHE_SIZE:
+      _SIGNING_KEYS.clear()
+
+    _SIGNING_KEYS[key_as_der] = key
+
+  return key
+
+
+def _cache(cache, value, size):
+  """
+  Adds a value to a set, clearing it first if it's full.
+  """
+
+  if len(cache) >= size:
+    cache.clear()
+
+  cache.add(value)
@@ -0,0 +1,361 @@
+# Copyright 2013, Damian Johnson
+# See LICENSE for licensing information
+
+"""
+Local SQLite database of descriptors. Questions like "what did this relay look
+like last March" otherwise mean reading through years of archives, but once
+descriptors have been added to a store they can be looked up by their
+fingerprint, digest, address, flags, or when they were published.
+
+::
+
+  from stem.descriptor.reader import DescriptorReader
+  from stem.descriptor.store import DescriptorStore
+
+  with DescriptorStore("/tmp/descriptors.sqlite") as store:
+    with DescriptorReader(["/tmp/archives"]) as reader:
+      store.add(reader)
+
+    relay = store.get_at("9695DFC35FFEB861329B9F1AB04C46397020CE31", datetime.datetime(2013, 3, 1))
+    print relay.nickname
+
+The store retains each descriptor's content rather than its parsed
+attributes, and descriptors are only parsed again as query results are
+iterated over. References to other descriptors (such as the
+:class:`~stem.descriptor.networkstatus.NetworkStatusDocumentV3` of a router
+status entry) are not retained.
+
+Descriptors are looked up by their digest. For router status entries this is
+the digest of the descriptor that they reference rather than their own, so
+entries are only provided by digest when we're asked for that type.
+
+Descriptors are indexed by when they took effect. For router status entries
+this is the **valid_after** of the consensus they came from, and for anything
+else it's when the descriptor was published. Descriptors without a timestamp,
+such as microdescriptors, are treated as being from the unix epoch.
+
+**Module Overview:**
+
+::
+
+  DescriptorStore - SQLite database of descriptors
+    |- add - adds descriptors to the store
+    |- get - provides the descriptor with a given digest
+    |- get_at - provides the descriptor a relay had at a given time
+    |- query - provides descriptors matching the given criteria
+    +- close - closes our database
+"""
+
+import calendar
+import sqlite3
+
+import stem.descriptor
+
+from stem.descriptor.extrainfo_descriptor import RelayExtraInfoDescriptor, BridgeExtraInfoDescriptor
+from stem.descriptor.microdescriptor import Microdescriptor
+from stem.descriptor.serialization import DESCRIPTOR_TYPES, DESCRIPTOR_TYPE_IDS
+from stem.descriptor.server_descriptor import RelayDescriptor, BridgeDescriptor
+
+# Number of descriptors we insert with each executemany() call.
+
+STORE_BATCH_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS descriptors (
+  id INTEGER PRIMARY KEY,
+  type INTEGER NOT NULL,
+  fingerprint TEXT,
+  digest TEXT,
+  address TEXT,
+  published INTEGER,
+  valid_after INTEGER NOT NULL,
+  path TEXT,
+  archive_path TEXT,
+  content BLOB NOT NULL,
+  UNIQUE (type, digest, valid_after)
+);
+
+CREATE TABLE IF NOT EXISTS flags (
+  flag TEXT NOT NULL,
+  descriptor_id INTEGER NOT NULL,
+  PRIMARY KEY (flag, descriptor_id)
+);
+
+CREATE INDEX IF NOT EXISTS descriptors_by_fingerprint ON descriptors (fingerprint, valid_after);
+CREATE INDEX IF NOT EXISTS descriptors_by_digest ON descriptors (digest);
+CREATE INDEX IF NOT EXISTS descriptors_by_address ON descriptors (address);
+CREATE INDEX IF NOT EXISTS descriptors_by_published ON descriptors (published);
+CREATE INDEX IF NOT EXISTS descriptors_by_valid_after ON descriptors (valid_after);
+"""
+
+INSERT_DESCRIPTOR = "INSERT OR IGNORE INTO descriptors (id, type, fingerprint, digest, address, published, valid_after, path, archive_path, content) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+# Flags are only added for descriptors that were inserted. Ones that we
+# ignored as duplicates never had their id used.
+
+INSERT_FLAG = "INSERT OR IGNORE INTO flags (flag, descriptor_id) SELECT ?, id FROM descriptors WHERE id = ?"
+
+# Descriptor types whose digest is of their own content. Router status entries
+# instead have the digest of the descriptor they reference.
+
+DIGESTED_TYPES = (RelayDescriptor, BridgeDescriptor, RelayExtraInfoDescriptor, BridgeExtraInfoDescriptor, Microdescriptor)
+
+SELECT_DESCRIPTOR = "SELECT type, path, archive_path, content FROM descriptors"
+
+
+class DescriptorStore(object):
+  """
+  SQLite database of descriptors. This can be used as a context manager, in
+  which case the database is closed when we're done.
+
+  :param str path: location of the database, this is created if it doesn't
+    already exist and kept in memory if **:memory:**
+
+  :raises: **IOError** if the database can't be opened
+  """
+
+  def __init__(self, path = ":memory:"):
+    self.path = path
+
+    try:
+      self._connection = sqlite3.connect(path)
+      self._connection.execute("PRAGMA journal_mode = WAL")
+      self._connection.execute("PRAGMA synchronous = NORMAL")
+      self._connection.executescript(SCHEMA)
+    except sqlite3.Error as exc:
+      raise IOError("Unable to open descriptor store at %s: %s" % (path, exc))
+
+  def add(self, descriptors):
+    """
+    Adds descriptors to the store. This is done in a single transaction, so
+    if it fails then none of the descriptors are added. Descriptors that are
+    already in the store are skipped.
+
+    Only the types of descriptors that can be
+    :mod:`serialized <stem.descriptor.serialization>` can be stored.
+
+    :param iterable descriptors: descriptors to be added, this can be a
+      :class:`~stem.descriptor.reader.DescriptorReader` or any other iterable
+
+    :returns: **int** for the number of descriptors that were added
+
+    :raises:
+      * **ValueError** if we're unable to store one of the descriptors
+      * **IOError** if unable to write to the database
+    """
+
+    try:
+      with self._connection:
+        added = 0
+        next_id = self._connection.execute("SELECT COALESCE(MAX(id), 0) FROM descriptors").fetchone()[0] + 1
+        descriptor_rows, flag_rows = [], []
+
+        for desc in descriptors:
+          descriptor_rows.append(_to_row(next_id, desc))
+
+          for flag in getattr(desc, 'flags', None) or ():
+            flag_rows.append((flag, next_id))
+
+          next_id += 1
+
+          if len(descriptor_rows) >= STORE_BATCH_SIZE:
+            added += self._insert(descriptor_rows, flag_rows)
+            descriptor_rows, flag_rows = [], []
+
+        return added + self._insert(descriptor_rows, flag_rows)
+    except sqlite3.Error as exc:
+      raise IOError("Unable to add descriptors to %s: %s" % (self.path, exc))
+
+  def get(self, digest, descriptor_type = None):
+    """
+    Provides the descriptor with the given digest. Router status entries are
+    only provided if **descriptor_type** is one of them, since their digest is
+    of the descriptor they reference.
+
+    :param str digest: hex encoded digest of the descriptor
+    :param class descriptor_type: type of descriptor to provide, any type with
+      its own digest if **None**
+
+    :returns: :class:`~stem.descriptor.__init__.Descriptor` with the digest,
+      **None** if we don't have it
+    """
+
+    if descriptor_type is None:
+      descriptor_type = DIGESTED_TYPES
+
+    for desc in self.query(descriptor_type, digest = digest, limit = 1):
+      return desc
+
+    return None
+
+  def get_at(self, fingerprint, timestamp, descriptor_type = None):
+    """
+    Provides the descriptor that a relay had at the given time. That is, the
+    most recent one that took effect at or before the timestamp.
+
+    :param str fingerprint: relay fingerprint
+    :param datetime timestamp: time to provide the descriptor for
+    :param class descriptor_type: type of descriptor to provide, any type if
+      **None**
+
+    :returns: :class:`~stem.descriptor.__init__.Descriptor` the relay had at
+      the time, **None** if we don't have one
+    """
+
+    for desc in self.query(descriptor_type, fingerprint = fingerprint, end = timestamp, limit = 1, newest_first = True):
+      return desc
+
+    return None
+
+  def query(self, descriptor_type = None, fingerprint = None, digest = None, address = None, flag = None, start = None, end = None, limit = None, newest_first = False):
+    """
+    Provides the descriptors matching all of the given criteria, ordered by
+    when they took effect. Descriptors are parsed as they're iterated over.
+
+    :param class,list descriptor_type: type of descriptor to provide, or a
+      list of types, any type if **None**
+    :param str fingerprint: relay fingerprint
+    :param str digest: hex encoded digest of the descriptor, or for router
+      status entries the descriptor that they reference
+    :param str address: IPv4 address of the relay
+    :param str flag: flag that router status entries must have
+    :param datetime start: only provide descriptors that took effect at or
+      after this time
+    :param datetime end: only provide descriptors that took effect at or
+      before this time
+    :param int limit: maximum number of descriptors to provide
+    :param bool newest_first: provides the most recent descriptors first if
+      **True**
+
+    :returns: iterator for the matching
+      :class:`~stem.descriptor.__init__.Descriptor` instances
+
+    :raises: **ValueError** if the descriptor type can't be stored
+    """
+
+    conditions, args = [], []
+
+    if isinstance(descriptor_type, (list, tuple)):
+      conditions.append("type IN (%s)" % ", ".join(["?"] * len(descriptor_type)))
+      args += [_get_type_id(desc_type) for desc_type in descriptor_type]
+    elif descriptor_type is not None:
+      conditions.append("type = ?")
+      args.append(_get_type_id(descriptor_type))
+
+    for column, value in (("fingerprint", fingerprint), ("digest", digest), ("address", address)):
+      if value is not None:
+        conditions.append("%s = ?" % column)
+        args.append(value)
+
+    if flag is not None:
+      conditions.append("id IN (SELECT descriptor_id FROM flags WHERE flag = ?)")
+      args.append(flag)
+
+    if start is not None:
+      conditions.append("valid_after >= ?")
+      args.append(_to_unix_time(start))
+
+    if end is not None:
+      conditions.append("valid_after <= ?")
+      args.append(_to_unix_time(end))
+
+    query = SELECT_DESCRIPTOR
+
+    if conditions:
+      query += " WHERE " + " AND ".join(conditions)
+
+    query += " ORDER BY valid_after %s, id %s" % (("DESC",) * 2 if newest_first else ("ASC",) * 2)
+
+    if limit is not None:
+      query += " LIMIT %i" % limit
+
+    return self._rehydrate(self._connection.execute(query, args))
+
+  def close(self):
+    """
+    Closes our database.
+    """
+
+    self._connection.close()
+
+  def _insert(self, descriptor_rows, flag_rows):
+    # Provides the number of descriptors we inserted. The rowcount of
+    # executemany() is summed across its rows, and excludes those that we
+    # ignored.
+
+    added = 0
+
+    if descriptor_rows:
+      added = self._connection.executemany(INSERT_DESCRIPTOR, descriptor_rows).rowcount
+
+    if flag_rows:
+      self._connection.executemany(INSERT_FLAG, flag_rows)
+
+    return added
+
+  def _rehydrate(self, cursor):
+    for type_id, path, archive_path, content in cursor:
+      # content was validated when it was added, so skipping that now
+
+      desc = DESCRIPTOR_TYPES[type_id](bytes(content), validate = False)
+
+      if path is not None:
+        desc._set_path(str(path))
+
+      if archive_path is not None:
+        desc._set_archive_path(str(archive_path))
+
+      yield desc
+
+  def __len__(self):
+    return self._connection.execute("SELECT COUNT(*) FROM descriptors").fetchone()[0]
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exit_type, value, traceback):
+    self.close()
+
+
+def _get_type_id(descriptor_type):
+  type_id = DESCRIPTOR_TYPE_IDS.get(descriptor_type)
+
+  if type_id is None:
+    raise ValueError("We're unable to store %s instances" % descriptor_type.__name__)
+
+  return type_id
+
+
+def _to_row(row_id, desc):
+  digest = getattr(desc, 'digest', None)
+
+  if callable(digest):
+    digest = digest()
+
+  published = _to_unix_time(getattr(desc, 'published', None))
+  document = getattr(desc, 'document', None)
+
+  if isinstance(document, stem.descriptor.Descriptor) and getattr(document, 'valid_after', None):
+    valid_after = _to_unix_time(document.valid_after)
+  else:
+    valid_after = published if published is not None else 0
+
+  return (
+    row_id,
+    _get_type_id(type(desc)),
+    getattr(desc, 'fingerprint', None),
+    digest,
+    getattr(desc, 'address', None),
+    published,
+    valid_after,
+    desc.get_path(),
+    desc.get_archive_path(),
+    sqlite3.Binary(desc.get_bytes()),
+  )
+
+
+def _to_unix_time(timestamp):
+  if timestamp is None:
+    return None
+
+  return calendar.timegm(timestamp.utctimetuple())
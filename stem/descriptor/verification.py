@@ -0,0 +1,433 @@
+# Copyright 2013, Damian Johnson
+# See LICENSE for licensing information
+
+"""
+Verification of the signatures on v3 network status documents. Directory
+authorities sign documents with medium term signing keys, which are in turn
+certified by their long term identity key through a
+:class:`~stem.descriptor.networkstatus.KeyCertificate`.
+
+Signing keys are parsed and checked against their certificate once when
+they're added to a :class:`~stem.descriptor.verification.KeyCache`, after which
+they can be used to verify any number of documents...
+
+::
+
+  from stem.descriptor import parse_file
+  from stem.descriptor.verification import KeyCache, SignatureStatus, verify_files
+
+  keys = KeyCache(parse_file('/tmp/certs', 'dir-key-certificate-3 1.0'))
+
+  for path, signatures in verify_files(consensus_paths, keys, workers = 4):
+    valid = [identity for (identity, status) in signatures.items() if status == SignatureStatus.VALID]
+    print "%s was signed by %i authorities" % (path, len(valid))
+
+Votes include the certificate of the authority that made them, so for those
+you can add their **key_certificate** to the cache.
+
+This requires `pycrypto <https://www.dlitz.net/software/pycrypto/>`_.
+
+**Module Overview:**
+
+::
+
+  verify_signatures - checks the signatures of a document
+  verify_files - checks the signatures of documents on disk
+
+  KeyCache - Signing keys of directory authorities
+    |- add - adds the signing keys of key certificates
+    |- get - provides the signing key used for a signature
+    +- remove_expired - removes keys that have expired
+
+  SigningKey - Signing key of a directory authority
+    +- is_valid_at - checks if the key was valid at a given time
+
+.. data:: SignatureStatus (enum)
+
+  Outcome of checking a document's signature.
+
+  =================== ===========
+  SignatureStatus     Description
+  =================== ===========
+  **VALID**           signature matches the document
+  **INVALID**         signature doesn't match the document
+  **UNKNOWN_KEY**     we don't have the signing key for the signature
+  **EXPIRED_KEY**     signing key wasn't valid when the document was
+  **UNSUPPORTED**     signature was made with a digest algorithm we don't support
+  =================== ===========
+"""
+
+import binascii
+import datetime
+import hashlib
+import re
+
+import stem.descriptor
+import stem.prereq
+import stem.util.enum
+import stem.util.str_tools
+
+from stem.descriptor.networkstatus import DocumentSignature
+
+SignatureStatus = stem.util.enum.UppercaseEnum(
+  "VALID",
+  "INVALID",
+  "UNKNOWN_KEY",
+  "EXPIRED_KEY",
+  "UNSUPPORTED",
+)
+
+DIGEST_ALGORITHMS = {
+  'sha1': hashlib.sha1,
+  'sha256': hashlib.sha256,
+}
+
+# Number of files we give our workers at a time.
+
+VERIFY_CHUNK_SIZE = 16
+
+DOCUMENT_START = b"network-status-version"
+DOCUMENT_SIGNED_END = b"\ndirectory-signature "
+CERTIFICATE_START = b"dir-key-certificate-version"
+CERTIFICATE_SIGNED_END = b"\ndir-key-certification\n"
+
+VALID_AFTER_LINE = re.compile(b"^valid-after (.*)$", re.MULTILINE)
+SIGNATURE_LINE = re.compile(b"^directory-signature (?:(\\S+) )?(\\S+) (\\S+)\n(-----BEGIN SIGNATURE-----\n.*?\n-----END SIGNATURE-----)", re.MULTILINE | re.DOTALL)
+
+
+class SigningKey(object):
+  """
+  Directory authority's signing key.
+
+  :var str identity: fingerprint of the authority's identity key
+  :var str key_digest: hex encoded sha1 digest of the signing key
+  :var datetime published: time when the key was generated
+  :var datetime expires: time after which the key is invalid
+  :var long modulus: rsa modulus of the key
+  :var long exponent: rsa public exponent of the key
+  """
+
+  def __init__(self, identity, key_digest, published, expires, modulus, exponent):
+    self.identity = identity
+    self.key_digest = key_digest
+    self.published = published
+    self.expires = expires
+    self.modulus = modulus
+    self.exponent = exponent
+
+  def is_valid_at(self, timestamp):
+    """
+    Checks if the key was valid at a given time.
+
+    :param datetime timestamp: time to check
+
+    :returns: **True** if the key was valid at the time, **False** otherwise
+    """
+
+    if self.published and timestamp < self.published:
+      return False
+
+    return not (self.expires and timestamp > self.expires)
+
+
+class KeyCache(object):
+  """
+  Signing keys of directory authorities, keyed on the authority's fingerprint
+  and the key's digest. These are what directory signatures identify their
+  key by.
+
+  :param iterable certificates: :class:`~stem.descriptor.networkstatus.KeyCertificate`
+    with the keys to start with
+  :param bool validate: checks that the certificates were made by the
+    authority they claim to be from if **True**
+
+  :raises:
+    * **ValueError** if a certificate is invalid and validate is **True**
+    * **ImportError** if pycrypto is unavailable
+  """
+
+  def __init__(self, certificates = (), validate = True):
+    if not stem.prereq.is_crypto_available():
+      raise ImportError("Verifying document signatures requires pycrypto")
+
+    self.validate = validate
+    self._keys = {}
+    self.add(certificates)
+
+  def add(self, certificates):
+    """
+    Adds the signing keys of key certificates.
+
+    :param iterable certificates: :class:`~stem.descriptor.networkstatus.KeyCertificate`
+      with the keys to be added
+
+    :returns: **int** for the number of keys that we didn't already have
+
+    :raises: **ValueError** if a certificate is invalid and validate is **True**
+    """
+
+    added = 0
+
+    for cert in certificates:
+      if cert.signing_key is None or cert.fingerprint is None:
+        if self.validate:
+          raise ValueError("Key certificate lacks a signing key or fingerprint")
+
+        continue
+
+      signing_key_der = _get_block_bytes(cert.signing_key)
+      key_digest = hashlib.sha1(signing_key_der).hexdigest().upper()
+      fingerprint = cert.fingerprint.upper()
+
+      if (fingerprint, key_digest) in self._keys:
+        continue
+
+      if self.validate:
+        _check_certificate(cert, fingerprint)
+
+      modulus, exponent = _get_rsa_key(signing_key_der)
+      self._keys[(fingerprint, key_digest)] = SigningKey(fingerprint, key_digest, cert.published, cert.expires, modulus, exponent)
+      added += 1
+
+    return added
+
+  def get(self, identity, key_digest):
+    """
+    Provides the signing key that a signature was made with.
+
+    :param str identity: fingerprint of the authority
+    :param str key_digest: digest of the signing key
+
+    :returns: :class:`~stem.descriptor.verification.SigningKey` for the key,
+      **None** if we don't have it
+    """
+
+    return self._keys.get((identity.upper(), key_digest.upper()))
+
+  def remove_expired(self, timestamp = None):
+    """
+    Removes keys that expired before a given time.
+
+    :param datetime timestamp: time to check against, this is now if **None**
+
+    :returns: **int** for the number of keys that were removed
+    """
+
+    if timestamp is None:
+      timestamp = datetime.datetime.utcnow()
+
+    expired = [key for (key, value) in self._keys.items() if value.expires and value.expires < timestamp]
+
+    for key in expired:
+      del self._keys[key]
+
+    return len(expired)
+
+  def __len__(self):
+    return len(self._keys)
+
+
+def verify_signatures(document, keys):
+  """
+  Checks the signatures of a network status document. The digest of the
+  document's signed content is calculated once for all of its signatures.
+
+  :param NetworkStatusDocumentV3 document: document to be checked
+  :param KeyCache keys: signing keys of the authorities
+
+  :returns: **dict** of authority fingerprints to the
+    :data:`~stem.descriptor.verification.SignatureStatus` of their signature
+  """
+
+  return _verify(document.get_bytes(), document.valid_after, document.signatures, keys)
+
+
+def verify_files(paths, keys, workers = None):
+  """
+  Checks the signatures of network status documents on disk. This only reads
+  what's needed to check the signatures, so documents aren't parsed or
+  validated otherwise.
+
+  :param iterable paths: locations of the documents
+  :param KeyCache keys: signing keys of the authorities
+  :param int workers: number of processes to check the documents with, if
+    **None** then this is done in our own process
+
+  :returns: iterator for (path, signatures) tuples in the order of the paths,
+    where signatures is a **dict** of authority fingerprints to the
+    :data:`~stem.descriptor.verification.SignatureStatus` of their signature
+
+  :raises:
+    * **ValueError** if a document lacks a 'valid-after' or signature
+    * **IOError** if a document can't be read
+  """
+
+  if not workers:
+    for path in paths:
+      yield path, _verify_file(path, keys)
+
+    return
+
+  paths = iter(paths)
+
+  def chunks():
+    while True:
+      chunk = [path for (path, _) in zip(paths, range(VERIFY_CHUNK_SIZE))]
+
+      if not chunk:
+        break
+
+      yield chunk
+
+  for result in stem.descriptor._parse_with_workers(chunks(), (keys,), workers, True, _verify_chunk):
+    yield result
+
+
+def _verify_chunk(paths, keys):
+  # Runs within our worker processes, checking a list of documents.
+
+  return [(path, _verify_file(path, keys)) for path in paths]
+
+
+def _verify_file(path, keys):
+  with open(path, 'rb') as document_file:
+    content = document_file.read()
+
+  valid_after_match = VALID_AFTER_LINE.search(content)
+
+  if not valid_after_match:
+    raise ValueError("%s doesn't have a 'valid-after' line" % path)
+
+  valid_after = stem.util.str_tools._parse_timestamp(stem.util.str_tools._to_unicode(valid_after_match.group(1).strip()))
+
+  signed_end = content.find(DOCUMENT_SIGNED_END)
+  signatures = []
+
+  if signed_end != -1:
+    for method, identity, key_digest, signature in SIGNATURE_LINE.findall(content, signed_end):
+      method = stem.util.str_tools._to_unicode(method) if method else 'sha1'
+      identity = stem.util.str_tools._to_unicode(identity)
+      key_digest = stem.util.str_tools._to_unicode(key_digest)
+      signature = stem.util.str_tools._to_unicode(signature)
+
+      signatures.append(DocumentSignature(method, identity, key_digest, signature, False))
+
+  if not signatures:
+    raise ValueError("%s doesn't have any directory signatures" % path)
+
+  return _verify(content, valid_after, signatures, keys)
+
+
+def _verify(content, valid_after, signatures, keys):
+  """
+  Checks signatures against the signed portion of a document's content.
+  """
+
+  start = content.find(DOCUMENT_START)
+  end = content.find(DOCUMENT_SIGNED_END)
+  signed_content = content[max(start, 0):end + len(DOCUMENT_SIGNED_END)] if end != -1 else None
+
+  digests = {}  # algorithm => digest of the signed content
+  results = {}
+
+  for sig in signatures:
+    algorithm = DIGEST_ALGORITHMS.get(sig.method)
+    key = keys.get(sig.identity, sig.key_digest)
+
+    if algorithm is None:
+      results[sig.identity] = SignatureStatus.UNSUPPORTED
+    elif key is None:
+      results[sig.identity] = SignatureStatus.UNKNOWN_KEY
+    elif valid_after and not key.is_valid_at(valid_after):
+      results[sig.identity] = SignatureStatus.EXPIRED_KEY
+    elif signed_content is None:
+      results[sig.identity] = SignatureStatus.INVALID
+    else:
+      if sig.method not in digests:
+        digests[sig.method] = algorithm(signed_content).digest()
+
+      if _is_valid_signature(key.modulus, key.exponent, sig.signature, digests[sig.method]):
+        results[sig.identity] = SignatureStatus.VALID
+      else:
+        results[sig.identity] = SignatureStatus.INVALID
+
+  return results
+
+
+def _check_certificate(cert, fingerprint):
+  """
+  Checks that a key certificate was made with the identity key of the
+  authority it's for.
+
+  :raises: **ValueError** if the certificate is invalid
+  """
+
+  if cert.identity_key is None or cert.certification is None:
+    raise ValueError("Key certificate for %s lacks an identity key or certification" % fingerprint)
+
+  identity_key_der = _get_block_bytes(cert.identity_key)
+
+  if hashlib.sha1(identity_key_der).hexdigest().upper() != fingerprint:
+    raise ValueError("Key certificate's identity key doesn't match its fingerprint (%s)" % fingerprint)
+
+  content = cert.get_bytes()
+  start = content.find(CERTIFICATE_START)
+  end = content.find(CERTIFICATE_SIGNED_END)
+
+  if start == -1 or end == -1:
+    raise ValueError("Unable to determine the signed content of the key certificate for %s" % fingerprint)
+
+  digest = hashlib.sha1(content[start:end + len(CERTIFICATE_SIGNED_END)]).digest()
+  modulus, exponent = _get_rsa_key(identity_key_der)
+
+  if not _is_valid_signature(modulus, exponent, cert.certification, digest):
+    raise ValueError("Key certificate for %s wasn't signed by its identity key" % fingerprint)
+
+
+def _get_block_bytes(block):
+  """
+  Provides the decoded content of a PEM block, such as a key or signature.
+  """
+
+  lines = stem.util.str_tools._to_unicode(block).strip().split('\n')
+  return binascii.a2b_base64(''.join(lines[1:-1]))
+
+
+def _get_rsa_key(key_der):
+  """
+  Provides the modulus and exponent of a DER encoded rsa public key.
+
+  :raises: **ValueError** if the key is malformed
+  """
+
+  from Crypto.Util import asn1
+
+  seq = asn1.DerSequence()
+
+  try:
+    seq.decode(key_der)
+    return seq[0], seq[1]
+  except (ValueError, IndexError, TypeError) as exc:
+    raise ValueError("Unable to decode rsa key: %s" % exc)
+
+
+def _is_valid_signature(modulus, exponent, signature, digest):
+  """
+  Checks that a signature is the PKCS#1 v1.5 padded digest, as tor makes
+  them.
+  """
+
+  from Crypto.Util.number import bytes_to_long, long_to_bytes
+
+  try:
+    sig_as_long = bytes_to_long(_get_block_bytes(signature))
+  except binascii.Error:
+    return False
+
+  blocksize = (modulus.bit_length() + 7) // 8
+  decrypted = long_to_bytes(pow(sig_as_long, exponent, modulus), blocksize)
+
+  # 0x00 0x01, followed by 0xFF padding, a 0x00 separator, and the digest
+
+  expected_padding = b'\x00\x01' + b'\xff' * (blocksize - len(digest) - 3) + b'\x00'
+  return decrypted == expected_padding + digest
@@ -362,6 +362,16 @@ class ExitPolicy(object):
     else:
       return False
 
+  def __reduce_ex__(self, protocol):
+    # Policies from descriptors are usually still unparsed strings. If so then
+    # pickling just those is far more compact, and lets them be lazily parsed
+    # again on the other end.
+
+    if self._rules is None and all([isinstance(rule, (bytes, unicode)) for rule in self._input_rules]):
+      return (ExitPolicy, tuple(self._input_rules), {'_is_allowed_default': self._is_allowed_default})
+    else:
+      return super(ExitPolicy, self).__reduce_ex__(protocol)
+
 
 class MicroExitPolicy(ExitPolicy):
   """
@@ -442,6 +452,10 @@ class MicroExitPolicy(ExitPolicy):
     else:
       return False
 
+  def __reduce_ex__(self, protocol):
+    # our policy string is all we need to reconstruct ourselves
+    return (MicroExitPolicy, (self._policy,))
+
 
 class ExitPolicyRule(object):
   """
@@ -9,6 +9,10 @@ Checks for stem dependencies. We require python 2.6 or greater (including the
 
   * validating descriptor signature integrity
 
+* numpy module
+
+  * exporting descriptors to columnar arrays
+
 ::
 
   check_requirements - checks for minimum requirements for running stem
@@ -17,11 +21,13 @@ Checks for stem dependencies. We require python 2.6 or greater (including the
   is_python_3 - checks if python 3.0 or later is available
 
   is_crypto_available - checks if the pycrypto module is available
+  is_numpy_available - checks if the numpy module is available
 """
 
 import sys
 
 IS_CRYPTO_AVAILABLE = None
+IS_NUMPY_AVAILABLE = None
 
 
 def check_requirements():
@@ -79,6 +85,24 @@ def is_crypto_available():
   return IS_CRYPTO_AVAILABLE
 
 
+def is_numpy_available():
+  global IS_NUMPY_AVAILABLE
+
+  if IS_NUMPY_AVAILABLE is None:
+    from stem.util import log
+
+    try:
+      import numpy
+      IS_NUMPY_AVAILABLE = True
+    except ImportError:
+      IS_NUMPY_AVAILABLE = False
+
+      msg = "Unable to import the numpy module. Because of this we'll be unable to export descriptors to columnar arrays."
+      log.log_once("stem.prereq.is_numpy_available", log.INFO, msg)
+
+  return IS_NUMPY_AVAILABLE
+
+
 def _check_version(minor_req):
   major_version, minor_version = sys.version_info[0:2]
 
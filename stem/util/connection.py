@@ -42,12 +42,14 @@ def is_valid_ipv4_address(address):
 
   # checks if theres four period separated values
 
-  if address.count(".") != 3:
+  octets = address.split(".")
+
+  if len(octets) != 4:
     return False
 
   # checks that each value in the octet are decimal values between 0-255
-  for entry in address.split("."):
-    if not entry.isdigit() or int(entry) < 0 or int(entry) > 255:
+  for entry in octets:
+    if not entry.isdigit() or int(entry) > 255:
       return False
     elif entry[0] == "0" and len(entry) > 1:
       return False  # leading zeros, for instance in "1.2.3.001"
@@ -47,6 +47,15 @@ TIME_UNITS = (
   (1.0, "s", " second"),
 )
 
+# Descriptors often share timestamps (for instance, the publication times of
+# router status entries) so we reuse the ones we've parsed. This is cleared
+# when it exceeds TIMESTAMP_CACHE_SIZE entries.
+
+TIMESTAMP_CACHE_SIZE = 10000
+_TIMESTAMP_CACHE = {}
+
+UNIX_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
 if stem.prereq.is_python_3():
   def _to_bytes_impl(msg):
     if isinstance(msg, str):
@@ -343,6 +352,48 @@ def _parse_iso_timestamp(entry):
   return timestamp + datetime.timedelta(microseconds = int(microseconds))
 
 
+def _parse_timestamp(entry, as_epoch = False):
+  """
+  Parses the 'YYYY-MM-DD HH:MM:SS' timestamps used throughout tor's
+  descriptors, such as...
+
+  ::
+
+    2012-11-08 16:48:41
+
+  This is equivalent to **strptime()** with a '%Y-%m-%d %H:%M:%S' format, but
+  far faster. Timestamps we've recently parsed are provided from a cache.
+
+  :param str entry: timestamp to be parsed
+  :param bool as_epoch: provides the timestamp as an **int** of seconds since
+    the unix epoch if **True**, a **datetime** otherwise
+
+  :returns: **datetime** or **int** for the time represented by the timestamp
+
+  :raises: **ValueError** if the timestamp is malformed
+  """
+
+  result = _TIMESTAMP_CACHE.get(entry)
+
+  if result is None:
+    if len(entry) == 19 and entry[4] == entry[7] == '-' and entry[10] == ' ' and entry[13] == entry[16] == ':' and (entry[:4] + entry[5:7] + entry[8:10] + entry[11:13] + entry[14:16] + entry[17:]).isdigit():
+      timestamp = datetime.datetime(int(entry[:4]), int(entry[5:7]), int(entry[8:10]), int(entry[11:13]), int(entry[14:16]), int(entry[17:]))
+    else:
+      # unusual formatting that strptime() accepts, such as unpadded values
+
+      timestamp = datetime.datetime.strptime(entry, "%Y-%m-%d %H:%M:%S")
+
+    epoch = (timestamp.toordinal() - UNIX_EPOCH_ORDINAL) * 86400 + timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second
+    result = (timestamp, epoch)
+
+    if len(_TIMESTAMP_CACHE) >= TIMESTAMP_CACHE_SIZE:
+      _TIMESTAMP_CACHE.clear()
+
+    _TIMESTAMP_CACHE[entry] = result
+
+  return result[1] if as_epoch else result[0]
+
+
 def _get_label(units, count, decimal, is_long):
   """
   Provides label corresponding to units of the highest significance in the
@@ -3,6 +3,8 @@ Integration tests for stem.descriptor.* contents.
 """
 
 __all__ = [
+  "cache",
+  "export",
   "reader",
   "extrainfo_descriptor",
   "microdescriptor",
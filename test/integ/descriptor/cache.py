@@ -0,0 +1,211 @@
+"""
+Integration tests for stem.descriptor.cache.
+"""
+
+import os
+import pickle
+import shutil
+import unittest
+
+import stem.descriptor
+import stem.descriptor.cache
+import stem.descriptor.reader
+import test.mocking
+import test.runner
+
+from stem.descriptor.filters import DescriptorFilter
+from test.integ.descriptor import get_resource, DESCRIPTOR_TEST_DATA
+
+
+def _get_cache_path():
+  return test.runner.get_runner().get_test_dir("descriptor_cache")
+
+
+class TestDescriptorCache(unittest.TestCase):
+  def setUp(self):
+    if os.path.exists(_get_cache_path()):
+      shutil.rmtree(_get_cache_path())
+
+  def tearDown(self):
+    test.mocking.revert_mocking()
+
+  def test_get_and_put(self):
+    """
+    Caches descriptors, and checks that they're still available with a new
+    cache instance for the same directory.
+    """
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+    self.assertEquals(0, len(cache))
+    self.assertEquals(0, cache.get_size())
+
+    descriptors = list(stem.descriptor.parse_file(get_resource("metrics_server_desc_multiple")))
+    key = cache.get_key("/tmp/cached-descriptors", b"content", last_modified = 1234)
+
+    self.assertEquals(None, cache.get(key))
+    self.assertTrue(cache.put(key, descriptors))
+    self.assertTrue(key in cache)
+    self.assertTrue(cache.get_size() > 0)
+
+    for cache in (cache, stem.descriptor.cache.DescriptorCache(_get_cache_path())):
+      cached = cache.get(key)
+      self.assertEquals([str(desc) for desc in descriptors], [str(desc) for desc in cached])
+      self.assertEquals(descriptors[0].exit_policy, cached[0].exit_policy)
+
+    cache.clear()
+    self.assertEquals(0, len(cache))
+    self.assertEquals(None, cache.get(key))
+
+  def test_get_key(self):
+    """
+    Checks that keys differ when the file or its content changes.
+    """
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+    key = cache.get_key("/tmp/cached-descriptors", b"content", last_modified = 1234)
+
+    self.assertEquals(key, cache.get_key("/tmp/cached-descriptors", b"content", last_modified = 1234))
+    self.assertNotEquals(key, cache.get_key("/tmp/cached-descriptors", b"Content", last_modified = 1234))
+    self.assertNotEquals(key, cache.get_key("/tmp/cached-descriptors", b"content", last_modified = 1235))
+    self.assertNotEquals(key, cache.get_key("/tmp/cached-extrainfo", b"content", last_modified = 1234))
+    self.assertNotEquals(key, cache.get_key("/tmp/cached-descriptors", b"content", "member", 1234))
+    self.assertNotEquals(key, cache.get_key("/tmp/cached-descriptors", b"content", last_modified = 1234, settings = (False,)))
+
+  def test_eviction(self):
+    """
+    Exceeds our cache's size limit, checking that the least recently used
+    entries are evicted.
+    """
+
+    descriptors = list(stem.descriptor.parse_file(get_resource("metrics_server_desc_multiple")))
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+    cache.put("first", descriptors[:1])
+    cache.put("second", descriptors[:1])
+    entry_size = cache.get_size() / 2
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path(), max_size = entry_size * 2)
+    cache.get("first")
+    cache.put("third", descriptors[:1])
+
+    self.assertEquals(2, len(cache))
+    self.assertTrue("first" in cache)
+    self.assertFalse("second" in cache)
+    self.assertTrue("third" in cache)
+    self.assertEquals(entry_size * 2, cache.get_size())
+
+    # entries that could never fit aren't cached
+
+    self.assertFalse(cache.put("fourth", descriptors * 10))
+    self.assertFalse("fourth" in cache)
+
+  def test_unsupported_entries(self):
+    """
+    Caches content that we can't serialize, and loads entries that aren't
+    serialized descriptors (such as pickles that someone placed in our cache).
+    """
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+
+    self.assertFalse(cache.put("first", ["not a descriptor"]))
+    self.assertFalse("first" in cache)
+
+    with open(os.path.join(_get_cache_path(), "second.cache"), "wb") as entry_file:
+      entry_file.write(pickle.dumps(["not a descriptor"]))
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+    self.assertTrue("second" in cache)
+    self.assertEquals(None, cache.get("second"))
+    self.assertFalse("second" in cache)
+
+  def test_temporary_files(self):
+    """
+    Fails to write an entry, checking that its temporary file is removed, and
+    that temporary files left behind by other processes are removed when we're
+    made.
+    """
+
+    descriptors = list(stem.descriptor.parse_file(get_resource("metrics_server_desc_multiple")))
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+
+    test.mocking.mock(os.rename, test.mocking.raise_exception(OSError("disk full")), os)
+    self.assertFalse(cache.put("first", descriptors))
+    test.mocking.revert_mocking()
+
+    self.assertFalse("first" in cache)
+    self.assertEquals([], os.listdir(_get_cache_path()))
+
+    with open(os.path.join(_get_cache_path(), "tmpabc123.tmp"), "wb") as tmp_file:
+      tmp_file.write(b"partial entry")
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+    self.assertEquals([], os.listdir(_get_cache_path()))
+    self.assertEquals(0, cache.get_size())
+
+  def test_parse_file(self):
+    """
+    Parses a file with a cache, checking that we get the same descriptors
+    whether they're parsed or loaded from the cache.
+    """
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+    descriptor_path = get_resource("cached-consensus")
+
+    parsed = list(stem.descriptor.parse_file(descriptor_path, cache = cache))
+    self.assertEquals(1, len(cache))
+
+    cached = list(stem.descriptor.parse_file(descriptor_path, cache = cache))
+    self.assertEquals(1, len(cache))
+
+    self.assertEquals([str(desc) for desc in parsed], [str(desc) for desc in cached])
+    self.assertEquals(os.path.abspath(descriptor_path), cached[0].get_path())
+
+  def test_reader(self):
+    """
+    Reads our test data with a cache, checking that we get the same results as
+    without one.
+    """
+
+    def read_descriptors(cache, processes = None):
+      reader = stem.descriptor.reader.DescriptorReader(DESCRIPTOR_TEST_DATA, processes = processes, cache = cache)
+
+      with reader:
+        return [(str(desc), desc.get_path(), desc.get_archive_path()) for desc in reader]
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+    expected = read_descriptors(None)
+
+    self.assertEquals(expected, read_descriptors(cache))
+    cache_entries = len(cache)
+    self.assertTrue(cache_entries > 0)
+
+    self.assertEquals(expected, read_descriptors(cache))
+    self.assertEquals(expected, read_descriptors(cache, 2))
+    self.assertEquals(cache_entries, len(cache))
+
+  def test_filter(self):
+    """
+    Parses and reads with both a cache and a filter, checking that the filter
+    applies to the descriptor type of cached content.
+    """
+
+    cache = stem.descriptor.cache.DescriptorCache(_get_cache_path())
+    descriptor_path = get_resource("example_descriptor")
+
+    for _ in range(2):
+      for descriptor_types, expected_count in ((["extra-info"], 0), (["server-descriptor"], 1)):
+        descriptor_filter = DescriptorFilter(descriptor_types = descriptor_types)
+        self.assertEquals(expected_count, len(list(stem.descriptor.parse_file(descriptor_path, "server-descriptor 1.0", descriptor_filter = descriptor_filter, cache = cache))))
+
+    def read_descriptors(cache, processes = None):
+      descriptor_filter = DescriptorFilter(descriptor_types = ["server-descriptor"])
+      reader = stem.descriptor.reader.DescriptorReader(DESCRIPTOR_TEST_DATA, processes = processes, cache = cache, descriptor_filter = descriptor_filter)
+
+      with reader:
+        return [(str(desc), desc.get_path(), desc.get_archive_path()) for desc in reader]
+
+    expected = read_descriptors(None)
+    self.assertTrue(expected)
+
+    for processes in (None, 2, None):
+      self.assertEquals(expected, read_descriptors(cache, processes))
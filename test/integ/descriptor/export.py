@@ -0,0 +1,67 @@
+"""
+Integration tests for stem.descriptor.export.
+"""
+
+import os
+import shutil
+import unittest
+
+import stem
+import stem.descriptor
+import stem.prereq
+import test.runner
+
+from stem.descriptor.export import FLAG_BITS, export_columns, load_columns, to_columns
+from test.integ.descriptor import get_resource
+
+
+class TestExport(unittest.TestCase):
+  def test_columns(self):
+    """
+    Exports the entries of a consensus to columns and memory maps them back.
+    """
+
+    if not stem.prereq.is_numpy_available():
+      test.runner.skip(self, "(requires numpy)")
+      return
+
+    import numpy
+
+    columns_path = test.runner.get_runner().get_test_dir("descriptor_columns")
+
+    if os.path.exists(columns_path):
+      shutil.rmtree(columns_path)
+
+    entries = list(stem.descriptor.parse_file(get_resource("cached-consensus")))
+
+    fields = ('fingerprint', 'flags', 'bandwidth', 'published')
+    self.assertEquals(len(entries), export_columns(columns_path, iter(entries), fields))
+
+    columns = load_columns(columns_path)
+    self.assertEquals(set(fields), set(columns.keys()))
+    self.assertTrue(isinstance(columns['bandwidth'], numpy.memmap))
+    self.assertEquals([entry.fingerprint for entry in entries], list(columns['fingerprint']))
+    self.assertEquals([entry.bandwidth for entry in entries], list(columns['bandwidth']))
+
+    is_exit = (columns['flags'] & FLAG_BITS[stem.Flag.EXIT]) != 0
+    exit_bandwidth = sum([entry.bandwidth for entry in entries if stem.Flag.EXIT in entry.flags])
+    self.assertEquals(exit_bandwidth, numpy.sum(columns['bandwidth'][is_exit]))
+
+    columns = load_columns(columns_path, ('published',), mmap = False)
+    self.assertEquals(['published'], list(columns.keys()))
+    self.assertFalse(isinstance(columns['published'], numpy.memmap))
+    self.assertEquals(entries[0].published.isoformat(), str(columns['published'][0]))
+
+    # columns written a chunk at a time match those we make in memory, with
+    # strings as wide as the widest of their chunks
+
+    fields = ('nickname', 'bandwidth', 'published')
+    self.assertEquals(len(entries), export_columns(columns_path, iter(entries), fields, chunk_size = 1))
+    self.assertEquals(set(['nickname.npy', 'bandwidth.npy', 'published.npy', 'fingerprint.npy', 'flags.npy']), set(os.listdir(columns_path)))
+
+    expected = to_columns(entries, fields)
+    columns = load_columns(columns_path, fields)
+
+    for field in fields:
+      self.assertEquals(expected[field].dtype, columns[field].dtype)
+      self.assertEquals(list(expected[field]), list(columns[field]))
@@ -48,16 +48,16 @@ k0d2aofcVbHr4fPQOSST0LXDrhFl5Fqo5um296zpJGvRUeO6S44U/EfJAGShtqWw
     # the initial contents for the line and parsed values.
 
     read_values_start = [3309568, 9216, 41984, 27648, 123904]
-    self.assertEquals(read_values_start, desc.read_history_values[:5])
+    self.assertEquals(read_values_start, list(desc.read_history_values[:5]))
 
     write_values_start = [1082368, 19456, 50176, 272384, 485376]
-    self.assertEquals(write_values_start, desc.write_history_values[:5])
+    self.assertEquals(write_values_start, list(desc.write_history_values[:5]))
 
     dir_read_values_start = [0, 0, 0, 0, 33792, 27648, 48128]
-    self.assertEquals(dir_read_values_start, desc.dir_read_history_values[:7])
+    self.assertEquals(dir_read_values_start, list(desc.dir_read_history_values[:7]))
 
     dir_write_values_start = [0, 0, 0, 227328, 349184, 382976, 738304]
-    self.assertEquals(dir_write_values_start, desc.dir_write_history_values[:7])
+    self.assertEquals(dir_write_values_start, list(desc.dir_write_history_values[:7]))
 
   def test_metrics_bridge_descriptor(self):
     """
@@ -100,16 +100,16 @@ k0d2aofcVbHr4fPQOSST0LXDrhFl5Fqo5um296zpJGvRUeO6S44U/EfJAGShtqWw
     self.assertEquals([], desc.get_unrecognized_lines())
 
     read_values_start = [337920, 437248, 3995648, 48726016]
-    self.assertEquals(read_values_start, desc.read_history_values[:4])
+    self.assertEquals(read_values_start, list(desc.read_history_values[:4]))
 
     write_values_start = [343040, 991232, 5649408, 49548288]
-    self.assertEquals(write_values_start, desc.write_history_values[:4])
+    self.assertEquals(write_values_start, list(desc.write_history_values[:4]))
 
     dir_read_values_start = [0, 71680, 99328, 25600]
-    self.assertEquals(dir_read_values_start, desc.dir_read_history_values[:4])
+    self.assertEquals(dir_read_values_start, list(desc.dir_read_history_values[:4]))
 
     dir_write_values_start = [5120, 664576, 2419712, 578560]
-    self.assertEquals(dir_write_values_start, desc.dir_write_history_values[:4])
+    self.assertEquals(dir_write_values_start, list(desc.dir_write_history_values[:4]))
 
     self.assertEquals({}, desc.dir_v2_requests)
     self.assertEquals({}, desc.dir_v3_requests)
@@ -4,6 +4,7 @@ Integration tests for stem.descriptor.networkstatus.
 
 import datetime
 import os
+import shutil
 import unittest
 
 import stem
@@ -356,6 +357,96 @@ TpQQk3nNQF8z6UIvdlvP+DnJV4izWVkQEZgUZgIVM0E=
       self.assertEquals(None, router3.dir_port)
       self.assertEquals(set(["Fast", "Stable", "Running", "Valid"]), set(router3.flags))
 
+  def test_lazy_routers_with_workers(self):
+    """
+    Parses the router status entries of a lazily loaded consensus and vote
+    with a pool of processes.
+    """
+
+    for resource in ("cached-consensus", "vote"):
+      with open(get_resource(resource), 'rb') as descriptor_file:
+        content = descriptor_file.read()
+
+      expected_document = stem.descriptor.networkstatus.NetworkStatusDocumentV3(content)
+      document = stem.descriptor.networkstatus.NetworkStatusDocumentV3(content, lazy_routers = True)
+      document.routers.load(workers = 2)
+
+      self.assertEquals(len(expected_document.routers), len(document.routers._entries))
+      self.assertEquals(expected_document.routers, dict(document.routers))
+
+      for fingerprint, router in document.routers.items():
+        self.assertEquals(document, router.document)
+        self.assertEquals(expected_document.routers[fingerprint].microdescriptor_hashes, router.microdescriptor_hashes)
+
+  def test_router_index(self):
+    """
+    Reads individual router status entries from a consensus via a
+    RouterIndex, both when it's first built and once it's saved.
+    """
+
+    test_dir = test.runner.get_runner().get_test_dir("router_index")
+
+    if os.path.exists(test_dir):
+      shutil.rmtree(test_dir)
+
+    os.makedirs(test_dir)
+    consensus_path = os.path.join(test_dir, "cached-consensus")
+    shutil.copy(get_resource("cached-consensus"), consensus_path)
+
+    with open(consensus_path, 'rb') as descriptor_file:
+      expected_entries = list(stem.descriptor.parse_file(descriptor_file, "network-status-consensus-3 1.0"))
+
+    for _ in xrange(2):
+      with stem.descriptor.networkstatus.RouterIndex(consensus_path) as index:
+        self.assertTrue(os.path.exists(consensus_path + ".index"))
+        self.assertEquals([entry.fingerprint for entry in expected_entries], index.fingerprints())
+        self.assertEquals(datetime.datetime(2012, 7, 12, 10, 0, 0), index.get_document().valid_after)
+
+        for expected_entry in expected_entries:
+          entry = index.get_entry(expected_entry.fingerprint)
+          self.assertEquals(str(expected_entry), str(entry))
+          self.assertEquals(index.get_document(), entry.document)
+
+        self.assertEquals(None, index.get_entry("A" * 40))
+
+        entries = index.get_entries(["0013D22389CD50D0B784A3E4061CB31E8CE8CEB5", "A" * 40])
+        self.assertEquals(["0013D22389CD50D0B784A3E4061CB31E8CE8CEB5"], list(entries.keys()))
+        self.assertEquals("sumkledi", entries["0013D22389CD50D0B784A3E4061CB31E8CE8CEB5"].nickname)
+
+    # the index should be rebuilt if the document changes
+
+    with open(get_resource("cached-consensus"), 'rb') as descriptor_file:
+      content = descriptor_file.read()
+
+    first_entry_start = content.index(b"\nr ") + 1
+    second_entry_start = content.index(b"\nr ", first_entry_start) + 1
+
+    with open(consensus_path, 'wb') as consensus_file:
+      consensus_file.write(content[:first_entry_start] + content[second_entry_start:])
+
+    os.utime(consensus_path, (0, 0))
+
+    with stem.descriptor.networkstatus.RouterIndex(consensus_path) as index:
+      self.assertEquals(len(expected_entries) - 1, len(index.fingerprints()))
+      self.assertEquals(None, index.get_entry("0013D22389CD50D0B784A3E4061CB31E8CE8CEB5"))
+      self.assertEquals(str(expected_entries[1]), str(index.get_entry(expected_entries[1].fingerprint)))
+
+    # consensuses from CollecTor start with an '@type' annotation
+
+    metrics_path = os.path.join(test_dir, "2012-07-12-10-00-00-consensus")
+    shutil.copy(get_resource("metrics_consensus"), metrics_path)
+
+    with open(metrics_path, 'rb') as descriptor_file:
+      expected_entries = list(stem.descriptor.parse_file(descriptor_file))
+
+    for _ in xrange(2):
+      with stem.descriptor.networkstatus.RouterIndex(metrics_path) as index:
+        self.assertEquals([desc.fingerprint for desc in expected_entries], index.fingerprints())
+        self.assertEquals(datetime.datetime(2012, 7, 12, 10, 0, 0), index.get_document().valid_after)
+
+        for expected_entry in expected_entries:
+          self.assertEquals(str(expected_entry), str(index.get_entry(expected_entry.fingerprint)))
+
   def test_metrics_vote(self):
     """
     Checks if vote documents from Metrics are parsed properly.
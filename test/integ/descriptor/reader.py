@@ -4,12 +4,17 @@ Integration tests for stem.descriptor.reader.
 
 import getpass
 import os
+import shutil
 import signal
 import sys
 import tarfile
+import threading
 import time
 import unittest
 
+import stem.descriptor.dedup
+import stem.descriptor.filters
+import stem.descriptor.microdescriptor
 import stem.descriptor.reader
 import test.mocking
 import test.runner
@@ -251,6 +256,27 @@ class TestDescriptorReader(unittest.TestCase):
       time.sleep(0.01)
       self.assertTrue(reader.get_buffered_descriptor_count() <= 2)
 
+  def test_max_buffer_bytes(self):
+    """
+    Reads our test data with a buffer that's limited by the size of its
+    descriptors. We should provide all of them, and the buffer shouldn't
+    exceed its limit unless it just has a single large descriptor.
+    """
+
+    with stem.descriptor.reader.DescriptorReader(DESCRIPTOR_TEST_DATA) as reader:
+      expected = [str(desc) for desc in reader]
+
+    reader = stem.descriptor.reader.DescriptorReader(DESCRIPTOR_TEST_DATA, buffer_size = 0, max_buffer_bytes = 4096)
+    descriptors = []
+
+    with reader:
+      for desc in reader:
+        descriptors.append(str(desc))
+        self.assertTrue(reader.get_buffered_descriptor_bytes() <= 4096 or reader.get_buffered_descriptor_count() == 1)
+
+    self.assertEquals(expected, descriptors)
+    self.assertEquals(0, reader.get_buffered_descriptor_bytes())
+
   def test_persistence_path(self):
     """
     Check that the persistence_path argument loads and saves a a processed
@@ -284,6 +310,287 @@ class TestDescriptorReader(unittest.TestCase):
     with reader:
       self.assertEqual(0, len(list(reader)))
 
+  def test_file_positions(self):
+    """
+    Reads a file that tor appends descriptors to, checking that we only read
+    what's been appended and read it from the start if it's rewritten.
+    """
+
+    with open(os.path.join(DESCRIPTOR_TEST_DATA, "cached-microdescs"), 'rb') as descriptor_file:
+      content = descriptor_file.read()
+
+    test_dir = test.runner.get_runner().get_test_dir("descriptor_appends")
+    test_path = os.path.join(test_dir, "cached-microdescs.new")
+    persistence_path = os.path.join(test_dir, "processed_files")
+
+    if not os.path.exists(test_dir):
+      os.makedirs(test_dir)
+
+    for processes in (None, 2):
+      if os.path.exists(persistence_path):
+        os.remove(persistence_path)
+
+      modified = [int(time.time()) - 100]
+
+      def _write(file_content, mode = 'wb'):
+        with open(test_path, mode) as test_file:
+          test_file.write(file_content)
+
+        modified[0] += 1
+        os.utime(test_path, (modified[0], modified[0]))
+
+      def _read():
+        with stem.descriptor.reader.DescriptorReader(test_path, processes = processes, persistence_path = persistence_path) as reader:
+          return len(list(reader))
+
+      _write(content)
+      self.assertEquals(3, _read())
+
+      with open(persistence_path) as persistence_file:
+        self.assertEquals(5, len(persistence_file.read().split()))
+
+      # appended descriptors are read on their own, and if nothing has been
+      # appended then nothing is read
+
+      _write(content, 'ab')
+      self.assertEquals(3, _read())
+
+      _write(b"", 'ab')
+      self.assertEquals(0, _read())
+
+      # when the file is truncated or rewritten we read all of it
+
+      _write(content)
+      self.assertEquals(3, _read())
+
+      _write(content.replace(b"@last-listed 2013-02-24", b"@last-listed 2013-02-25") + content)
+      self.assertEquals(6, _read())
+
+  def test_file_positions_with_truncated_append(self):
+    """
+    Reads a file while tor is part way through appending a descriptor to it,
+    checking that we read that descriptor in full once the rest is written.
+    """
+
+    with open(os.path.join(DESCRIPTOR_TEST_DATA, "cached-microdescs"), 'rb') as descriptor_file:
+      content = descriptor_file.read()
+
+    second_start = content.index(b"@last-listed", 1)
+    third_start = content.index(b"@last-listed", second_start + 1)
+    cut = (second_start + third_start) // 2
+
+    test_dir = test.runner.get_runner().get_test_dir("descriptor_truncated_appends")
+    test_path = os.path.join(test_dir, "cached-microdescs.new")
+    persistence_path = os.path.join(test_dir, "processed_files")
+
+    if not os.path.exists(test_dir):
+      os.makedirs(test_dir)
+
+    for processes in (None, 2):
+      for validate in (True, False):
+        if os.path.exists(persistence_path):
+          os.remove(persistence_path)
+
+        modified = [int(time.time()) - 100]
+
+        def _write(file_content, mode = 'wb'):
+          with open(test_path, mode) as test_file:
+            test_file.write(file_content)
+
+          modified[0] += 1
+          os.utime(test_path, (modified[0], modified[0]))
+
+        def _read():
+          with stem.descriptor.reader.DescriptorReader(test_path, validate = validate, processes = processes, persistence_path = persistence_path) as reader:
+            return list(reader)
+
+        # When validating the partly written descriptor is malformed, so we
+        # only provide the first. Otherwise we provide what we have of it.
+
+        _write(content[:cut])
+        descriptors = _read()
+        self.assertEquals(1 if validate else 2, len(descriptors))
+        self.assertTrue(content[:second_start].endswith(descriptors[0].get_bytes()))
+
+        # once the rest has been written we read that descriptor again
+
+        _write(content[cut:], 'ab')
+        descriptors = _read()
+        self.assertEquals(2, len(descriptors))
+        self.assertTrue(content[second_start:third_start].endswith(descriptors[0].get_bytes()))
+        self.assertTrue(content[third_start:].endswith(descriptors[1].get_bytes()))
+
+        # then only what's appended after the last complete descriptor
+
+        _write(content, 'ab')
+        self.assertEquals(3, len(_read()))
+
+        _write(b"", 'ab')
+        self.assertEquals(0, len(_read()))
+
+  def test_file_positions_read_ahead(self):
+    """
+    Reads a file that tor appends descriptors to with a small buffer_size,
+    checking that we only parse a few descriptors ahead of our caller.
+    """
+
+    with open(os.path.join(DESCRIPTOR_TEST_DATA, "cached-microdescs"), 'rb') as descriptor_file:
+      content = descriptor_file.read()
+
+    test_dir = test.runner.get_runner().get_test_dir("descriptor_read_ahead")
+    test_path = os.path.join(test_dir, "cached-microdescs.new")
+
+    if not os.path.exists(test_dir):
+      os.makedirs(test_dir)
+
+    with open(test_path, 'wb') as test_file:
+      test_file.write(content * 100)
+
+    parsed = []
+    original_init = stem.descriptor.microdescriptor.Microdescriptor.__init__
+
+    def _init(desc, *args, **kwargs):
+      parsed.append(desc)
+      original_init(desc, *args, **kwargs)
+
+    test.mocking.mock_method(stem.descriptor.microdescriptor.Microdescriptor, '__init__', _init)
+
+    with stem.descriptor.reader.DescriptorReader(test_path, buffer_size = 5) as reader:
+      descriptors = iter(reader)
+      next(descriptors)
+      time.sleep(0.1)
+      self.assertTrue(len(parsed) < 20)
+
+      self.assertEquals(299, len(list(descriptors)))
+
+  def test_follow(self):
+    """
+    Follows a directory, checking that we provide descriptors from files that
+    are appended to, made, or moved there while we're running. This is done
+    with both inotify (if it's available) and polling.
+    """
+
+    with open(os.path.join(DESCRIPTOR_TEST_DATA, "cached-microdescs"), 'rb') as descriptor_file:
+      content = descriptor_file.read()
+
+    test_dir = test.runner.get_runner().get_test_dir("descriptor_follow")
+    persistence_path = test.runner.get_runner().get_test_dir("descriptor_follow_listing")
+
+    original_interval = stem.descriptor.reader.FOLLOW_INTERVAL
+    stem.descriptor.reader.FOLLOW_INTERVAL = 0.05
+
+    try:
+      for watcher_class in (stem.descriptor.reader._InotifyWatcher, stem.descriptor.reader._PollingWatcher):
+        if os.path.exists(test_dir):
+          shutil.rmtree(test_dir)
+
+        if os.path.exists(persistence_path):
+          os.remove(persistence_path)
+
+        os.makedirs(test_dir)
+        test_path = os.path.join(test_dir, "cached-microdescs.new")
+
+        with open(test_path, 'wb') as test_file:
+          test_file.write(content)
+
+        try:
+          watcher_class([test_dir], False).close()
+        except OSError:
+          continue  # inotify is unavailable
+
+        test.mocking.mock(stem.descriptor.reader._get_watcher, lambda targets, follow_links: watcher_class(targets, follow_links))
+
+        descriptors, read_files = [], []
+        reader = stem.descriptor.reader.DescriptorReader(test_dir, follow = True, persistence_path = persistence_path)
+        reader.register_read_listener(read_files.append)
+
+        def _consume():
+          for desc in reader:
+            descriptors.append(desc)
+
+        def _wait_for(check):
+          start_time = time.time()
+
+          while not check() and time.time() - start_time < 5:
+            time.sleep(0.01)
+
+          self.assertTrue(check())
+
+        with reader:
+          consumer = threading.Thread(target = _consume)
+          consumer.start()
+
+          _wait_for(lambda: len(descriptors) == 3)
+          _wait_for(lambda: os.path.exists(persistence_path))
+
+          with open(test_path, 'ab') as test_file:
+            test_file.write(content)
+
+          _wait_for(lambda: len(descriptors) == 6)
+
+          os.makedirs(os.path.join(test_dir, "subdirectory"))
+
+          with open(os.path.join(test_dir, "subdirectory", "cached-microdescs"), 'wb') as test_file:
+            test_file.write(content)
+
+          _wait_for(lambda: len(descriptors) == 9)
+
+          moved_path = os.path.join(test.runner.get_runner().get_test_dir(), "cached-extrainfo")
+
+          with open(moved_path, 'wb') as moved_file:
+            moved_file.write(content)
+
+          os.rename(moved_path, os.path.join(test_dir, "cached-microdescs"))
+          _wait_for(lambda: len(descriptors) == 12)
+
+          self.assertEquals(4, len(read_files))
+
+        consumer.join()
+        self.assertEquals(12, len(descriptors))
+        self.assertEquals((len(content) * 2), reader.get_file_positions()[os.path.abspath(test_path)][0])
+    finally:
+      stem.descriptor.reader.FOLLOW_INTERVAL = original_interval
+
+  def test_walk(self):
+    """
+    Walks our test data, checking that we provide the same files as os.walk()
+    along with their stat() results. This is done with scandir and, if it's
+    unavailable, an equivalent of it.
+    """
+
+    class DirEntry(object):
+      def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+      def is_dir(self):
+        return os.path.isdir(self.path)
+
+      def is_symlink(self):
+        return os.path.islink(self.path)
+
+      def stat(self):
+        return os.stat(self.path)
+
+    expected = []
+
+    for root, _, files in os.walk(DESCRIPTOR_TEST_DATA):
+      for filename in files:
+        path = os.path.join(root, filename)
+        expected.append((path, os.stat(path).st_size))
+
+    original_scandir = stem.descriptor.reader._scandir
+
+    try:
+      scandir = original_scandir if original_scandir else lambda directory: [DirEntry(directory, name) for name in os.listdir(directory)]
+
+      for scandir_impl in (None, scandir):
+        stem.descriptor.reader._scandir = scandir_impl
+        results = [(walked_path, path_stat.st_size) for (walked_path, path_stat) in stem.descriptor.reader._walk(DESCRIPTOR_TEST_DATA, False)]
+        self.assertEquals(sorted(expected), sorted(results))
+    finally:
+      stem.descriptor.reader._scandir = original_scandir
+
   def test_archived_paths(self):
     """
     Checks the get_path() and get_archive_path() for a tarball.
@@ -338,6 +645,90 @@ class TestDescriptorReader(unittest.TestCase):
       read_descriptors = [str(desc) for desc in list(reader)]
       self.assertEquals(expected_results, read_descriptors)
 
+  def test_processes(self):
+    """
+    Reads our test data with a pool of worker processes, checking that we get
+    the same descriptors, skipped files, and processed file listing as when
+    reading them ourselves.
+    """
+
+    test.mocking.mock_method(stem.descriptor.server_descriptor.RelayDescriptor, '_validate_content', test.mocking.no_op())
+
+    results = []
+
+    for processes in (None, 2):
+      skip_listener = SkipListener()
+      reader = stem.descriptor.reader.DescriptorReader(DESCRIPTOR_TEST_DATA, processes = processes)
+      reader.register_skip_listener(skip_listener.listener)
+
+      with reader:
+        descriptors = [(str(desc), desc.get_path(), desc.get_archive_path()) for desc in reader]
+
+      skipped = sorted([(path, type(exc)) for (path, exc) in skip_listener.results])
+      results.append((descriptors, skipped, reader.get_processed_files()))
+
+    self.assertTrue(len(results[0][0]) > 0)
+    self.assertEquals(results[0], results[1])
+
+  def test_seen(self):
+    """
+    Reads our test data with a digest set of the descriptors we've already
+    read, checking that duplicates are skipped whether we parse them ourselves
+    or with a pool of worker processes.
+    """
+
+    test.mocking.mock_method(stem.descriptor.server_descriptor.RelayDescriptor, '_validate_content', test.mocking.no_op())
+
+    with stem.descriptor.reader.DescriptorReader(DESCRIPTOR_TEST_DATA) as reader:
+      all_descriptors = list(reader)
+
+    expected, digests = [], set()
+
+    for desc in all_descriptors:
+      digest = stem.descriptor.dedup.get_digest(desc.get_bytes())
+
+      if digest not in digests:
+        expected.append(str(desc))
+        digests.add(digest)
+
+    self.assertTrue(len(expected) < len(all_descriptors))
+
+    for processes in (None, 2):
+      with stem.descriptor.dedup.DigestSet() as seen:
+        reader = stem.descriptor.reader.DescriptorReader(DESCRIPTOR_TEST_DATA, processes = processes, seen = seen)
+
+        with reader:
+          self.assertEquals(expected, [str(desc) for desc in reader])
+
+        # reading everything again provides nothing new
+
+        reader.set_processed_files([])
+
+        with reader:
+          self.assertEquals([], list(reader))
+
+  def test_descriptor_filter(self):
+    """
+    Reads our test data with a filter, checking that we provide the same
+    descriptors as filtering them afterward whether we parse them ourselves or
+    with a pool of worker processes.
+    """
+
+    test.mocking.mock_method(stem.descriptor.server_descriptor.RelayDescriptor, '_validate_content', test.mocking.no_op())
+
+    with stem.descriptor.reader.DescriptorReader(DESCRIPTOR_TEST_DATA) as reader:
+      all_descriptors = list(reader)
+
+    fingerprints = [desc.fingerprint for desc in all_descriptors if getattr(desc, 'fingerprint', None)][:3]
+    descriptor_filter = stem.descriptor.filters.DescriptorFilter(fingerprints = fingerprints)
+
+    expected = [str(desc) for desc in all_descriptors if descriptor_filter.accepts(desc)]
+    self.assertTrue(0 < len(expected) < len(all_descriptors))
+
+    for processes in (None, 2):
+      with stem.descriptor.reader.DescriptorReader(DESCRIPTOR_TEST_DATA, processes = processes, descriptor_filter = descriptor_filter) as reader:
+        self.assertEquals(expected, [str(desc) for desc in reader])
+
   def test_stop(self):
     """
     Runs a DescriptorReader over the root directory, then checks that calling
@@ -8,8 +8,10 @@ import unittest
 
 import stem.control
 import stem.descriptor
+import stem.descriptor.dedup
 import stem.descriptor.server_descriptor
 import stem.exit_policy
+import stem.prereq
 import stem.version
 import test.mocking
 import test.runner
@@ -104,6 +106,79 @@ Qlx9HNCqCY877ztFRC624ja2ql6A2hBcuoYMbkHjcQ4=
       self.assertEquals("Unnamed", descriptors[1].nickname)
       self.assertEquals("5366F1D198759F8894EA6E5FF768C667F59AFD24", descriptors[1].fingerprint)
 
+  def test_metrics_descriptor_multiple_with_workers(self):
+    """
+    Parses a file with multiple server descriptors using a pool of workers,
+    checking that we get the same results as parsing it sequentially.
+    """
+
+    with open(get_resource("metrics_server_desc_multiple"), 'rb') as descriptor_file:
+      expected = list(stem.descriptor.parse_file(descriptor_file, "server-descriptor 1.0"))
+
+    with open(get_resource("metrics_server_desc_multiple"), 'rb') as descriptor_file:
+      descriptors = list(stem.descriptor.parse_file(descriptor_file, "server-descriptor 1.0", workers = 2))
+
+    self.assertEquals([str(desc) for desc in expected], [str(desc) for desc in descriptors])
+    self.assertEquals(["anonion", "Unnamed"], [desc.nickname for desc in descriptors])
+    self.assertEquals(expected[0].exit_policy, descriptors[0].exit_policy)
+
+    # paths are read the same way as files
+
+    descriptors = list(stem.descriptor.parse_file(get_resource("metrics_server_desc_multiple"), "server-descriptor 1.0", workers = 2))
+    self.assertEquals([str(desc) for desc in expected], [str(desc) for desc in descriptors])
+
+    with stem.descriptor.dedup.DigestSet() as seen:
+      descriptors = list(stem.descriptor.parse_file(get_resource("metrics_server_desc_multiple"), "server-descriptor 1.0", workers = 2, seen = seen))
+      self.assertEquals([str(desc) for desc in expected], [str(desc) for desc in descriptors])
+
+    # chunks we hand to our workers should always end on a descriptor boundary
+
+    with open(get_resource("metrics_server_desc_multiple"), 'rb') as descriptor_file:
+      content = descriptor_file.read()
+      descriptor_file.seek(0)
+      chunks = list(stem.descriptor._split_descriptor_file(descriptor_file, b"router ", chunk_size = 100))
+
+    self.assertEquals(2, len(chunks))
+    self.assertEquals(content, b"".join(chunks))
+    self.assertTrue(chunks[1].startswith(b"router Unnamed"))
+
+  def test_verified_digests(self):
+    """
+    Skips verifying the signature of descriptors that we've already verified,
+    and saves these for other processes.
+    """
+
+    if not stem.prereq.is_crypto_available():
+      test.runner.skip(self, "(requires pycrypto)")
+      return
+
+    with open(get_resource("example_descriptor"), 'rb') as descriptor_file:
+      content = descriptor_file.read()
+      content = content[content.find(b"router "):]  # skip the @type annotation
+
+    stem.descriptor.server_descriptor._VERIFIED_DIGESTS.clear()
+    desc = stem.descriptor.server_descriptor.RelayDescriptor(content)
+    self.assertEquals(1, len(stem.descriptor.server_descriptor._VERIFIED_DIGESTS))
+
+    # descriptors with the same digest but a different signature are still
+    # checked
+
+    signature_start = content.find(b"-----BEGIN SIGNATURE-----\n") + 26
+    tampered_content = content[:signature_start] + b"A" + content[signature_start + 1:]
+    self.assertRaises(ValueError, stem.descriptor.server_descriptor.RelayDescriptor, tampered_content)
+
+    verified_path = test.runner.get_runner().get_test_dir("verified_digests")
+
+    try:
+      self.assertEquals(1, stem.descriptor.server_descriptor.save_verified_digests(verified_path))
+      stem.descriptor.server_descriptor._VERIFIED_DIGESTS.clear()
+
+      self.assertEquals(1, stem.descriptor.server_descriptor.load_verified_digests(verified_path))
+      self.assertEquals(desc.digest(), stem.descriptor.server_descriptor.RelayDescriptor(content).digest())
+    finally:
+      if os.path.exists(verified_path):
+        os.remove(verified_path)
+
   def test_old_descriptor(self):
     """
     Parses a relay server descriptor from 2005.
@@ -145,10 +220,10 @@ Qlx9HNCqCY877ztFRC624ja2ql6A2hBcuoYMbkHjcQ4=
     # the initial contents for the line and parsed values.
 
     read_values_start = [20774, 489973, 510022, 511163, 20949]
-    self.assertEquals(read_values_start, desc.read_history_values[:5])
+    self.assertEquals(read_values_start, list(desc.read_history_values[:5]))
 
     write_values_start = [81, 8848, 8927, 8927, 83, 8848, 8931, 8929, 81, 8846]
-    self.assertEquals(write_values_start, desc.write_history_values[:10])
+    self.assertEquals(write_values_start, list(desc.write_history_values[:10]))
 
   def test_cached_descriptor(self):
     """
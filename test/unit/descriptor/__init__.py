@@ -9,5 +9,12 @@ __all__ = [
   "networkstatus",
   "reader",
   "router_status_entry",
+  "serialization",
   "server_descriptor",
+  "store",
+  "diff",
+  "verification",
+  "dedup",
+  "join",
+  "filters",
 ]
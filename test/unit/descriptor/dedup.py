@@ -0,0 +1,157 @@
+"""
+Unit tests for stem.descriptor.dedup.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import stem.descriptor
+
+from stem.descriptor.dedup import BloomFilter, DigestSet, get_digest
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from test.mocking import no_op, \
+                         mock_method, \
+                         revert_mocking, \
+                         get_relay_server_descriptor, \
+                         get_microdescriptor, \
+                         get_router_status_entry_v3, \
+                         get_network_status_document_v3, \
+                         get_directory_authority
+
+
+def _parse(content, descriptor_type, seen, workers = None):
+  return list(stem.descriptor.parse_file(io.BytesIO(content), descriptor_type, workers = workers, seen = seen))
+
+
+class TestDedup(unittest.TestCase):
+  def setUp(self):
+    mock_method(RelayDescriptor, '_verify_digest', no_op())
+
+  def tearDown(self):
+    revert_mocking()
+
+  def test_get_digest(self):
+    """
+    Digests of descriptor content, with and without annotations.
+    """
+
+    content = get_relay_server_descriptor(content = True)
+    expected = hashlib.sha1(content).digest()
+
+    self.assertEquals(expected, get_digest(content))
+    self.assertEquals(expected, get_digest(b"\n" + content + b"\n\n"))
+    self.assertEquals(expected, get_digest(b"@downloaded-at 2012-03-14 16:31:05\n@source \"145.53.65.130\"\n" + content))
+    self.assertEquals(expected, get_digest(RelayDescriptor(content).get_bytes()))
+    self.assertEquals(hashlib.sha1(b"").digest(), get_digest(b"@type server-descriptor 1.0"))
+
+  def test_bloom_filter(self):
+    """
+    Adds digests to a bloom filter, and checks the rate of false positives.
+    """
+
+    self.assertRaises(ValueError, BloomFilter, 0)
+    self.assertRaises(ValueError, BloomFilter, 100, 1.5)
+
+    bloom_filter = BloomFilter(1000, 0.01)
+    self.assertEquals(9586, bloom_filter.size)
+    self.assertEquals(7, bloom_filter.hash_count)
+
+    added = [hashlib.sha1(str(i).encode()).digest() for i in range(1000)]
+    missing = [hashlib.sha1(str(-i).encode()).digest() for i in range(1, 1001)]
+
+    for digest in added:
+      bloom_filter.add(digest)
+
+    self.assertTrue(all([digest in bloom_filter for digest in added]))
+    self.assertTrue(len([digest for digest in missing if digest in bloom_filter]) < 30)
+
+  def test_digest_set(self):
+    """
+    Adds digests to sets that are in memory and on disk.
+    """
+
+    digests = [hashlib.sha1(str(i).encode()).digest() for i in range(5)]
+
+    with DigestSet(capacity = 100) as seen:
+      self.assertTrue(seen.add(digests[0]))
+      self.assertFalse(seen.add(digests[0]))
+      self.assertTrue(digests[0] in seen)
+      self.assertFalse(digests[1] in seen)
+      self.assertEquals(1, len(seen))
+
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "digests")
+
+    try:
+      with DigestSet(path, capacity = 100) as seen:
+        for digest in digests[:3]:
+          self.assertTrue(seen.add(digest))
+
+      with DigestSet(path, capacity = 100) as seen:
+        self.assertEquals(3, len(seen))
+        self.assertEquals([False, False, False, True, True], [seen.add(digest) for digest in digests])
+        self.assertEquals(5, len(seen))
+    finally:
+      shutil.rmtree(tmp_dir)
+
+  def test_parse_file(self):
+    """
+    Skips server descriptors and microdescriptors that we've already read,
+    both when parsing them ourselves and with workers.
+    """
+
+    relays = [get_relay_server_descriptor({'router': "caerSidi%i 71.35.133.197 9001 0 0" % i}, content = True) for i in range(3)]
+    first_file = b"@downloaded-at 2012-03-14 16:31:05\n" + relays[0] + b"\n" + relays[1] + b"\n"
+    second_file = b"@downloaded-at 2012-03-15 16:31:05\n" + relays[1] + b"\n" + relays[2] + b"\n" + relays[0] + b"\n"
+
+    for workers in (None, 2):
+      seen = DigestSet(capacity = 100)
+
+      self.assertEquals(["caerSidi0", "caerSidi1"], [desc.nickname for desc in _parse(first_file, "server-descriptor 1.0", seen, workers)])
+      self.assertEquals(["caerSidi2"], [desc.nickname for desc in _parse(second_file, "server-descriptor 1.0", seen, workers)])
+      self.assertEquals([], _parse(second_file, "server-descriptor 1.0", seen, workers))
+
+      seen.close()
+
+    # duplicates within the same file
+
+    micro_content = get_microdescriptor(content = True)
+
+    with DigestSet(capacity = 100) as seen:
+      self.assertEquals(1, len(_parse(relays[0] + b"\n" + relays[0], "server-descriptor 1.0", seen)))
+      self.assertEquals(1, len(_parse(micro_content + b"\n" + micro_content, "microdescriptor 1.0", seen)))
+      self.assertEquals(0, len(_parse(micro_content, "microdescriptor 1.0", seen)))
+
+    # descriptors that fail to parse, and the ones we didn't get to after
+    # them, aren't regarded as seen
+
+    malformed = get_relay_server_descriptor({'router': "caerSidi3 71.35.133.197 9001 0 0", 'published': "nonsense"}, content = True)
+    content = malformed + b"\n" + relays[0]
+
+    for workers in (None, 2):
+      with DigestSet(capacity = 100) as seen:
+        self.assertRaises(ValueError, _parse, content, "server-descriptor 1.0", seen, workers)
+        self.assertEquals(["caerSidi0"], [desc.nickname for desc in _parse(relays[0], "server-descriptor 1.0", seen, workers)])
+
+        descriptors = list(stem.descriptor.parse_file(io.BytesIO(malformed), "server-descriptor 1.0", validate = False, seen = seen))
+        self.assertEquals(["caerSidi3"], [desc.nickname for desc in descriptors])
+
+  def test_parse_file_parsed(self):
+    """
+    Skips router status entries that we've already read. These are checked
+    after they're parsed.
+    """
+
+    entries = [get_router_status_entry_v3({'r': "caerSidi%i p1aag7VwarGxqctS7/fS0y5FU+s oQZFLYe9e4A7bOkWKR7TaNxb0JE 2012-08-06 11:19:31 71.35.150.29 9001 0" % i}) for i in range(3)]
+
+    def get_document(valid_after, routers):
+      return get_network_status_document_v3({'valid-after': valid_after}, authorities = (get_directory_authority(is_vote = False),), routers = routers, content = True)
+
+    with DigestSet(capacity = 100) as seen:
+      self.assertEquals(2, len(_parse(get_document("2012-09-02 22:00:00", entries[:2]), "network-status-consensus-3 1.0", seen)))
+      self.assertEquals(["caerSidi2"], [entry.nickname for entry in _parse(get_document("2012-09-02 23:00:00", entries[1:]), "network-status-consensus-3 1.0", seen)])
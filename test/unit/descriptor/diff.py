@@ -0,0 +1,138 @@
+"""
+Unit tests for stem.descriptor.diff.
+"""
+
+import datetime
+import unittest
+
+from stem import Flag
+from stem.descriptor.diff import Change, ConsensusPatch, diff_routers
+from stem.descriptor.networkstatus import NetworkStatusDocumentV3
+
+from test.mocking import get_router_status_entry_v3, \
+                         get_network_status_document_v3, \
+                         get_directory_authority
+
+CAERSIDI = "A7569A83B5706AB1B1A9CB52EFF7D2D32E4553EB"
+AMUNET1 = "21B8466BC4FEF2DCB2FCC8710A4FEA23E108D8B5"
+AMUNET2 = "DB4C1871B146C057CC92D9AE7DF623E99D5133D9"
+AMUNET3 = "9D3BFD006D5C65E156DA15E248810017A24B449E"
+
+
+def _get_entry(nickname, identity, attr = None):
+  entry_attr = {'r': "%s %s oQZFLYe9e4A7bOkWKR7TaNxb0JE 2012-08-06 11:19:31 71.35.150.29 9001 0" % (nickname, identity)}
+  entry_attr.update(attr or {})
+  return get_router_status_entry_v3(entry_attr)
+
+
+def _get_document(valid_after, routers, lazy_routers = False):
+  content = get_network_status_document_v3(
+    {'valid-after': valid_after},
+    authorities = (get_directory_authority(is_vote = False),),
+    routers = routers,
+    content = True,
+  )
+
+  return NetworkStatusDocumentV3(content, lazy_routers = lazy_routers)
+
+
+class TestDiff(unittest.TestCase):
+  def setUp(self):
+    # like tor's consensuses, entries are in fingerprint order
+
+    self.old_routers = (
+      _get_entry("Amunet1", "IbhGa8T+8tyy/MhxCk/qI+EI2LU"),
+      _get_entry("caerSidi", "p1aag7VwarGxqctS7/fS0y5FU+s", {'w': "Bandwidth=100", 'p': "accept 80,443"}),
+      _get_entry("Amunet2", "20wYcbFGwFfMktmuffYj6Z1RM9k"),
+    )
+
+    self.new_routers = (
+      _get_entry("Amunet3", "nTv9AG1cZeFW2hXiSIEAF6JLRJ4"),
+      _get_entry("caerSidi", "p1aag7VwarGxqctS7/fS0y5FU+s", {'s': "Fast Guard Running Valid", 'w': "Bandwidth=200", 'p': "accept 80,443"}),
+      _get_entry("Amunet2", "20wYcbFGwFfMktmuffYj6Z1RM9k"),
+    )
+
+  def test_diff_routers(self):
+    """
+    Compares the relays in two documents, both when they're fully parsed and
+    parsed as they're used.
+    """
+
+    for lazy_routers in (False, True):
+      old = _get_document("2012-09-02 22:00:00", self.old_routers, lazy_routers)
+      new = _get_document("2012-09-02 23:00:00", self.new_routers, lazy_routers)
+
+      changes = list(diff_routers(old, new))
+      self.assertEquals([AMUNET1, AMUNET3, CAERSIDI], [change.fingerprint for change in changes])
+
+      self.assertEquals((Change.LEFT,), changes[0].changes)
+      self.assertEquals("Amunet1", changes[0].old_entry.nickname)
+      self.assertEquals(None, changes[0].new_entry)
+
+      self.assertEquals((Change.JOINED,), changes[1].changes)
+      self.assertEquals(None, changes[1].old_entry)
+      self.assertEquals("Amunet3", changes[1].new_entry.nickname)
+
+      self.assertEquals((Change.FLAGS, Change.BANDWIDTH), changes[2].changes)
+      self.assertEquals([Flag.GUARD], changes[2].added_flags)
+      self.assertEquals([Flag.NAMED, Flag.STABLE], changes[2].removed_flags)
+      self.assertEquals(200, changes[2].new_entry.bandwidth)
+
+      self.assertEquals([], list(diff_routers(old, old)))
+
+    # relays that are unchanged between lazily parsed documents aren't parsed
+
+    old = _get_document("2012-09-02 22:00:00", self.old_routers, True)
+    new = _get_document("2012-09-02 23:00:00", self.new_routers, True)
+    list(diff_routers(old, new))
+
+    self.assertFalse(AMUNET2 in old.routers._entries)
+    self.assertFalse(AMUNET2 in new.routers._entries)
+
+  def test_exit_policy_and_other_changes(self):
+    """
+    Relays whose exit policy summary or other attributes changed.
+    """
+
+    old = _get_document("2012-09-02 22:00:00", self.old_routers[1:2])
+    new = _get_document("2012-09-02 23:00:00", (_get_entry("caerSidi", "p1aag7VwarGxqctS7/fS0y5FU+s", {'w': "Bandwidth=100", 'p': "reject 25", 'v': "Tor 0.2.4.10-alpha"}),))
+
+    changes = list(diff_routers(old, new))
+    self.assertEquals(1, len(changes))
+    self.assertEquals((Change.EXIT_POLICY, Change.OTHER), changes[0].changes)
+
+  def test_patch(self):
+    """
+    Updates a document to match a newer one.
+    """
+
+    current = _get_document("2012-09-02 22:00:00", self.old_routers)
+    unchanged_entry = current.routers[AMUNET2]
+
+    old = _get_document("2012-09-02 22:00:00", self.old_routers, True)
+    new = _get_document("2012-09-02 23:00:00", self.new_routers, True)
+
+    patch = ConsensusPatch(old, new)
+    self.assertFalse(hasattr(patch, '_raw_contents') or '_raw_contents' in patch._attributes)
+    self.assertEquals(len(new.get_bytes()), len(patch._header_content) + sum([len(new.routers[fingerprint].get_bytes()) for fingerprint in new.routers]) + len(patch._footer_content))
+    self.assertEquals(datetime.datetime(2012, 9, 2, 22, 0, 0), patch.base_valid_after)
+    self.assertEquals(datetime.datetime(2012, 9, 2, 23, 0, 0), patch.valid_after)
+    self.assertEquals(3, len(patch.changes))
+
+    patch.apply(current)
+    expected = _get_document("2012-09-02 23:00:00", self.new_routers)
+
+    self.assertEquals(expected.valid_after, current.valid_after)
+    self.assertEquals(str(expected), str(current))
+    self.assertEquals(sorted(expected.routers.keys()), sorted(current.routers.keys()))
+
+    for fingerprint, entry in expected.routers.items():
+      self.assertEquals(str(entry), str(current.routers[fingerprint]))
+      self.assertEquals(entry.flags, current.routers[fingerprint].flags)
+      self.assertTrue(current.routers[fingerprint].document is current)
+
+    self.assertTrue(current.routers[AMUNET2] is unchanged_entry)
+
+    # the patch can only be applied to the document it was made from
+
+    self.assertRaises(ValueError, patch.apply, current)
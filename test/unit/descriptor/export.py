@@ -2,20 +2,31 @@
 Unit tests for stem.descriptor.export.
 """
 
+import io
+import json
 import StringIO
+import struct
 import unittest
 
 import stem.prereq
 import test.runner
 
-from stem.descriptor.export import export_csv, export_csv_file
+from stem.descriptor.export import FLAG_BITS, \
+                                   export_csv, \
+                                   export_csv_file, \
+                                   export_jsonl, \
+                                   export_jsonl_file, \
+                                   export_binary_file, \
+                                   to_columns
 from stem.descriptor.server_descriptor import RelayDescriptor
 
 from test.mocking import no_op, \
                          mock_method, \
                          revert_mocking, \
                          get_relay_server_descriptor, \
-                         get_bridge_server_descriptor
+                         get_bridge_server_descriptor, \
+                         get_router_status_entry_v3, \
+                         get_network_status_document_v3
 
 
 class TestExport(unittest.TestCase):
@@ -75,6 +86,22 @@ class TestExport(unittest.TestCase):
 
     self.assertEqual(desc_csv, csv_buffer.getvalue())
 
+  def test_iterator_input(self):
+    """
+    Exports descriptors from a generator, with enough of them that they're
+    written in multiple chunks.
+    """
+
+    nicknames = ['relay%i' % i for i in xrange(2500)]
+    descriptors = [get_relay_server_descriptor({'router': "%s 71.35.133.197 9001 0 0" % nickname}) for nickname in nicknames]
+
+    csv_buffer = StringIO.StringIO()
+    export_csv_file(csv_buffer, (desc for desc in descriptors), included_fields = ('nickname',), header = False)
+    self.assertEqual("\n".join(nicknames) + "\n", csv_buffer.getvalue())
+
+    self.assertEqual(export_csv(descriptors), export_csv(iter(descriptors)))
+    self.assertEqual("", export_csv(iter([])))
+
   def test_excludes_private_attr(self):
     """
     Checks that the default attributes for our csv output doesn't include private fields.
@@ -115,3 +142,126 @@ class TestExport(unittest.TestCase):
     server_desc = get_relay_server_descriptor()
     bridge_desc = get_bridge_server_descriptor()
     self.assertRaises(ValueError, export_csv, (server_desc, bridge_desc))
+
+  def test_jsonl(self):
+    """
+    Exports descriptors to JSON Lines, checking that values are converted to
+    their JSON counterparts.
+    """
+
+    desc = get_relay_server_descriptor({'family': '$A $B', 'or-address': '[2001:db8::ff00:42]:8080'})
+    fields = ('nickname', 'published', 'exit_policy', 'family', 'or_addresses', 'tor_version', 'uptime', 'hibernating', 'dir_port')
+    desc_jsonl = export_jsonl([desc, desc], included_fields = fields)
+
+    lines = desc_jsonl.split("\n")
+    self.assertEquals(3, len(lines))
+    self.assertEquals("", lines[2])
+    self.assertEquals(lines[0], lines[1])
+
+    expected = {
+      'nickname': 'caerSidi',
+      'published': '2012-03-01T17:15:27',
+      'exit_policy': 'reject *:*',
+      'family': ['$A', '$B'],
+      'or_addresses': [['2001:db8::ff00:42', 8080, True]],
+      'tor_version': None,
+      'uptime': None,
+      'hibernating': False,
+      'dir_port': None,
+    }
+
+    self.assertEquals(expected, json.loads(lines[0]))
+
+    # defaults to all public attributes
+
+    self.assertEquals(set([attr for attr in vars(desc) if not attr.startswith('_')]), set(json.loads(export_jsonl(desc))))
+    self.assertFalse('nickname' in json.loads(export_jsonl(desc, excluded_fields = ('nickname',))))
+
+  def test_jsonl_file(self):
+    """
+    Writes JSON Lines to a file from a generator, checking that it matches
+    export_jsonl() and excludes references to other descriptors.
+    """
+
+    document = get_network_status_document_v3(routers = (get_router_status_entry_v3(),))
+    entries = document.routers.values() * 2500
+
+    jsonl_buffer = StringIO.StringIO()
+    export_jsonl_file(jsonl_buffer, (entry for entry in entries))
+    self.assertEquals(export_jsonl(entries), jsonl_buffer.getvalue())
+
+    lines = jsonl_buffer.getvalue().splitlines()
+    self.assertEquals(2500, len(lines))
+    self.assertFalse('document' in json.loads(lines[0]))
+    self.assertEquals("", export_jsonl(iter([])))
+
+    self.assertRaises(ValueError, export_jsonl, entries[0], ('nickname', 'blarg!'))
+    self.assertRaises(ValueError, export_jsonl, (entries[0], get_relay_server_descriptor()))
+
+  def test_binary_file(self):
+    """
+    Writes length-prefixed records, checking that each has the JSON for a
+    descriptor.
+    """
+
+    nicknames = ('relay1', 'relay3', 'relay2', 'caerSidi', 'zeus')
+    descriptors = []
+
+    for nickname in nicknames:
+      router_line = "%s 71.35.133.197 9001 0 0" % nickname
+      descriptors.append(get_relay_server_descriptor({'router': router_line}))
+
+    output_buffer = io.BytesIO()
+    export_binary_file(output_buffer, iter(descriptors), included_fields = ('nickname', 'published'))
+    content = output_buffer.getvalue()
+
+    records = []
+
+    while content:
+      record_length = struct.unpack("!I", content[:4])[0]
+      records.append(json.loads(content[4:4 + record_length].decode('utf-8')))
+      content = content[4 + record_length:]
+
+    self.assertEquals([{'nickname': nickname, 'published': '2012-03-01T17:15:27'} for nickname in nicknames], records)
+
+  def test_to_columns(self):
+    """
+    Exports router status entries to columns, checking their types and values.
+    """
+
+    if not stem.prereq.is_numpy_available():
+      test.runner.skip(self, "(requires numpy)")
+      return
+
+    entries = [
+      get_router_status_entry_v3({'r': 'caerSidi p1aag7VwarGxqctS7/fS0y5FU+s oQZFLYe9e4A7bOkWKR7TaNxb0JE 2012-08-06 11:19:31 71.35.150.29 9001 0', 's': 'Fast Exit Valid'}),
+      get_router_status_entry_v3({'s': 'Running Exit FakeFlag', 'w': 'Bandwidth=75'}),
+      get_router_status_entry_v3({'s': '', 'w': 'Bandwidth=20 Measured=30'}),
+    ]
+
+    columns = to_columns(iter(entries), ('fingerprint', 'flags', 'bandwidth', 'measured', 'published', 'nickname', 'exit_policy'), chunk_size = 2)
+
+    self.assertEquals(['fingerprint', 'flags', 'bandwidth', 'measured', 'published', 'nickname', 'exit_policy'], list(columns.keys()))
+    self.assertEquals('S40', columns['fingerprint'].dtype.str[1:])
+    self.assertEquals([entry.fingerprint for entry in entries], list(columns['fingerprint']))
+
+    expected_flags = [
+      FLAG_BITS['Fast'] | FLAG_BITS['Exit'] | FLAG_BITS['Valid'],
+      FLAG_BITS['Running'] | FLAG_BITS['Exit'],
+      0,
+    ]
+
+    self.assertEquals(expected_flags, list(columns['flags']))
+
+    # bandwidth isn't set for the first entry and measured only for the last
+
+    self.assertEquals('int64', str(columns['bandwidth'].dtype))
+    self.assertEquals([-1, 75, 20], list(columns['bandwidth']))
+    self.assertEquals([-1, -1, 30], list(columns['measured']))
+
+    self.assertEquals('datetime64[s]', str(columns['published'].dtype))
+    self.assertEquals('2012-08-06T11:19:31', str(columns['published'][0]))
+    self.assertEquals([b'caerSidi', b'caerSidi', b'caerSidi'], list(columns['nickname']))
+    self.assertEquals([b'', b'', b''], list(columns['exit_policy']))
+
+    self.assertRaises(ValueError, to_columns, entries, ('nickname', 'blarg!'))
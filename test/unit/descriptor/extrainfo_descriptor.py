@@ -2,14 +2,21 @@
 Unit tests for stem.descriptor.extrainfo_descriptor.
 """
 
+import array
 import datetime
 import unittest
 
-from stem.descriptor.extrainfo_descriptor import RelayExtraInfoDescriptor, DirResponse, DirStat
+import stem.prereq
+import test.mocking as mocking
+
+from stem.descriptor.extrainfo_descriptor import RelayExtraInfoDescriptor, DirResponse, DirStat, align_histories, sum_histories
 from test.mocking import get_relay_extrainfo_descriptor, get_bridge_extrainfo_descriptor, CRYPTO_BLOB
 
 
 class TestExtraInfoDescriptor(unittest.TestCase):
+  def tearDown(self):
+    mocking.revert_mocking()
+
   def test_minimal_extrainfo_descriptor(self):
     """
     Basic sanity check that we can parse an extrainfo descriptor with minimal
@@ -277,7 +284,7 @@ class TestExtraInfoDescriptor(unittest.TestCase):
 
       for test_value, expected_value in test_entries:
         desc = get_relay_extrainfo_descriptor({keyword: test_value})
-        self.assertEquals(expected_value, getattr(desc, attr))
+        self.assertEquals(expected_value, list(getattr(desc, attr)))
 
       test_entries = (
         (",,11", [11.0]),
@@ -287,7 +294,8 @@ class TestExtraInfoDescriptor(unittest.TestCase):
 
       for entry, expected in test_entries:
         desc_text = get_relay_extrainfo_descriptor({keyword: entry}, content = True)
-        self._expect_invalid_attr(desc_text, attr, expected)
+        desc = self._expect_invalid_attr(desc_text)
+        self.assertEquals(expected, list(getattr(desc, attr)))
 
   def test_timestamp_lines(self):
     """
@@ -364,7 +372,7 @@ class TestExtraInfoDescriptor(unittest.TestCase):
         desc = get_relay_extrainfo_descriptor({keyword: "2012-05-03 12:07:50 (500 s)%s" % test_values})
         self.assertEquals(datetime.datetime(2012, 5, 3, 12, 7, 50), getattr(desc, end_attr))
         self.assertEquals(500, getattr(desc, interval_attr))
-        self.assertEquals(expected_values, getattr(desc, values_attr))
+        self.assertEquals(expected_values, list(getattr(desc, values_attr)))
 
       test_entries = (
         "",
@@ -384,6 +392,45 @@ class TestExtraInfoDescriptor(unittest.TestCase):
         self.assertEquals(None, getattr(desc, interval_attr))
         self.assertEquals(None, getattr(desc, values_attr))
 
+  def test_align_histories(self):
+    """
+    Aligns and sums the read histories of two relays.
+    """
+
+    relay_a = "ninja B2289C3EAB83ECD6EB916A2F481A02E6B76A0A48"
+    relay_b = "caerSidi A7569A83B5706AB1B1A9CB52EFF7D2D32E4553EB"
+
+    descriptors = [
+      get_relay_extrainfo_descriptor({'extra-info': relay_a, 'read-history': "2012-05-03 12:07:50 (900 s) 1,2,3"}),
+      get_relay_extrainfo_descriptor({'extra-info': relay_b, 'read-history': "2012-05-03 12:20:00 (900 s) 10,20"}),
+      get_relay_extrainfo_descriptor({'extra-info': relay_a, 'read-history': "2012-05-03 12:22:50 (900 s) 4,5"}),
+      get_relay_extrainfo_descriptor(),  # without a read-history
+    ]
+
+    start, interval, histories = align_histories(descriptors)
+
+    self.assertEquals(datetime.datetime(2012, 5, 3, 11, 30), start)
+    self.assertEquals(900, interval)
+    self.assertEquals([1, 2, 4, 5], list(histories["B2289C3EAB83ECD6EB916A2F481A02E6B76A0A48"]))
+    self.assertEquals([0, 10, 20, 0], list(histories["A7569A83B5706AB1B1A9CB52EFF7D2D32E4553EB"]))
+    self.assertTrue(isinstance(histories["B2289C3EAB83ECD6EB916A2F481A02E6B76A0A48"], array.array))
+
+    self.assertEquals([1, 12, 24, 5], list(sum_histories(histories.values())))
+    self.assertEquals([2, 4], list(sum_histories(([1, 2], (1, 2)))))
+    self.assertEquals([], list(sum_histories([])))
+    self.assertRaises(ValueError, sum_histories, ([1, 2], [1]))
+
+    self.assertEquals((None, None, {}), align_histories(descriptors, 'dir_read'))
+    self.assertRaises(ValueError, align_histories, descriptors, 'pepperjack')
+
+    descriptors.append(get_relay_extrainfo_descriptor({'read-history': "2012-05-03 12:22:50 (300 s) 4,5"}))
+    self.assertRaises(ValueError, align_histories, descriptors)
+
+    # sums histories without numpy too
+
+    mocking.mock(stem.prereq.is_numpy_available, mocking.return_false())
+    self.assertEquals([1, 12, 24, 5], list(sum_histories(histories.values())))
+
   def test_port_mapping_lines(self):
     """
     Uses valid and invalid data to tests lines of the form...
@@ -0,0 +1,197 @@
+"""
+Unit tests for stem.descriptor.filters.
+"""
+
+import datetime
+import io
+import unittest
+
+import stem.descriptor
+
+from stem.descriptor.dedup import DigestSet
+from stem.descriptor.filters import DescriptorFilter
+from stem.descriptor.router_status_entry import RouterStatusEntryV3
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from test.mocking import no_op, \
+                         mock_method, \
+                         revert_mocking, \
+                         get_relay_server_descriptor, \
+                         get_relay_extrainfo_descriptor, \
+                         get_microdescriptor, \
+                         get_router_status_entry_v3, \
+                         get_network_status_document_v3, \
+                         get_directory_authority
+
+FINGERPRINTS = (
+  "A7569A83B5706AB1B1A9CB52EFF7D2D32E4553EB",
+  "9695DFC35FFEB861329B9F1AB04C46397020CE31",
+  "847B1F850344D7876491A54892F904934E4EB85D",
+)
+
+# base64 encoded identities of the above
+
+IDENTITIES = (
+  "p1aag7VwarGxqctS7/fS0y5FU+s",
+  "lpXfw1/+uGEym58asExGOXAgzjE",
+  "hHsfhQNE14dkkaVIkvkEk05OuF0",
+)
+
+
+def _get_entry(index, published = "2012-08-06 11:19:31", flags = "Fast Running Valid"):
+  return get_router_status_entry_v3({
+    'r': "caerSidi%i %s oQZFLYe9e4A7bOkWKR7TaNxb0JE %s 71.35.150.29 9001 0" % (index, IDENTITIES[index], published),
+    's': flags,
+  })
+
+
+def _get_server_descriptor(index, published = "2012-03-01 17:15:27"):
+  fingerprint = " ".join([FINGERPRINTS[index][i:i + 4] for i in range(0, 40, 4)])
+
+  return get_relay_server_descriptor({
+    'router': "caerSidi%i 71.35.133.197 9001 0 0" % index,
+    'published': published,
+    'fingerprint': fingerprint,
+  }, content = True)
+
+
+def _parse(content, descriptor_type, descriptor_filter, **kwargs):
+  return list(stem.descriptor.parse_file(io.BytesIO(content), descriptor_type, descriptor_filter = descriptor_filter, **kwargs))
+
+
+class TestDescriptorFilter(unittest.TestCase):
+  def setUp(self):
+    mock_method(RelayDescriptor, '_validate_content', no_op())
+
+  def tearDown(self):
+    revert_mocking()
+
+  def test_accepts_path(self):
+    """
+    Checks files that are named for when they were made.
+    """
+
+    descriptor_filter = DescriptorFilter(published_after = datetime.datetime(2013, 3, 1, 12))
+
+    self.assertTrue(descriptor_filter.accepts_path("/tmp/consensuses-2013-03.tar.bz2"))
+    self.assertFalse(descriptor_filter.accepts_path("/tmp/consensuses-2013-02.tar.bz2"))
+    self.assertFalse(descriptor_filter.accepts_path("server-descriptors-2012-12.tar.bz2"))
+    self.assertTrue(descriptor_filter.accepts_path("consensuses-2013-03/01/2013-03-01-12-00-00-consensus"))
+    self.assertFalse(descriptor_filter.accepts_path("consensuses-2013-03/01/2013-03-01-11-00-00-consensus"))
+    self.assertFalse(descriptor_filter.accepts_path("2013-03-01-00-00-00-vote-27B6B5996C426270A5C95488AA5BCEB6BCC86956-B7E1E5B50B6E0E1DD7D9F4EC7A8A1F6C6BA9F3E4"))
+
+    # names without a time, or with something that isn't actually a date
+
+    self.assertTrue(descriptor_filter.accepts_path("/home/atagar/.tor/cached-descriptors"))
+    self.assertTrue(descriptor_filter.accepts_path("server-descriptors-2013-03/a/b/ab12cd"))
+    self.assertTrue(descriptor_filter.accepts_path("relay-2013-13"))
+    self.assertTrue(descriptor_filter.accepts_path("2013-02-30-00-00-00-consensus"))
+    self.assertTrue(descriptor_filter.accepts_path(None))
+
+    self.assertTrue(DescriptorFilter().accepts_path("consensuses-2005-12.tar.bz2"))
+
+  def test_accepts_content(self):
+    """
+    Checks descriptor content before it's parsed.
+    """
+
+    entry = _get_entry(0).get_bytes()
+    server_desc = _get_server_descriptor(1)
+    extrainfo_desc = get_relay_extrainfo_descriptor({'extra-info': "ninja %s" % FINGERPRINTS[2]}, content = True)
+
+    self.assertTrue(DescriptorFilter().accepts_content(entry))
+
+    descriptor_filter = DescriptorFilter(fingerprints = FINGERPRINTS[:2])
+    self.assertTrue(descriptor_filter.accepts_content(entry))
+    self.assertTrue(descriptor_filter.accepts_content(server_desc))
+    self.assertFalse(descriptor_filter.accepts_content(extrainfo_desc))
+
+    descriptor_filter = DescriptorFilter(fingerprints = [FINGERPRINTS[2].lower()])
+    self.assertFalse(descriptor_filter.accepts_content(entry))
+    self.assertFalse(descriptor_filter.accepts_content(server_desc))
+    self.assertTrue(descriptor_filter.accepts_content(extrainfo_desc))
+
+    descriptor_filter = DescriptorFilter(published_after = datetime.datetime(2012, 8, 1), published_before = datetime.datetime(2012, 9, 1))
+    self.assertTrue(descriptor_filter.accepts_content(entry))
+    self.assertFalse(descriptor_filter.accepts_content(server_desc))
+    self.assertFalse(descriptor_filter.accepts_content(b"@downloaded-at 2012-08-02 00:00:00\n" + server_desc))
+    self.assertTrue(descriptor_filter.accepts_content(_get_server_descriptor(1, "2012-08-02 00:00:00")))
+
+    descriptor_filter = DescriptorFilter(flags = ["Running", "Guard"])
+    self.assertFalse(descriptor_filter.accepts_content(entry))
+    self.assertTrue(descriptor_filter.accepts_content(_get_entry(0, flags = "Fast Guard Running").get_bytes()))
+
+    # lines we can't read are left for when the descriptor is parsed
+
+    self.assertTrue(descriptor_filter.accepts_content(_get_server_descriptor(1).replace(b"published", b"published nonsense")))
+
+    self.assertRaises(ValueError, DescriptorFilter, fingerprints = ["nonsense"])
+
+  def test_accepts(self):
+    """
+    Checks parsed descriptors.
+    """
+
+    descriptor_filter = DescriptorFilter(
+      published_after = datetime.datetime(2012, 8, 1),
+      fingerprints = FINGERPRINTS[:1],
+      flags = ["Running"],
+    )
+
+    self.assertTrue(descriptor_filter.accepts(_get_entry(0)))
+    self.assertFalse(descriptor_filter.accepts(_get_entry(0, published = "2012-07-31 23:59:59")))
+    self.assertFalse(descriptor_filter.accepts(_get_entry(1)))
+    self.assertFalse(descriptor_filter.accepts(_get_entry(0, flags = "Fast Valid")))
+    self.assertFalse(descriptor_filter.accepts(RelayDescriptor(_get_server_descriptor(0))))
+    self.assertTrue(descriptor_filter.accepts(RelayDescriptor(_get_server_descriptor(0, "2012-08-02 00:00:00"))))
+
+    # microdescriptors lack anything to filter by
+
+    self.assertTrue(descriptor_filter.accepts(get_microdescriptor()))
+
+    # documents are checked by when they became valid
+
+    self.assertTrue(descriptor_filter.accepts(get_network_status_document_v3({'valid-after': "2012-09-02 22:00:00"})))
+    self.assertFalse(descriptor_filter.accepts(get_network_status_document_v3({'valid-after': "2012-07-02 22:00:00"})))
+
+  def test_parse_file(self):
+    """
+    Filters the descriptors of files that we parse, both by ourselves and with
+    workers.
+    """
+
+    content = b"".join([_get_server_descriptor(i, "2012-03-0%i 17:15:27" % (i + 1)) + b"\n" for i in range(3)])
+    descriptor_filter = DescriptorFilter(published_after = datetime.datetime(2012, 3, 2))
+
+    for workers in (None, 2):
+      self.assertEquals(["caerSidi1", "caerSidi2"], [desc.nickname for desc in _parse(content, "server-descriptor 1.0", descriptor_filter, workers = workers)])
+
+    descriptor_filter = DescriptorFilter(fingerprints = FINGERPRINTS[2:], descriptor_types = ["server-descriptor"])
+    self.assertEquals(["caerSidi2"], [desc.nickname for desc in _parse(content, "server-descriptor 1.0", descriptor_filter)])
+    self.assertEquals([], _parse(b"@type server-descriptor 1.0\n" + content, None, DescriptorFilter(descriptor_types = ["extra-info"])))
+
+    # descriptors that we filter out aren't added to our digest set
+
+    with DigestSet(capacity = 100) as seen:
+      self.assertEquals(1, len(_parse(content, "server-descriptor 1.0", descriptor_filter, seen = seen)))
+      self.assertEquals(2, len(_parse(content, "server-descriptor 1.0", None, seen = seen)))
+
+    # router status entries are filtered before they're parsed
+
+    document = get_network_status_document_v3(authorities = (get_directory_authority(is_vote = False),), routers = [_get_entry(i) for i in range(3)], content = True)
+    constructed = []
+
+    def _count_init(self, *args, **kwargs):
+      constructed.append(args[0])
+      return original_init(self, *args, **kwargs)
+
+    original_init = RouterStatusEntryV3.__init__
+    mock_method(RouterStatusEntryV3, '__init__', _count_init)
+
+    entries = _parse(document, "network-status-consensus-3 1.0", DescriptorFilter(fingerprints = FINGERPRINTS[1:2]))
+
+    self.assertEquals([FINGERPRINTS[1]], [entry.fingerprint for entry in entries])
+    self.assertEquals(1, len(constructed))
+
+    entries = _parse(document, "network-status-consensus-3 1.0", DescriptorFilter(flags = ["Guard"]))
+    self.assertEquals([], entries)
@@ -0,0 +1,152 @@
+"""
+Unit tests for stem.descriptor.join.
+"""
+
+import base64
+import binascii
+import unittest
+
+import stem.descriptor.join
+
+from stem.descriptor.join import DescriptorIndex, join
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from test.mocking import no_op, \
+                         mock_method, \
+                         revert_mocking, \
+                         get_relay_server_descriptor, \
+                         get_relay_extrainfo_descriptor, \
+                         get_microdescriptor, \
+                         get_key_certificate, \
+                         get_router_status_entry_v3, \
+                         get_router_status_entry_micro_v3
+
+
+def _to_base64(hex_digest):
+  return base64.b64encode(binascii.unhexlify(hex_digest)).decode('utf-8').rstrip('=')
+
+
+class TestJoin(unittest.TestCase):
+  def setUp(self):
+    mock_method(RelayDescriptor, '_verify_digest', no_op())
+
+  def tearDown(self):
+    revert_mocking()
+
+  def _get_relays(self, count):
+    extrainfo_descriptors, server_descriptors, entries = [], [], []
+
+    for i in range(count):
+      extrainfo_desc = get_relay_extrainfo_descriptor({'extra-info': "ninja%i B2289C3EAB83ECD6EB916A2F481A02E6B76A0A48" % i})
+      server_desc = get_relay_server_descriptor({
+        'router': "caerSidi%i 71.35.133.197 9001 0 0" % i,
+        'extra-info-digest': extrainfo_desc.digest(),
+      })
+
+      entry = get_router_status_entry_v3({'r': "caerSidi%i p1aag7VwarGxqctS7/fS0y5FU+s %s 2012-08-06 11:19:31 71.35.150.29 9001 0" % (i, _to_base64(server_desc.digest()))})
+
+      extrainfo_descriptors.append(extrainfo_desc)
+      server_descriptors.append(server_desc)
+      entries.append(entry)
+
+    return extrainfo_descriptors, server_descriptors, entries
+
+  def test_join(self):
+    """
+    Joins router status entries with the server descriptors and extra-info
+    descriptors they reference.
+    """
+
+    extrainfo_descriptors, server_descriptors, entries = self._get_relays(3)
+
+    # relay without descriptors, and descriptors without an entry
+
+    unknown_entry = get_router_status_entry_v3({'r': "Unknown p1aag7VwarGxqctS7/fS0y5FU+s oQZFLYe9e4A7bOkWKR7TaNxb0JE 2012-08-06 11:19:31 71.35.150.29 9001 0"})
+    unreferenced_desc = get_relay_server_descriptor({'router': "Unreferenced 71.35.133.197 9001 0 0"})
+
+    relays = list(join(entries + [unknown_entry], server_descriptors + extrainfo_descriptors + [unreferenced_desc]))
+    self.assertEquals(4, len(relays))
+
+    for relay, entry, server_desc, extrainfo_desc in zip(relays, entries, server_descriptors, extrainfo_descriptors):
+      self.assertEquals(entry, relay.entry)
+      self.assertEquals(server_desc, relay.server_descriptor)
+      self.assertEquals(extrainfo_desc, relay.extrainfo_descriptor)
+      self.assertEquals(None, relay.microdescriptor)
+
+    self.assertEquals(unknown_entry, relays[3].entry)
+    self.assertEquals(None, relays[3].server_descriptor)
+    self.assertEquals(None, relays[3].extrainfo_descriptor)
+
+    # entries that aren't from a microdescriptor consensus can't reference
+    # microdescriptors, and other types can't be joined at all
+
+    self.assertRaises(ValueError, list, join(entries, [entries[0]]))
+
+  def test_join_microdescriptors(self):
+    """
+    Joins router status entries from a microdescriptor flavored consensus with
+    the microdescriptors they reference.
+    """
+
+    microdescriptors = [get_microdescriptor({'family': "relay%i" % i}) for i in range(3)]
+    entries = [get_router_status_entry_micro_v3({'m': _to_base64(desc.digest)}) for desc in microdescriptors]
+
+    relays = list(join(reversed(entries), microdescriptors, size = 1))
+    self.assertEquals(list(reversed(microdescriptors)), [relay.microdescriptor for relay in relays])
+    self.assertEquals([None] * 3, [relay.server_descriptor for relay in relays])
+
+  def test_descriptor_index(self):
+    """
+    Adds descriptors to an index that's too small to hold all of them in
+    memory.
+    """
+
+    extrainfo_descriptors, server_descriptors, _ = self._get_relays(5)
+
+    with DescriptorIndex(size = 2) as index:
+      self.assertEquals(5, index.add(server_descriptors))
+      self.assertEquals(0, index.add(get_key_certificate()))
+      self.assertEquals(5, len(index))
+
+      for desc in server_descriptors:
+        self.assertTrue(desc.digest() in index)
+        self.assertTrue(desc.digest().lower() in index)
+        self.assertEquals(desc, index.get(desc.digest()))
+
+      self.assertFalse(extrainfo_descriptors[0].digest() in index)
+      self.assertEquals(None, index.get(extrainfo_descriptors[0].digest()))
+      self.assertEquals("default", index.get(None, "default"))
+
+      # re-adding a descriptor doesn't duplicate it
+
+      self.assertEquals(1, index.add(server_descriptors[0]))
+      self.assertEquals(server_descriptors[0], index.get(server_descriptors[0].digest()))
+
+    # spilled descriptors are written to the database in batches
+
+    original_batch_size = stem.descriptor.join.SPILL_BATCH_SIZE
+
+    try:
+      stem.descriptor.join.SPILL_BATCH_SIZE = 2
+
+      with DescriptorIndex(size = 1) as index:
+        index.add(server_descriptors)
+        self.assertTrue(index._connection is not None)
+        self.assertEquals(5, len(index))
+
+        for desc in server_descriptors:
+          self.assertEquals(desc, index.get(desc.digest()))
+    finally:
+      stem.descriptor.join.SPILL_BATCH_SIZE = original_batch_size
+
+    # indexes can be reused when joining several consensuses
+
+    extrainfo_descriptors, server_descriptors, entries = self._get_relays(2)
+
+    with DescriptorIndex() as index:
+      index.add(server_descriptors)
+
+      for _ in range(2):
+        relays = list(join(entries, extrainfo_descriptors, server_descriptors = index))
+        self.assertEquals(server_descriptors, [relay.server_descriptor for relay in relays])
+        self.assertEquals(extrainfo_descriptors, [relay.extrainfo_descriptor for relay in relays])
@@ -858,6 +858,92 @@ class TestNetworkStatusDocument(unittest.TestCase):
     document = NetworkStatusDocumentV3(content, False)
     self.assertEqual([RouterStatusEntryV3(str(entry1), False)], document.routers.values())
 
+  def test_lazy_routers(self):
+    """
+    Parses a document whose router status entries are only parsed when used.
+    """
+
+    entry1 = get_router_status_entry_v3({'s': "Fast"})
+    entry2 = get_router_status_entry_v3({
+      'r': "Nightfae AWt0XNId/OU2xX5xs5hVtDc5Mes 6873oEfM7fFIbxYtwllw9GPDwkA 2013-02-20 11:12:27 85.177.66.233 9001 9030",
+      's': "Valid",
+    })
+
+    content = get_network_status_document_v3(routers = (entry1, entry2), content = True)
+    expected_document = NetworkStatusDocumentV3(content)
+    document = NetworkStatusDocumentV3(content, lazy_routers = True)
+
+    self.assertEqual(expected_document, document)
+    self.assertEqual(expected_document.signatures, document.signatures)
+    self.assertEqual(2, len(document.routers))
+    self.assertEqual(0, len(document.routers._entries))
+
+    self.assertTrue(entry2.fingerprint in document.routers)
+    self.assertFalse("A" * 40 in document.routers)
+    self.assertEqual(0, len(document.routers._entries))
+
+    router = document.routers[entry2.fingerprint]
+    self.assertEqual(entry2, router)
+    self.assertEqual(document, router.document)
+    self.assertTrue(router is document.routers[entry2.fingerprint])
+    self.assertEqual(1, len(document.routers._entries))
+
+    self.assertEqual(expected_document.routers, document.routers)
+    self.assertEqual([entry1.fingerprint, entry2.fingerprint], list(document.routers.keys()))
+
+    document = NetworkStatusDocumentV3(content, lazy_routers = True)
+    document.routers.load()
+    self.assertEqual(2, len(document.routers._entries))
+
+    # malformed entries aren't a problem until they're parsed
+
+    entry3 = RouterStatusEntryV3(get_router_status_entry_v3({
+      'r': "Nightfae AWt0XNId/OU2xX5xs5hVtDc5Mes 6873oEfM7fFIbxYtwllw9GPDwkA 2013-02-20 11:12:27 85.177.66.233 9001 9030",
+      'p': "ugabuga",
+    }, content = True), False)
+
+    content = get_network_status_document_v3(routers = (entry1, entry3), content = True)
+
+    self.assertRaises(ValueError, NetworkStatusDocumentV3, content)
+    document = NetworkStatusDocumentV3(content, lazy_routers = True)
+
+    self.assertEqual(entry1, document.routers[entry1.fingerprint])
+    self.assertRaises(ValueError, document.routers.__getitem__, entry3.fingerprint)
+    self.assertRaises(ValueError, document.routers.load)
+
+    document = NetworkStatusDocumentV3(content, False, lazy_routers = True)
+    self.assertEqual(entry3, document.routers[entry3.fingerprint])
+
+  def test_lazy_routers_of_vote(self):
+    """
+    Parses the router status entries of a lazily loaded vote, whose 'm' lines
+    are only valid within a vote, both by ourselves and with workers.
+    """
+
+    m_line = "8,9,10,11,12 sha256=g1vx9si329muxV3tquWIXXySNOIwRGMeAESKs/v4DWs"
+
+    entry1 = RouterStatusEntryV3(get_router_status_entry_v3({'m': m_line}, content = True), False)
+    entry2 = RouterStatusEntryV3(get_router_status_entry_v3({
+      'r': "Nightfae AWt0XNId/OU2xX5xs5hVtDc5Mes 6873oEfM7fFIbxYtwllw9GPDwkA 2013-02-20 11:12:27 85.177.66.233 9001 9030",
+      'm': m_line,
+    }, content = True), False)
+
+    content = get_network_status_document_v3({'vote-status': 'vote'}, authorities = (get_directory_authority(is_vote = True),), routers = (entry1, entry2), content = True)
+    expected_document = NetworkStatusDocumentV3(content)
+    expected_hashes = [router.microdescriptor_hashes for router in expected_document.routers.values()]
+    self.assertEqual([[([8, 9, 10, 11, 12], {'sha256': 'g1vx9si329muxV3tquWIXXySNOIwRGMeAESKs/v4DWs'})]] * 2, expected_hashes)
+
+    for validate in (True, False):
+      for workers in (None, 2):
+        document = NetworkStatusDocumentV3(content, validate, lazy_routers = True)
+        document.routers.load(workers = workers)
+
+        self.assertEqual(expected_document.routers, dict(document.routers))
+        self.assertEqual(expected_hashes, [router.microdescriptor_hashes for router in document.routers.values()])
+
+        for router in document.routers.values():
+          self.assertEqual(document, router.document)
+
   def test_with_directory_authorities(self):
     """
     Includes a couple directory authorities in the document.
@@ -3,6 +3,8 @@ Unit tests for stem.descriptor.reader.
 """
 
 import StringIO
+import threading
+import time
 import unittest
 
 import stem.descriptor.reader
@@ -51,6 +53,37 @@ class TestDescriptorReader(unittest.TestCase):
     _mock_open("\n".join(test_lines))
     self.assertEquals(expected_value, stem.descriptor.reader.load_processed_files(""))
 
+  def test_load_file_positions(self):
+    """
+    Loads a listing with how far we've read some of the files.
+    """
+
+    digest = "A7569A83B5706AB1B1A9CB52EFF7D2D32E4553EB"
+
+    test_lines = (
+      "/dir/file 12345",
+      "/dir/cached-microdescs.new 12345 2048 %s" % digest,
+      "/dir/file with spaces 12345 2048 %s" % digest.lower(),
+      "/dir/file 1 2 12345",
+      "/dir/cached-extrainfo.new 12345 2048 %s 512" % digest,
+    )
+
+    _mock_open("\n".join(test_lines))
+    self.assertEquals({
+      "/dir/cached-microdescs.new": (2048, digest, 0),
+      "/dir/file with spaces": (2048, digest, 0),
+      "/dir/cached-extrainfo.new": (2048, digest, 512),
+    }, stem.descriptor.reader.load_file_positions(""))
+
+    _mock_open("\n".join(test_lines))
+    self.assertEquals({
+      "/dir/file": 12345,
+      "/dir/cached-microdescs.new": 12345,
+      "/dir/file with spaces": 12345,
+      "/dir/file 1 2": 12345,
+      "/dir/cached-extrainfo.new": 12345,
+    }, stem.descriptor.reader.load_processed_files(""))
+
   def test_load_processed_files_empty(self):
     """
     Tests the load_processed_files() function with an empty file.
@@ -94,3 +127,135 @@ class TestDescriptorReader(unittest.TestCase):
 
     _mock_open("/dir/file 123a")
     self.assertRaises(TypeError, stem.descriptor.reader.load_processed_files, "")
+
+  def test_descriptor_buffer(self):
+    """
+    Fills a buffer that's limited by both its number of descriptors and their
+    size, checking that a descriptor larger than our limit is still accepted
+    once we're empty.
+    """
+
+    small_desc = mocking.get_microdescriptor()
+    large_desc = mocking.get_microdescriptor({"family": " ".join(["relay%i" % i for i in range(50)])})
+
+    small_size, large_size = len(small_desc.get_bytes()), len(large_desc.get_bytes())
+    desc_buffer = stem.descriptor.reader._DescriptorBuffer(3, small_size * 2)
+
+    desc_buffer.put([small_desc, small_desc])
+    self.assertEquals(2, desc_buffer.qsize())
+    self.assertEquals(small_size * 2, desc_buffer.get_bytes())
+
+    # we're at our byte limit, so putting another would need to wait
+
+    self.assertTrue(desc_buffer._is_full(1, small_size))
+    self.assertEquals([small_desc, small_desc], desc_buffer.get_batch())
+
+    # batches that the iterator has taken count against us until it's done
+    # with them
+
+    self.assertTrue(desc_buffer._is_full(1, small_size))
+    desc_buffer.release()
+    self.assertFalse(desc_buffer._is_full(1, small_size))
+    self.assertTrue(desc_buffer._is_full(1, large_size))
+
+    # descriptors larger than our limit are accepted once we're empty
+
+    desc_buffer.put([small_desc])
+
+    putter = threading.Thread(target = desc_buffer.put, args = ([large_desc],))
+    putter.start()
+    putter.join(0.05)
+    self.assertTrue(putter.is_alive())
+
+    self.assertEquals([small_desc], desc_buffer.get_batch())
+    self.assertEquals([large_desc], desc_buffer.get_batch())
+    putter.join()
+
+    self.assertEquals(1, desc_buffer.qsize())
+    self.assertEquals(large_size, desc_buffer.get_bytes())
+    desc_buffer.release()
+    self.assertEquals(0, desc_buffer.get_bytes())
+
+    # the count is also limited, and our FINISHED flag has no size
+
+    desc_buffer = stem.descriptor.reader._DescriptorBuffer(2)
+
+    desc_buffer.put([small_desc, stem.descriptor.reader.FINISHED])
+    self.assertEquals(small_size, desc_buffer.get_bytes())
+    self.assertTrue(desc_buffer._is_full(1, 0))
+
+  def test_descriptor_buffer_batches(self):
+    """
+    Adds descriptors through the batches of our reader thread. These are sized
+    by how quickly we're reading descriptors.
+    """
+
+    desc = mocking.get_microdescriptor()
+    current_time = [100.0]
+    mocking.mock(time.time, lambda: current_time[0], time)
+
+    # descriptors are handed over right away until we know how quickly we're
+    # reading them
+
+    desc_buffer = stem.descriptor.reader._DescriptorBuffer(6)
+    desc_buffer.add(desc)
+    self.assertEquals(1, desc_buffer.qsize())
+
+    # when reading quickly batches are limited to half our buffer size
+
+    desc_buffer = stem.descriptor.reader._DescriptorBuffer(6)
+    desc_buffer._interval = 0
+
+    for _ in range(5):
+      desc_buffer.add(desc)
+
+    self.assertEquals(3, desc_buffer.qsize())
+    desc_buffer.flush()
+    self.assertEquals(5, desc_buffer.qsize())
+    self.assertEquals([desc] * 5, desc_buffer.get_batch())
+    desc_buffer.release()
+
+    # batches are handed over once they're held for our latency
+
+    desc_buffer.add(desc)
+    self.assertEquals(0, desc_buffer.qsize())
+
+    current_time[0] += stem.descriptor.reader.BATCH_LATENCY * 2
+    desc_buffer.add(desc)
+    self.assertEquals(2, desc_buffer.qsize())
+
+    # descriptors that are slow to read are handed over on their own
+
+    desc_buffer = stem.descriptor.reader._DescriptorBuffer(6)
+
+    for _ in range(3):
+      current_time[0] += 1
+      desc_buffer.add(desc)
+      self.assertEquals([desc], desc_buffer.get_batch())
+
+    # waking provides an empty batch if we don't have anything
+
+    desc_buffer.wake()
+    self.assertEquals([], desc_buffer.get_batch())
+
+    # clearing discards everything, including the batch we're filling
+
+    desc_buffer._interval = 0
+    desc_buffer.add(desc)
+    desc_buffer.put([desc])
+    desc_buffer.clear()
+
+    self.assertEquals(0, desc_buffer.qsize())
+    self.assertEquals(0, desc_buffer.get_bytes())
+    desc_buffer.flush()
+    self.assertEquals(0, desc_buffer.qsize())
+
+    # batches are also limited by half our byte limit
+
+    desc_buffer = stem.descriptor.reader._DescriptorBuffer(0, len(desc.get_bytes()) * 4)
+    desc_buffer._interval = 0
+
+    for _ in range(3):
+      desc_buffer.add(desc)
+
+    self.assertEquals(2, desc_buffer.qsize())
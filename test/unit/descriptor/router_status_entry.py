@@ -147,6 +147,37 @@ class TestRouterStatusEntry(unittest.TestCase):
     entry = RouterStatusEntryV3(content)
     self.assertEqual("Tor 0.2.2.35", entry.version_line)
 
+  def test_common_format(self):
+    """
+    Entries in the common format are parsed the same way as ones that need our
+    generic parser.
+    """
+
+    content = get_router_status_entry_v3({'v': 'Tor 0.2.2.35', 'p': 'accept 80,443'}, content = True)
+
+    # leading 'opt' keywords are only handled by the generic parser
+
+    generic_content = content.replace(b"\nv ", b"\nopt v ")
+
+    entry = RouterStatusEntryV3(content)
+    generic_entry = RouterStatusEntryV3(generic_content)
+
+    for attr in ('nickname', 'fingerprint', 'digest', 'published', 'address', 'or_port', 'dir_port', 'flags', 'version', 'version_line', 'exit_policy'):
+      self.assertEquals(getattr(generic_entry, attr), getattr(entry, attr))
+
+    self.assertEquals([], entry.get_unrecognized_lines())
+
+    # entries with the same lines share their versions and policies
+
+    other_entry = RouterStatusEntryV3(content)
+    self.assertTrue(entry.version is other_entry.version)
+    self.assertTrue(entry.exit_policy is other_entry.exit_policy)
+
+    # flags are copied so modifying one entry's doesn't affect the others
+
+    entry.flags.append('Unicorn')
+    self.assertEquals([Flag.FAST, Flag.NAMED, Flag.RUNNING, Flag.STABLE, Flag.VALID], other_entry.flags)
+
   def test_duplicate_lines(self):
     """
     Duplicates linesin the entry.
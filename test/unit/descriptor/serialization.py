@@ -0,0 +1,148 @@
+"""
+Unit tests for stem.descriptor.serialization.
+"""
+
+import io
+import marshal
+import unittest
+import zlib
+
+import stem.descriptor.serialization
+
+from stem.descriptor.microdescriptor import Microdescriptor
+from stem.descriptor.server_descriptor import RelayDescriptor
+
+from test.mocking import no_op, \
+                         mock_method, \
+                         revert_mocking, \
+                         get_relay_server_descriptor, \
+                         get_bridge_server_descriptor, \
+                         get_relay_extrainfo_descriptor, \
+                         get_bridge_extrainfo_descriptor, \
+                         get_microdescriptor, \
+                         get_router_status_entry_v2, \
+                         get_router_status_entry_v3, \
+                         get_router_status_entry_micro_v3, \
+                         get_network_status_document_v3
+
+
+def _get_descriptors():
+  return [
+    get_relay_server_descriptor({'family': '$A $B', 'or-address': '[2001:db8::ff00:42]:8080'}),
+    get_bridge_server_descriptor(),
+    get_relay_extrainfo_descriptor({'read-history': '2012-05-03 12:07:50 (900 s) 3,2,1', 'dirreq-v3-resp': 'ok=25,not-found=0'}),
+    get_bridge_extrainfo_descriptor(),
+    get_microdescriptor({'p': 'accept 80,443'}),
+    get_router_status_entry_v2(),
+    get_router_status_entry_v3({'v': 'Tor 0.2.2.35', 'p': 'accept 80,443'}),
+    get_router_status_entry_micro_v3(),
+  ]
+
+
+class TestSerialization(unittest.TestCase):
+  def setUp(self):
+    mock_method(RelayDescriptor, '_verify_digest', no_op())
+
+  def tearDown(self):
+    revert_mocking()
+
+  def test_round_trip(self):
+    """
+    Serializes each type of descriptor we support, checking that we get back
+    the same attributes.
+    """
+
+    for desc in _get_descriptors():
+      content = desc.to_bytes()
+      loaded_desc = type(desc).from_bytes(content)
+
+      self.assertEquals(type(desc), type(loaded_desc))
+      self.assertEquals(vars(desc), vars(loaded_desc))
+      self.assertEquals(str(desc), str(loaded_desc))
+
+  def test_document_reference(self):
+    """
+    Serializes a router status entry that belongs to a document, which isn't
+    retained.
+    """
+
+    document = get_network_status_document_v3(routers = (get_router_status_entry_v3(),))
+    entry = document.routers.values()[0]
+    self.assertEquals(document, entry.document)
+
+    loaded_entry = type(entry).from_bytes(entry.to_bytes())
+    self.assertEquals(None, loaded_entry.document)
+    self.assertEquals(entry.fingerprint, loaded_entry.fingerprint)
+
+  def test_wrong_type(self):
+    """
+    Loads a descriptor with a class that it isn't an instance of.
+    """
+
+    content = get_relay_server_descriptor().to_bytes()
+    self.assertRaises(ValueError, Microdescriptor.from_bytes, content)
+
+  def test_unsupported_type(self):
+    """
+    Serializes a descriptor that we don't support.
+    """
+
+    self.assertRaises(ValueError, get_network_status_document_v3().to_bytes)
+
+  def test_unsupported_attribute(self):
+    """
+    Serializes a descriptor with an attribute of a type we don't handle, and
+    loads records with value types we don't recognize. We only construct the
+    types that descriptors use, so these shouldn't be pickled.
+    """
+
+    desc = get_microdescriptor()
+    desc.unsupported = object()
+    self.assertRaises(ValueError, desc.to_bytes)
+
+    for value in ((99, b"cos\nsystem\n(S'echo hi'\ntR."), (stem.descriptor.serialization.ARRAY, b"nonsense")):
+      content = zlib.compress(marshal.dumps({'onion_key': value}, 2))
+      record = stem.descriptor.serialization.RECORD_HEADER.pack(1, 5, len(content)) + content
+      self.assertRaises(ValueError, stem.descriptor.serialization.deserialize, record)
+
+  def test_malformed_content(self):
+    """
+    Loads content that isn't a valid record.
+    """
+
+    content = get_microdescriptor().to_bytes()
+
+    test_inputs = (
+      b"",
+      content[:4],
+      content[:-1],
+      content + b"\x00",
+      b"\x02" + content[1:],  # unrecognized format version
+      content[:1] + b"\xff" + content[2:],  # unrecognized descriptor type
+      content[:6] + b"\x00" * (len(content) - 6),  # invalid content
+    )
+
+    for test_input in test_inputs:
+      self.assertRaises(ValueError, stem.descriptor.serialization.deserialize, test_input)
+
+  def test_file(self):
+    """
+    Writes descriptors to a file and reads them back.
+    """
+
+    descriptors = _get_descriptors()
+    output_file = io.BytesIO()
+
+    self.assertEquals(len(descriptors), stem.descriptor.serialization.write_descriptors(output_file, iter(descriptors)))
+
+    input_file = io.BytesIO(output_file.getvalue())
+    loaded_descriptors = list(stem.descriptor.serialization.read_descriptors(input_file))
+    self.assertEquals([str(desc) for desc in descriptors], [str(desc) for desc in loaded_descriptors])
+
+    # truncated files or ones without our header are malformed
+
+    input_file = io.BytesIO(output_file.getvalue()[:-1])
+    self.assertRaises(ValueError, list, stem.descriptor.serialization.read_descriptors(input_file))
+
+    input_file = io.BytesIO(output_file.getvalue()[1:])
+    self.assertRaises(ValueError, list, stem.descriptor.serialization.read_descriptors(input_file))
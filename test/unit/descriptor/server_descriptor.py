@@ -6,6 +6,7 @@ import datetime
 import io
 import unittest
 
+import stem.descriptor
 import stem.descriptor.server_descriptor
 import stem.exit_policy
 import stem.prereq
@@ -143,6 +144,33 @@ class TestServerDescriptor(unittest.TestCase):
     desc = RelayDescriptor(desc_text, validate = False)
     self.assertEquals(b"", desc.platform)
 
+  def test_bytes_fields(self):
+    """
+    Constructs with platform and contact lines that are utf-8 and that can't be
+    decoded.
+    """
+
+    desc_text = get_relay_server_descriptor({"platform": "Tor 0.2.1.30 on Linux x86_64", "contact": "<contact>"}, content = True)
+
+    desc = RelayDescriptor(desc_text.replace(b"<contact>", b"Damian \xc3\xa9"), validate = False)
+    self.assertEquals(b"Damian \xc3\xa9", desc.contact)
+
+    desc = RelayDescriptor(desc_text.replace(b"<contact>", b"Damian \xff\xfe"), validate = False)
+    self.assertEquals(b"Damian \xff\xfe", desc.contact)
+    self.assertEquals(b"Tor 0.2.1.30 on Linux x86_64", desc.platform)
+
+  def test_read_text_mode_file(self):
+    """
+    Reads non-ascii content up to a keyword from a text mode file, where
+    positions aren't in bytes.
+    """
+
+    content = b"contact Damian \xc3\xa9\xc3\xa9\nrouter caerSidi 71.35.133.197 9001 0 0\n"
+
+    with io.TextIOWrapper(io.BytesIO(content), encoding = 'utf-8') as descriptor_file:
+      self.assertEquals([u"contact Damian \xe9\xe9\n"], stem.descriptor._read_until_keywords("router", descriptor_file))
+      self.assertEquals(u"router caerSidi 71.35.133.197 9001 0 0\n", descriptor_file.readline())
+
   def test_protocols_no_circuit_versions(self):
     """
     Constructs with a protocols line without circuit versions.
@@ -193,7 +221,7 @@ class TestServerDescriptor(unittest.TestCase):
 
       self.assertEquals(expected_end, attr[0])
       self.assertEquals(900, attr[1])
-      self.assertEquals(expected_values, attr[2])
+      self.assertEquals(expected_values, list(attr[2]))
 
   def test_read_history_empty(self):
     """
@@ -204,7 +232,7 @@ class TestServerDescriptor(unittest.TestCase):
     desc = get_relay_server_descriptor({"opt read-history": value})
     self.assertEquals(datetime.datetime(2005, 12, 17, 1, 23, 11), desc.read_history_end)
     self.assertEquals(900, desc.read_history_interval)
-    self.assertEquals([], desc.read_history_values)
+    self.assertEquals([], list(desc.read_history_values))
 
   def test_annotations(self):
     """
@@ -0,0 +1,154 @@
+"""
+Unit tests for stem.descriptor.store.
+"""
+
+import base64
+import binascii
+import datetime
+import unittest
+
+import stem.descriptor.store
+
+from stem.descriptor.microdescriptor import Microdescriptor
+from stem.descriptor.router_status_entry import RouterStatusEntryV3
+from stem.descriptor.server_descriptor import RelayDescriptor
+from stem.descriptor.store import DescriptorStore
+
+from test.mocking import no_op, \
+                         mock_method, \
+                         revert_mocking, \
+                         get_relay_server_descriptor, \
+                         get_microdescriptor, \
+                         get_router_status_entry_v3, \
+                         get_network_status_document_v3, \
+                         get_directory_authority
+
+FINGERPRINT = "A7569A83B5706AB1B1A9CB52EFF7D2D32E4553EB"
+
+
+def _get_consensus_entries(valid_after, flags):
+  entry = get_router_status_entry_v3({'s': flags})
+
+  document = get_network_status_document_v3(
+    {'valid-after': valid_after},
+    authorities = (get_directory_authority(is_vote = False),),
+    routers = (entry,),
+  )
+
+  return list(document.routers.values())
+
+
+class TestDescriptorStore(unittest.TestCase):
+  def setUp(self):
+    mock_method(RelayDescriptor, '_verify_digest', no_op())
+    self.store = DescriptorStore()
+
+  def tearDown(self):
+    self.store.close()
+    revert_mocking()
+
+  def test_add(self):
+    """
+    Adds descriptors, skipping ones that the store already has.
+    """
+
+    descriptors = [
+      get_relay_server_descriptor(),
+      get_microdescriptor(),
+    ]
+
+    self.assertEquals(2, self.store.add(descriptors))
+    self.assertEquals(0, self.store.add(descriptors))
+    self.assertEquals(2, len(self.store))
+
+    # counts span our batches, and only include descriptors we didn't have
+
+    original_batch_size = stem.descriptor.store.STORE_BATCH_SIZE
+
+    try:
+      stem.descriptor.store.STORE_BATCH_SIZE = 1
+      self.assertEquals(1, self.store.add(descriptors + [get_microdescriptor({'family': 'relay1'})]))
+      self.assertEquals(3, len(self.store))
+    finally:
+      stem.descriptor.store.STORE_BATCH_SIZE = original_batch_size
+
+    self.assertRaises(ValueError, self.store.add, [get_network_status_document_v3()])
+    self.assertEquals(3, len(self.store))
+
+  def test_get(self):
+    """
+    Looks up descriptors by their digest.
+    """
+
+    server_desc = get_relay_server_descriptor()
+    microdescriptor = get_microdescriptor()
+    self.store.add([server_desc, microdescriptor])
+
+    loaded_desc = self.store.get(server_desc.digest())
+    self.assertTrue(isinstance(loaded_desc, RelayDescriptor))
+    self.assertEquals(str(server_desc), str(loaded_desc))
+    self.assertEquals(server_desc.nickname, loaded_desc.nickname)
+
+    loaded_desc = self.store.get(microdescriptor.digest, Microdescriptor)
+    self.assertEquals(str(microdescriptor), str(loaded_desc))
+
+    self.assertEquals(None, self.store.get(microdescriptor.digest, RelayDescriptor))
+    self.assertEquals(None, self.store.get("0" * 40))
+
+    # router status entries have the digest of the server descriptor they
+    # reference, so they're only provided when asked for
+
+    identity = base64.b64encode(binascii.unhexlify(server_desc.digest())).rstrip(b"=").decode('utf-8')
+    entry = get_router_status_entry_v3({'r': "caerSidi p1aag7VwarGxqctS7/fS0y5FU+s %s 2012-01-01 00:00:00 71.35.150.29 9001 0" % identity})
+
+    document = get_network_status_document_v3(
+      {'valid-after': "2012-01-01 00:00:00"},
+      authorities = (get_directory_authority(is_vote = False),),
+      routers = (entry,),
+    )
+
+    self.assertEquals(1, self.store.add(document.routers.values()))
+    self.assertEquals(server_desc.digest(), list(document.routers.values())[0].digest)
+    self.assertTrue(isinstance(self.store.get(server_desc.digest()), RelayDescriptor))
+    self.assertTrue(isinstance(self.store.get(server_desc.digest(), RouterStatusEntryV3), RouterStatusEntryV3))
+    self.assertEquals(2, len(list(self.store.query(digest = server_desc.digest()))))
+
+  def test_get_at(self):
+    """
+    Provides the router status entry a relay had at various times.
+    """
+
+    self.store.add(_get_consensus_entries("2012-09-02 22:00:00", "Fast"))
+    self.store.add(_get_consensus_entries("2012-09-02 23:00:00", "Fast Stable"))
+
+    entry = self.store.get_at(FINGERPRINT, datetime.datetime(2012, 9, 2, 22, 30), RouterStatusEntryV3)
+    self.assertEquals(["Fast"], entry.flags)
+
+    entry = self.store.get_at(FINGERPRINT, datetime.datetime(2012, 9, 3), RouterStatusEntryV3)
+    self.assertEquals(["Fast", "Stable"], entry.flags)
+
+    self.assertEquals(None, self.store.get_at(FINGERPRINT, datetime.datetime(2012, 9, 1)))
+
+  def test_query(self):
+    """
+    Queries for descriptors by various criteria.
+    """
+
+    self.store.add(_get_consensus_entries("2012-09-02 22:00:00", "Fast"))
+    self.store.add(_get_consensus_entries("2012-09-02 23:00:00", "Fast Stable"))
+    self.store.add([get_relay_server_descriptor()])
+
+    self.assertEquals(3, len(list(self.store.query())))
+    self.assertEquals(2, len(list(self.store.query(RouterStatusEntryV3))))
+    self.assertEquals(2, len(list(self.store.query(flag = "Fast"))))
+    self.assertEquals(1, len(list(self.store.query(flag = "Stable"))))
+    self.assertEquals(0, len(list(self.store.query(flag = "Exit"))))
+    self.assertEquals(1, len(list(self.store.query(address = "71.35.133.197"))))
+    self.assertEquals(1, len(list(self.store.query(limit = 1))))
+
+    entries = list(self.store.query(fingerprint = FINGERPRINT, start = datetime.datetime(2012, 9, 2, 22, 30)))
+    self.assertEquals(1, len(entries))
+    self.assertEquals(["Fast", "Stable"], entries[0].flags)
+
+    flags = [entry.flags for entry in self.store.query(RouterStatusEntryV3, newest_first = True)]
+    self.assertEquals([["Fast", "Stable"], ["Fast"]], flags)
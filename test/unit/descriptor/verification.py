@@ -0,0 +1,173 @@
+"""
+Unit tests for stem.descriptor.verification.
+"""
+
+import base64
+import datetime
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import stem.prereq
+import test.runner
+
+from stem.descriptor.networkstatus import KeyCertificate, NetworkStatusDocumentV3
+
+from test.mocking import get_key_certificate, \
+                         get_network_status_document_v3, \
+                         get_directory_authority
+
+if stem.prereq.is_crypto_available():
+  from stem.descriptor.verification import SignatureStatus, KeyCache, verify_signatures, verify_files
+
+IDENTITY = "27B6B5996C426270A5C95488AA5BCEB6BCC86956"
+
+
+def _public_key(key):
+  from Crypto.Util import asn1
+
+  seq = asn1.DerSequence()
+  seq.append(key.n)
+  seq.append(key.e)
+  key_der = seq.encode()
+
+  return key_der, "\n-----BEGIN RSA PUBLIC KEY-----\n%s\n-----END RSA PUBLIC KEY-----" % _wrap(base64.b64encode(key_der))
+
+
+def _sign(key, content):
+  from Crypto.Util.number import bytes_to_long, long_to_bytes
+
+  digest = hashlib.sha1(content).digest()
+  padded = b'\x00\x01' + b'\xff' * (125 - len(digest)) + b'\x00' + digest
+  signature = long_to_bytes(pow(bytes_to_long(padded), key.d, key.n), 128)
+
+  return "-----BEGIN SIGNATURE-----\n%s\n-----END SIGNATURE-----" % _wrap(base64.b64encode(signature))
+
+
+def _wrap(content):
+  return "\n".join([content[i:i + 64] for i in range(0, len(content), 64)])
+
+
+class TestVerification(unittest.TestCase):
+  def setUp(self):
+    if not stem.prereq.is_crypto_available():
+      return
+
+    from Crypto.PublicKey import RSA
+
+    self.identity_key = RSA.generate(1024)
+    self.signing_key = RSA.generate(1024)
+
+    identity_der, identity_pem = _public_key(self.identity_key)
+    signing_der, signing_pem = _public_key(self.signing_key)
+
+    self.fingerprint = hashlib.sha1(identity_der).hexdigest().upper()
+    self.key_digest = hashlib.sha1(signing_der).hexdigest().upper()
+
+    cert_content = get_key_certificate({
+      'fingerprint': self.fingerprint,
+      'dir-identity-key': identity_pem,
+      'dir-signing-key': signing_pem,
+    }, content = True)
+
+    # our mocking puts a space after keywords that are followed by a block
+
+    cert_content = cert_content.replace(b" \n-----BEGIN", b"\n-----BEGIN")
+    signed_end = cert_content.find(b"\ndir-key-certification\n") + len(b"\ndir-key-certification\n")
+    self.cert = KeyCertificate(cert_content[:signed_end] + _sign(self.identity_key, cert_content[:signed_end]))
+
+  def _get_document(self, valid_after = "2012-09-02 22:00:00", sign = True):
+    content = get_network_status_document_v3({
+      'valid-after': valid_after,
+      'directory-signature': "%s %s\n-----BEGIN SIGNATURE-----\n-----END SIGNATURE-----" % (self.fingerprint, self.key_digest),
+    }, authorities = (get_directory_authority(is_vote = False),), content = True)
+
+    signed_end = content.find(b"\ndirectory-signature ") + len(b"\ndirectory-signature ")
+    signature_start = content.find(b"-----BEGIN SIGNATURE-----", signed_end)
+
+    if sign:
+      signature = _sign(self.signing_key, content[:signed_end])
+    else:
+      signature = _sign(self.signing_key, b"something else")
+
+    return NetworkStatusDocumentV3(content[:signature_start] + signature)
+
+  def test_verify_signatures(self):
+    """
+    Checks valid and invalid document signatures.
+    """
+
+    if not stem.prereq.is_crypto_available():
+      test.runner.skip(self, "(requires pycrypto)")
+      return
+
+    keys = KeyCache([self.cert])
+    self.assertEquals(1, len(keys))
+    self.assertEquals(0, keys.add([self.cert]))
+
+    self.assertEquals({self.fingerprint: SignatureStatus.VALID}, verify_signatures(self._get_document(), keys))
+    self.assertEquals({self.fingerprint: SignatureStatus.INVALID}, verify_signatures(self._get_document(sign = False), keys))
+    self.assertEquals({self.fingerprint: SignatureStatus.EXPIRED_KEY}, verify_signatures(self._get_document("2013-01-01 00:00:00"), keys))
+    self.assertEquals({self.fingerprint: SignatureStatus.UNKNOWN_KEY}, verify_signatures(self._get_document(), KeyCache()))
+
+  def test_key_cache(self):
+    """
+    Adds and expires key certificates.
+    """
+
+    if not stem.prereq.is_crypto_available():
+      test.runner.skip(self, "(requires pycrypto)")
+      return
+
+    keys = KeyCache([self.cert])
+
+    key = keys.get(self.fingerprint.lower(), self.key_digest)
+    self.assertEquals(self.signing_key.n, key.modulus)
+    self.assertEquals(datetime.datetime(2012, 11, 28, 21, 51, 4), key.expires)
+    self.assertTrue(key.is_valid_at(datetime.datetime(2012, 1, 1)))
+    self.assertFalse(key.is_valid_at(datetime.datetime(2013, 1, 1)))
+
+    self.assertEquals(0, keys.remove_expired(datetime.datetime(2012, 1, 1)))
+    self.assertEquals(1, keys.remove_expired(datetime.datetime(2013, 1, 1)))
+    self.assertEquals(None, keys.get(self.fingerprint, self.key_digest))
+
+    # certificates that weren't made by the identity key they claim
+
+    self.assertRaises(ValueError, KeyCache, [get_key_certificate({'fingerprint': IDENTITY})])
+    self.assertRaises(ValueError, KeyCache, [KeyCertificate(self.cert.get_bytes().replace(b"2012-11-28", b"2013-11-28"))])
+    self.assertEquals(1, len(KeyCache([KeyCertificate(self.cert.get_bytes().replace(b"2012-11-28", b"2013-11-28"))], False)))
+
+  def test_verify_files(self):
+    """
+    Checks the signatures of documents on disk.
+    """
+
+    if not stem.prereq.is_crypto_available():
+      test.runner.skip(self, "(requires pycrypto)")
+      return
+
+    keys = KeyCache([self.cert])
+    tmp_dir = tempfile.mkdtemp()
+
+    try:
+      paths = []
+
+      for index, sign in enumerate((True, False, True)):
+        path = os.path.join(tmp_dir, "consensus-%i" % index)
+        paths.append(path)
+
+        with open(path, 'wb') as document_file:
+          document_file.write(b"@type network-status-consensus-3 1.0\n" + self._get_document(sign = sign).get_bytes())
+
+      expected = [
+        (paths[0], {self.fingerprint: SignatureStatus.VALID}),
+        (paths[1], {self.fingerprint: SignatureStatus.INVALID}),
+        (paths[2], {self.fingerprint: SignatureStatus.VALID}),
+      ]
+
+      self.assertEquals(expected, list(verify_files(paths, keys)))
+      self.assertEquals(expected, list(verify_files(paths, keys, workers = 2)))
+    finally:
+      shutil.rmtree(tmp_dir)
@@ -2,6 +2,7 @@
 Unit tests for the stem.exit_policy.ExitPolicy class.
 """
 
+import pickle
 import unittest
 
 from stem.exit_policy import get_config_policy, \
@@ -136,6 +137,23 @@ class TestExitPolicy(unittest.TestCase):
     self.assertEquals(rules, list(ExitPolicy(*rules)))
     self.assertEquals(rules, list(ExitPolicy('accept *:80', 'accept *:443', 'reject *:*')))
 
+  def test_pickle(self):
+    # policies should survive pickling, including ones that haven't been parsed
+
+    policy = ExitPolicy('accept *:80', 'accept *:443', 'reject *:*')
+    self.assertEquals(policy, pickle.loads(pickle.dumps(policy)))
+
+    policy = ExitPolicy(ExitPolicyRule('accept *:80'), ExitPolicyRule('reject *:*'))
+    self.assertEquals(policy, pickle.loads(pickle.dumps(policy)))
+
+    policy = ExitPolicy('reject *:80')
+    policy._set_default_allowed(False)
+    self.assertFalse(pickle.loads(pickle.dumps(policy)).is_exiting_allowed())
+
+    policy = MicroExitPolicy('accept 80,443')
+    self.assertEquals(policy, pickle.loads(pickle.dumps(policy)))
+    self.assertTrue(pickle.loads(pickle.dumps(policy)).can_exit_to('127.0.0.1', 443))
+
   def test_microdescriptor_parsing(self):
     # mapping between inputs and if they should succeed or not
     test_inputs = {
@@ -151,3 +151,34 @@ class TestStrTools(unittest.TestCase):
 
     for arg in invalid_input:
       self.assertRaises(ValueError, str_tools._parse_iso_timestamp, arg)
+
+  def test_parse_timestamp(self):
+    """
+    Checks the _parse_timestamp() function.
+    """
+
+    test_inputs = {
+      '2012-11-08 16:48:41': (datetime.datetime(2012, 11, 8, 16, 48, 41), 1352393321),
+      '1970-01-01 00:00:00': (datetime.datetime(1970, 1, 1, 0, 0, 0), 0),
+      '2012-2-29 1:02:03': (datetime.datetime(2012, 2, 29, 1, 2, 3), 1330477323),
+    }
+
+    for arg, (expected, expected_epoch) in test_inputs.items():
+      self.assertEqual(expected, str_tools._parse_timestamp(arg))
+      self.assertEqual(expected_epoch, str_tools._parse_timestamp(arg, True))
+      self.assertEqual(expected, datetime.datetime.strptime(arg, "%Y-%m-%d %H:%M:%S"))
+
+    invalid_input = [
+      'hello world',
+      '2012-11-08T16:48:41',
+      '2012-11-08 16:48',
+      '2012-13-08 16:48:41',
+      '2013-02-29 16:48:41',
+      '2012-11-08 16:48:61',
+      '2012-11-08 +6:48:41',
+      ' 2012-11-08 16:48:41',
+    ]
+
+    for arg in invalid_input:
+      self.assertRaises(ValueError, str_tools._parse_timestamp, arg)
+      self.assertRaises(ValueError, datetime.datetime.strptime, arg, "%Y-%m-%d %H:%M:%S")